@@ -17,14 +17,20 @@
 
 from __future__ import annotations
 
+import functools
 import logging
 import re
-from typing import Optional
+from typing import Iterable, Optional, Sequence
 
 import attr
 import giturlparse
 
-from pelorus.utils import collect_bad_attribute_path_error, get_nested
+from pelorus.utils import (
+    BadAttributePathError,
+    collect_bad_attribute_path_error,
+    get_nested,
+    split_path,
+)
 
 DEFAULT_PROVIDER = "git"
 PROVIDER_TYPES = {"git", "image"}
@@ -33,6 +39,112 @@ GIT_PROVIDER_TYPES = {"github", "bitbucket", "gitea", "azure-devops", "gitlab"}
 SUPPORTED_PROTOCOLS = {"http", "https", "ssh", "git"}
 
 
+# Parsing is memoized, since many builds share few repositories.
+REPO_URL_CACHE_SIZE = 1024
+
+# http://user@dev.azure.com:8080/organization/project/_git/repository/
+_AZURE_HTTP_URL = re.compile(
+    r"^(?P<protocol>https?)\://"
+    r"((?P<user>[a-zA-Z0-9_-]+)@)?"
+    r"(?P<resource>[a-z0-9_.-]*)"
+    r"[:/]*"
+    r"(?P<port>[\d]+){0,1}"
+    r"(?P<pathname>\/"
+    r"(?P<owner>[\w\-\.]+)\/"
+    r"(?P<azure_project>[\w\-\.]+)\/\_git\/"
+    r"(?P<name>[\w\-\.]+)\/?)$"
+)
+# git@ssh.dev.azure.com:v3/organization/project/repository/
+_AZURE_SSH_URL = re.compile(
+    r"^git@(?P<resource>"
+    r"(?P<protocol>\w+)\.[a-z0-9_.-]*\:v3)"
+    r"[:/]*"
+    r"(?P<port>[\d]+){0,1}"
+    r"(?P<pathname>\/"
+    r"(?P<owner>[\w\-\.]+)\/"
+    r"(?P<azure_project>[\w\-\.]+)\/"
+    r"(?P<name>[\w\-\.]+)\/?)$"
+)
+
+
+@attr.frozen
+class ParsedRepo:
+    "The pieces of a repository URL. Shared between the metrics of the same repo."
+
+    url: Optional[str]
+    protocol: Optional[str] = None
+    fqdn: Optional[str] = None
+    group: Optional[str] = None
+    name: Optional[str] = None
+    project: Optional[str] = None
+    port: Optional[str] = None
+    azure_project: Optional[str] = None
+
+    @property
+    def server(self) -> str:
+        "The Git server FQDN with the protocol"
+        url = f"{self.protocol}://{self.fqdn}"
+
+        if self.port:
+            url += f":{self.port}"
+
+        return url
+
+
+_NO_REPO = ParsedRepo(None)
+
+
+@functools.lru_cache(maxsize=REPO_URL_CACHE_SIZE)
+def parse_repo_url(url: str) -> ParsedRepo:
+    """
+    Parse a repository URL into individual pieces.
+    Raises ValueError if its protocol is not supported.
+
+    >>> repo = parse_repo_url("https://github.com/konveyor/pelorus.git")
+    >>> repo.fqdn, repo.group, repo.project
+    ('github.com', 'konveyor', 'pelorus')
+    >>> parse_repo_url("https://github.com/konveyor/pelorus.git") is repo
+    True
+    """
+    logging.debug("repo url = %s", url)
+    match = _AZURE_SSH_URL.search(url) or _AZURE_HTTP_URL.search(url)
+    azure_project = None
+    if match:
+        regex_group = match.groupdict()
+        azure_project = regex_group.pop("azure_project")
+        pre_parsed = {
+            "protocols": giturlparse.parse(url).protocols or ["ssh"],
+            "href": url,
+            "user": None,
+            "owner": None,
+        }
+        pre_parsed.update(regex_group)
+        parsed = giturlparse.parser.Parsed(**pre_parsed)
+    else:
+        parsed = giturlparse.parse(url)
+    logging.debug("Parsed: %s", parsed)
+    if len(parsed.protocols) > 0 and parsed.protocols[0] not in SUPPORTED_PROTOCOLS:
+        raise ValueError("Unsupported protocol %s", parsed.protocols[0])
+    protocol = parsed.protocol
+    # In the case of multiple subgroups the host will be in the pathname
+    # Otherwise, it will be in the resource
+    if parsed.pathname.startswith("//"):
+        fqdn = parsed.pathname.split("/")[2]
+        protocol = parsed.protocols[0]
+    else:
+        fqdn = parsed.resource
+    return ParsedRepo(
+        url,
+        protocol=protocol,
+        fqdn=fqdn,
+        group=parsed.owner,
+        name=parsed.name,
+        project=parsed.name,
+        port=parsed.port,
+        azure_project=azure_project,
+    )
+
+
 # TODO: the majority of these fields are unused.
 # Let's figure out why they're there.
 @attr.define
@@ -42,14 +154,7 @@ class CommitMetric:
     labels: dict = attr.field(default=None, kw_only=True)
     namespace: Optional[str] = attr.field(default=None, kw_only=True)
 
-    __repo_url: str = attr.field(default=None, init=False)
-    __repo_protocol = attr.field(default=None, init=False)
-    __repo_fqdn: str = attr.field(default=None, init=False)
-    __repo_group = attr.field(default=None, init=False)
-    __repo_name = attr.field(default=None, init=False)
-    __repo_project = attr.field(default=None, init=False)
-    __repo_port = attr.field(default=None, init=False)
-    __azure_project = attr.field(default=None, init=False)
+    __repo: ParsedRepo = attr.field(default=_NO_REPO, init=False)
 
     committer: Optional[str] = attr.field(default=None, kw_only=True)
     commit_hash: Optional[str] = attr.field(default=None, kw_only=True)
@@ -83,113 +188,45 @@ class CommitMetric:
 
         git_{server,fqdn}
         """
-        return self.__repo_url
+        return self.__repo.url
 
     @repo_url.setter
     def repo_url(self, value):
         # Ensure git URI does not end with "/", issue #590
-        value = value.strip("/")
-        self.__repo_url = value
-        self.__parse_repourl()
+        self.__repo = parse_repo_url(value.strip("/"))
 
     @property
     def repo_protocol(self):
         """Returns the Git server protocol"""
-        return self.__repo_protocol
+        return self.__repo.protocol
 
     @property
     def git_fqdn(self):
         """Returns the Git server FQDN"""
-        return self.__repo_fqdn
+        return self.__repo.fqdn
 
     @property
     def repo_group(self):
-        return self.__repo_group
+        return self.__repo.group
 
     @property
     def repo_name(self):
         """Returns the Git repo name, example: myrepo.git"""
-        return self.__repo_name
+        return self.__repo.name
 
     @property
     def repo_project(self):
         """Returns the Git project name, this is normally the repo_name with '.git' parsed off the end."""
-        return self.__repo_project
+        return self.__repo.project
 
     @property
     def git_server(self):
         """Returns the Git server FQDN with the protocol"""
-        url = f"{self.__repo_protocol}://{self.__repo_fqdn}"
-
-        if self.__repo_port:
-            url += f":{self.__repo_port}"
-
-        return url
+        return self.__repo.server
 
     @property
     def azure_project(self):
-        return self.__azure_project
-
-    def __parse_repourl(self):
-        """Parse the repo_url into individual pieces"""
-        logging.debug("repo url = %s", self.__repo_url)
-        if self.__repo_url is None:
-            return
-        # http://user@dev.azure.com:8080/organization/project/_git/repository/
-        regex = re.compile(
-            r"^(?P<protocol>https?)\://"
-            r"((?P<user>[a-zA-Z0-9_-]+)@)?"
-            r"(?P<resource>[a-z0-9_.-]*)"
-            r"[:/]*"
-            r"(?P<port>[\d]+){0,1}"
-            r"(?P<pathname>\/"
-            r"(?P<owner>[\w\-\.]+)\/"
-            r"(?P<azure_project>[\w\-\.]+)\/\_git\/"
-            r"(?P<name>[\w\-\.]+)\/?)$"
-        )
-        match = regex.search(self.__repo_url)
-        # git@ssh.dev.azure.com:v3/organization/project/repository/
-        regex_ssh = re.compile(
-            r"^git@(?P<resource>"
-            r"(?P<protocol>\w+)\.[a-z0-9_.-]*\:v3)"
-            r"[:/]*"
-            r"(?P<port>[\d]+){0,1}"
-            r"(?P<pathname>\/"
-            r"(?P<owner>[\w\-\.]+)\/"
-            r"(?P<azure_project>[\w\-\.]+)\/"
-            r"(?P<name>[\w\-\.]+)\/?)$"
-        )
-        match_ssh = regex_ssh.search(self.__repo_url)
-        if match_ssh:
-            match = match_ssh
-        if match:
-            regex_group = match.groupdict()
-            self.__azure_project = regex_group.pop("azure_project")
-            pre_parsed = {
-                "protocols": giturlparse.parse(self.__repo_url).protocols or ["ssh"],
-                "href": self.__repo_url,
-                "user": None,
-                "owner": None,
-            }
-            pre_parsed.update(regex_group)
-            parsed = giturlparse.parser.Parsed(**pre_parsed)
-        else:
-            parsed = giturlparse.parse(self.__repo_url)
-        logging.debug("Parsed: %s", parsed)
-        if len(parsed.protocols) > 0 and parsed.protocols[0] not in SUPPORTED_PROTOCOLS:
-            raise ValueError("Unsupported protocol %s", parsed.protocols[0])
-        self.__repo_protocol = parsed.protocol
-        # In the case of multiple subgroups the host will be in the pathname
-        # Otherwise, it will be in the resource
-        if parsed.pathname.startswith("//"):
-            self.__repo_fqdn = parsed.pathname.split("/")[2]
-            self.__repo_protocol = parsed.protocols[0]
-        else:
-            self.__repo_fqdn = parsed.resource
-        self.__repo_group = parsed.owner
-        self.__repo_name = parsed.name
-        self.__repo_project = parsed.name
-        self.__repo_port = parsed.port
+        return self.__repo.azure_project
 
     # maps attributes to their location in a `Build`.
     #
@@ -219,6 +256,24 @@ class CommitMetric:
     )
 
 
+def pick_annotations(annotations, names: Iterable[str]) -> dict[str, str]:
+    """
+    Copy the given annotations of an object, skipping the missing ones,
+    so metrics don't keep every annotation of the objects they come from.
+
+    >>> pick_annotations({"a": "1", "b": "2"}, ["a", "c"])
+    {'a': '1'}
+    """
+    if not annotations:
+        return {}
+    picked = {}
+    for name in names:
+        value = annotations.get(name)
+        if value is not None:
+            picked[name] = value
+    return picked
+
+
 def commit_metric_from_build(app: str, build, errors: list) -> CommitMetric:
     """
     Create a CommitMetric from build information.
@@ -234,3 +289,48 @@ def commit_metric_from_build(app: str, build, errors: list) -> CommitMetric:
             setattr(metric, attr_name, value)
 
     return metric
+
+
+def _get_raw_field(build: dict, path: Sequence[str]):
+    """
+    Look a field of a build listed as a plain dict up, like `get_nested` does on a
+    `ResourceField`: a missing field is None, and only looking into a None fails.
+    """
+    item = build
+    for i, key in enumerate(path):
+        if not isinstance(item, dict):
+            raise BadAttributePathError(
+                path=path, path_slice=slice(i), key=key, value=item, root_name="build"
+            )
+        item = item.get(key)
+    return item
+
+
+def commit_metric_from_raw_build(app: str, build: dict, errors: list) -> CommitMetric:
+    """
+    Create a CommitMetric from a build listed as a plain dict,
+    the same way `commit_metric_from_build` does from a `ResourceField`.
+
+    >>> build = dict(
+    ...     metadata=dict(name="app-1", namespace="ns", labels=dict(buildconfig="app")),
+    ...     status=dict(outputDockerImageReference="registry/ns/app:latest"),
+    ... )
+    >>> errors = []
+    >>> commit_metric_from_raw_build("app", build, errors).build_config_name
+    'app'
+    >>> [str(e) for e in errors]
+    ['build is missing to in status.output.to.imageDigest because status.output was None']
+    """
+    metric = CommitMetric(app)
+    for attr_name, (path, required) in _RAW_BUILD_MAPPING.items():
+        with collect_bad_attribute_path_error(errors, required):
+            setattr(metric, attr_name, _get_raw_field(build, path))
+
+    return metric
+
+
+# CommitMetric._BUILD_MAPPING, with the paths split once
+_RAW_BUILD_MAPPING = {
+    attr_name: (split_path(path), required)
+    for attr_name, (path, required) in CommitMetric._BUILD_MAPPING.items()
+}
@@ -1,30 +1,36 @@
 #!/usr/bin/python3
 import logging
-import time
 from typing import Optional
 
 import attrs.converters
 import attrs.validators
 from attrs import define, field
 from openshift.dynamic import DynamicClient
-from prometheus_client import start_http_server
-from prometheus_client.core import REGISTRY
 
 import pelorus
-from committime import CommitMetric
+from committime import CommitMetric, image_label_store
 from committime.collector_azure_devops import AzureDevOpsCommitCollector
 from committime.collector_base import (
     COMMIT_DATE_ANNOTATION_ENV,
     COMMIT_HASH_ANNOTATION_ENV,
     COMMIT_REPO_URL_ANNOTATION_ENV,
+    DEFAULT_COMMIT_LOOKUP_WORKERS,
+    DEFAULT_COMMIT_LOOKUP_WORKERS_PER_HOST,
     AbstractCommitCollector,
 )
 from committime.collector_bitbucket import BitbucketCommitCollector
-from committime.collector_containerimage import ContainerImageCommitCollector
+from committime.collector_containerimage import (
+    DEFAULT_IMAGE_LABEL_TIMEOUT_SECONDS,
+    DEFAULT_IMAGE_LABEL_WORKERS,
+    DEFAULT_IMAGE_LABEL_WORKERS_PER_REGISTRY,
+    ContainerImageCommitCollector,
+    ImageLabelWorkers,
+)
 from committime.collector_gitea import GiteaCommitCollector
 from committime.collector_github import GitHubCommitCollector
 from committime.collector_gitlab import GitLabCommitCollector
-from committime.collector_image import ImageCommitCollector
+from committime.collector_image import DEFAULT_IMAGE_PAGE_SIZE, ImageCommitCollector
+from committime.commit_store import DEFAULT_MAX_ENTRIES, make_commit_time_store
 from pelorus.config import (
     REDACT,
     env_var_names,
@@ -34,7 +40,9 @@ from pelorus.config import (
     no_env_vars,
 )
 from pelorus.config.converters import comma_separated, pass_through
+from pelorus.runtime import run_exporter
 from pelorus.utils import Url
+from provider_common.informer import WatchCache, make_watch_cache
 
 PROVIDER_CLASSES_BY_NAME = {
     "github": GitHubCommitCollector,
@@ -60,6 +68,7 @@ class CommittimeTypeConfig:
 @define(kw_only=True)
 class ContainerImageCommittimeConfig:
     kube_client: DynamicClient = field(metadata=no_env_vars())
+    cache: Optional[WatchCache] = field(default=None, metadata=no_env_vars())
 
     app_label: str = pelorus.DEFAULT_APP_LABEL
     namespaces: set[str] = field(factory=set, converter=comma_separated(set))
@@ -79,9 +88,26 @@ class ContainerImageCommittimeConfig:
         metadata=env_vars(COMMIT_HASH_ANNOTATION_ENV),
     )
 
+    image_label_workers: int = field(default=DEFAULT_IMAGE_LABEL_WORKERS, converter=int)
+    image_label_workers_per_registry: int = field(
+        default=DEFAULT_IMAGE_LABEL_WORKERS_PER_REGISTRY, converter=int
+    )
+    image_label_timeout: float = field(
+        default=DEFAULT_IMAGE_LABEL_TIMEOUT_SECONDS, converter=float
+    )
+    image_label_wait: float = field(default=0.0, converter=float)
+    image_label_store_path: Optional[str] = field(default=None)
+    image_label_store_max_entries: int = field(
+        default=image_label_store.DEFAULT_MAX_ENTRIES, converter=int
+    )
+    image_label_store_max_age: float = field(
+        default=image_label_store.DEFAULT_MAX_AGE_SECONDS, converter=float
+    )
+
     def make_collector(self) -> AbstractCommitCollector:
         return ContainerImageCommitCollector(
             kube_client=self.kube_client,
+            cache=self.cache,
             date_format=self.label_commit_time_format,
             namespaces=self.namespaces,
             prod_label=self.prod_label,
@@ -90,12 +116,26 @@ class ContainerImageCommittimeConfig:
             app_label=self.app_label,
             date_annotation_name=self.label_commit_time,
             hash_annotation_name=self.label_commit_hash,
+            label_workers=ImageLabelWorkers(
+                self.image_label_workers,
+                self.image_label_workers_per_registry,
+                self.image_label_timeout,
+                store=image_label_store.make_image_label_store(
+                    self.image_label_store_path,
+                    self.image_label_store_max_entries,
+                    self.image_label_store_max_age,
+                ),
+                hash_label=self.label_commit_hash,
+                date_label=self.label_commit_time,
+            ),
+            label_wait=self.image_label_wait,
         )
 
 
 @define(kw_only=True)
 class ImageCommittimeConfig:
     kube_client: DynamicClient = field(metadata=no_env_vars())
+    cache: Optional[WatchCache] = field(default=None, metadata=no_env_vars())
 
     app_label: str = pelorus.DEFAULT_APP_LABEL
 
@@ -123,6 +163,8 @@ class ImageCommittimeConfig:
         metadata=env_vars(COMMIT_REPO_URL_ANNOTATION_ENV),
     )
 
+    image_page_size: int = field(default=DEFAULT_IMAGE_PAGE_SIZE, converter=int)
+
     def make_collector(self) -> AbstractCommitCollector:
         # Image provider is a special case, where commit time
         # metadata is stored within image.openshift.io/v1 object
@@ -133,6 +175,7 @@ class ImageCommittimeConfig:
         #
         return ImageCommitCollector(
             kube_client=self.kube_client,
+            cache=self.cache,
             date_format=self.date_format,
             username="",
             token="",
@@ -140,12 +183,14 @@ class ImageCommittimeConfig:
             date_annotation_name=self.date_annotation_name,
             hash_annotation_name=self.hash_annotation_name,
             repo_url_annotation_name=self.repo_url_annotation_name,
+            image_page_size=self.image_page_size,
         )
 
 
 @define(kw_only=True)
 class GitCommittimeConfig:
     kube_client: DynamicClient = field(metadata=no_env_vars())
+    cache: Optional[WatchCache] = field(default=None, metadata=no_env_vars())
 
     username: str = field(default="", metadata=env_vars(*env_var_names.USERNAME))
     token: str = field(
@@ -171,6 +216,17 @@ class GitCommittimeConfig:
         default=pelorus.DEFAULT_TLS_VERIFY, converter=attrs.converters.to_bool
     )
 
+    commit_lookup_workers: int = field(
+        default=DEFAULT_COMMIT_LOOKUP_WORKERS, converter=int
+    )
+    commit_lookup_workers_per_host: int = field(
+        default=DEFAULT_COMMIT_LOOKUP_WORKERS_PER_HOST, converter=int
+    )
+
+    # File the looked up commit times are persisted to. Kept in memory only if unset.
+    commit_store_path: Optional[str] = field(default=None)
+    commit_store_max_entries: int = field(default=DEFAULT_MAX_ENTRIES, converter=int)
+
     # TODO hash_annotation_name and repo_url_annotation_name seem to be
     # unnecessary
     hash_annotation_name: str = field(
@@ -197,13 +253,20 @@ class GitCommittimeConfig:
 
     def make_collector(self) -> AbstractCommitCollector:
         git_provider = self.git_provider
+        commit_store = make_commit_time_store(
+            self.commit_store_path, self.commit_store_max_entries
+        )
 
         if git_provider == "gitlab":
             return GitLabCommitCollector(
                 kube_client=self.kube_client,
+                cache=self.cache,
                 username=self.username,
                 token=self.token,
                 namespaces=self.namespaces,
+                commit_lookup_workers=self.commit_lookup_workers,
+                commit_lookup_workers_per_host=self.commit_lookup_workers_per_host,
+                commit_store=commit_store,
                 app_label=self.app_label,
                 hash_annotation_name=self.hash_annotation_name,
                 repo_url_annotation_name=self.repo_url_annotation_name,
@@ -215,9 +278,13 @@ class GitCommittimeConfig:
                 api = {}
             return GitHubCommitCollector(
                 kube_client=self.kube_client,
+                cache=self.cache,
                 username=self.username,
                 token=self.token,
                 namespaces=self.namespaces,
+                commit_lookup_workers=self.commit_lookup_workers,
+                commit_lookup_workers_per_host=self.commit_lookup_workers_per_host,
+                commit_store=commit_store,
                 tls_verify=self.tls_verify,
                 app_label=self.app_label,
                 hash_annotation_name=self.hash_annotation_name,
@@ -227,9 +294,13 @@ class GitCommittimeConfig:
         if git_provider == "bitbucket":
             return BitbucketCommitCollector(
                 kube_client=self.kube_client,
+                cache=self.cache,
                 username=self.username,
                 token=self.token,
                 namespaces=self.namespaces,
+                commit_lookup_workers=self.commit_lookup_workers,
+                commit_lookup_workers_per_host=self.commit_lookup_workers_per_host,
+                commit_store=commit_store,
                 tls_verify=self.tls_verify,
                 app_label=self.app_label,
                 hash_annotation_name=self.hash_annotation_name,
@@ -242,9 +313,13 @@ class GitCommittimeConfig:
                 api = {}
             return GiteaCommitCollector(
                 kube_client=self.kube_client,
+                cache=self.cache,
                 username=self.username,
                 token=self.token,
                 namespaces=self.namespaces,
+                commit_lookup_workers=self.commit_lookup_workers,
+                commit_lookup_workers_per_host=self.commit_lookup_workers_per_host,
+                commit_store=commit_store,
                 app_label=self.app_label,
                 hash_annotation_name=self.hash_annotation_name,
                 repo_url_annotation_name=self.repo_url_annotation_name,
@@ -257,9 +332,13 @@ class GitCommittimeConfig:
                 api = {}
             return AzureDevOpsCommitCollector(
                 kube_client=self.kube_client,
+                cache=self.cache,
                 username=self.username,
                 token=self.token,
                 namespaces=self.namespaces,
+                commit_lookup_workers=self.commit_lookup_workers,
+                commit_lookup_workers_per_host=self.commit_lookup_workers_per_host,
+                commit_store=commit_store,
                 app_label=self.app_label,
                 hash_annotation_name=self.hash_annotation_name,
                 repo_url_annotation_name=self.repo_url_annotation_name,
@@ -277,30 +356,21 @@ def set_up(prod: bool = True) -> AbstractCommitCollector:
     provider_config = load_and_log(CommittimeTypeConfig)
 
     dyn_client = pelorus.utils.get_k8s_client()
+    clients = dict(kube_client=dyn_client, cache=make_watch_cache(dyn_client))
 
     if provider_config.provider == "git":
-        config = load_and_log(GitCommittimeConfig, other=dict(kube_client=dyn_client))
+        config = load_and_log(GitCommittimeConfig, other=clients)
     elif provider_config.provider == "image":
-        config = load_and_log(ImageCommittimeConfig, other=dict(kube_client=dyn_client))
+        config = load_and_log(ImageCommittimeConfig, other=clients)
     elif provider_config.provider == "containerimage":
-        config = load_and_log(
-            ContainerImageCommittimeConfig, other=dict(kube_client=dyn_client)
-        )
+        config = load_and_log(ContainerImageCommittimeConfig, other=clients)
     else:
         raise ValueError(
             f"Unknown provider {provider_config.provider}"
         )  # should be unreachable
 
-    collector = config.make_collector()
-
-    REGISTRY.register(collector)
-    return collector
+    return config.make_collector()
 
 
 if __name__ == "__main__":
-    set_up()
-    # TODO refactor: create function, all exporters have same structure
-    start_http_server(8080)
-
-    while True:
-        time.sleep(1)
+    run_exporter(set_up())
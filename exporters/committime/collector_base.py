@@ -19,21 +19,33 @@ from __future__ import annotations
 
 import logging
 import re
+import threading
 from abc import abstractmethod
-from typing import ClassVar, Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import ClassVar, Iterable, Iterator, Optional
 
 import attrs
 from attrs import define, field
-from jsonpath_ng import parse
 from openshift.dynamic import DynamicClient
-from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 import pelorus
-from committime import CommitMetric, commit_metric_from_build
+from committime import CommitMetric, commit_metric_from_build, pick_annotations
+from committime.commit_store import (
+    CommitLookupFailures,
+    CommitTimeStore,
+    MemoryCommitTimeStore,
+)
 from pelorus.config import env_vars
 from pelorus.config.converters import comma_separated, pass_through
 from pelorus.utils import Url, get_nested
+from pelorus.utils.http import http_client_metrics
+from pelorus.utils.resilience import CircuitOpenError
 from provider_common import format_app_name
+from provider_common.github import RateLimitDeferred
+from provider_common.informer import BY_APP, BY_NAMESPACE, WatchCache
+from provider_common.openshift import list_metadata, namespace_query_planner
 
 # Custom annotations env for the Build
 # Default ones are in the CommitMetric._ANNOTATION_MAPPIG
@@ -41,6 +53,54 @@ COMMIT_HASH_ANNOTATION_ENV = "COMMIT_HASH_ANNOTATION"
 COMMIT_REPO_URL_ANNOTATION_ENV = "COMMIT_REPO_URL_ANNOTATION"
 COMMIT_DATE_ANNOTATION_ENV = "COMMIT_DATE_ANNOTATION"
 
+# Concurrent commit time lookups, in total and against a single git server
+DEFAULT_COMMIT_LOOKUP_WORKERS = 8
+DEFAULT_COMMIT_LOOKUP_WORKERS_PER_HOST = 4
+
+
+JENKINS_STRATEGY = "JenkinsPipeline"
+# Strategies of the builds that produce an image from a commit
+CODE_STRATEGIES = frozenset({"Source", "Binary", "Docker"})
+
+
+def group_by_app(items: Iterable, app_label: str) -> dict[str, list]:
+    """
+    Bucket OpenShift objects by the value of their app label, in a single pass.
+    Objects without the label are skipped. Each bucket keeps the order of `items`.
+    """
+    items_by_app: dict[str, list] = {}
+    for item in items:
+        labels = item.metadata.labels
+        app = labels[app_label] if labels else None
+        if app is not None:
+            bucket = items_by_app.get(app)
+            if bucket is None:
+                items_by_app[app] = [item]
+            else:
+                bucket.append(item)
+    return items_by_app
+
+
+def group_by_namespace(items: Iterable) -> dict[str, list]:
+    "Bucket OpenShift objects by namespace, keeping the order of `items`."
+    items_by_namespace: dict[str, list] = {}
+    for item in items:
+        items_by_namespace.setdefault(item.metadata.namespace, []).append(item)
+    return items_by_namespace
+
+
+def split_by_strategy(builds: Iterable) -> tuple[list, list]:
+    "Split builds into (Jenkins pipeline builds, code builds) in a single pass."
+    jenkins_builds = []
+    code_builds = []
+    for build in builds:
+        strategy = build.spec.strategy.type
+        if strategy == JENKINS_STRATEGY:
+            jenkins_builds.append(build)
+        elif strategy in CODE_STRATEGIES:
+            code_builds.append(build)
+    return jenkins_builds, code_builds
+
 
 class UnsupportedGITProvider(Exception):
     """
@@ -77,7 +137,36 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
 
     tls_verify: bool = field(default=True)
 
-    commit_dict: dict[str, Optional[float]] = field(factory=dict, init=False)
+    commit_store: CommitTimeStore = field(factory=MemoryCommitTimeStore)
+    lookup_failures: CommitLookupFailures = field(factory=CommitLookupFailures)
+
+    cache: Optional[WatchCache] = field(default=None)
+
+    commit_lookup_workers: int = field(
+        default=DEFAULT_COMMIT_LOOKUP_WORKERS, converter=int
+    )
+    commit_lookup_workers_per_host: int = field(
+        default=DEFAULT_COMMIT_LOOKUP_WORKERS_PER_HOST, converter=int
+    )
+
+    _executor: Optional[ThreadPoolExecutor] = field(default=None, init=False)
+    _lookup_locks: dict[str, threading.Lock] = field(factory=dict, init=False)
+    _host_limits: dict[Optional[str], threading.BoundedSemaphore] = field(
+        factory=dict, init=False
+    )
+    _limits_lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    # (namespace, name) -> (resourceVersion, repo URL) of the BuildConfigs
+    _build_config_repos: dict[tuple[str, str], tuple[str, Optional[str]]] = field(
+        factory=dict, init=False
+    )
+    # namespaces whose BuildConfigs were listed during the current collection
+    _build_config_namespaces: set[str] = field(factory=set, init=False)
+    # namespace -> lock held while its BuildConfigs are listed
+    _build_config_list_locks: dict[str, threading.Lock] = field(
+        factory=dict, init=False
+    )
+    _build_configs_lock: threading.Lock = field(factory=threading.Lock, init=False)
 
     # TODO hash_annotation_name and repo_url_annotation_name seem to be
     # unnecessary
@@ -92,7 +181,6 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
     )
 
     def __attrs_post_init__(self):
-        self.commit_dict = dict()
         if not (self.username and self.token):
             logging.warning(
                 "No API_USER and no TOKEN given. This is okay for public repositories only."
@@ -135,74 +223,107 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
             )
         yield commit_metric
 
+        yield from self._lookup_failure_metrics()
+        yield from namespace_query_planner.metrics()
+        yield from http_client_metrics()
+
+    def _lookup_failure_metrics(self) -> Iterable[GaugeMetricFamily]:
+        failures = CounterMetricFamily(
+            "pelorus_commit_lookup_failures",
+            "Number of commit time lookups that failed",
+        )
+        failures.add_metric([], self.lookup_failures.failures_total)
+        yield failures
+
+        skipped = CounterMetricFamily(
+            "pelorus_commit_lookups_skipped",
+            "Number of commit time lookups skipped while backing off from a failure",
+        )
+        skipped.add_metric([], self.lookup_failures.skipped_total)
+        yield skipped
+
+        backing_off = GaugeMetricFamily(
+            "pelorus_commit_lookups_backing_off",
+            "Number of commits whose last lookup failed",
+        )
+        backing_off.add_metric([], len(self.lookup_failures))
+        yield backing_off
+
     def _get_watched_namespaces(self) -> set[str]:
         watched_namespaces = self.namespaces
         if not watched_namespaces:
             logging.debug("No namespaces specified, watching all namespaces")
-            v1_namespaces = self.kube_client.resources.get(
-                api_version="v1", kind="Namespace"
-            )
+            informer = self.cache and self.cache.informer("v1", "Namespace")
+            if informer:
+                namespace_objects = informer.list()
+            else:
+                v1_namespaces = self.kube_client.resources.get(
+                    api_version="v1", kind="Namespace"
+                )
+                namespace_objects = list_metadata(v1_namespaces)
             watched_namespaces = {
-                namespace.metadata.name for namespace in v1_namespaces.get().items
+                namespace.metadata.name for namespace in namespace_objects
             }
         logging.debug("Watching namespaces: %s" % (watched_namespaces))
         return watched_namespaces
 
-    def _get_openshift_obj_by_app(self, openshift_obj: str) -> Optional[dict]:
-        app_label = self.app_label
-
-        # use a jsonpath expression to find all values for the app label
-        jsonpath_str = "$['items'][*]['metadata']['labels']['" + str(app_label) + "']"
-
-        jsonpath_expr = parse(jsonpath_str)
-
-        found = jsonpath_expr.find(openshift_obj)
-
-        apps = {match.value for match in found}
-
-        if not apps:
-            return None
+    def _get_openshift_obj_by_app(self, openshift_obj) -> Optional[dict]:
+        return group_by_app(openshift_obj.items, self.app_label) or None
 
-        items_by_app = {}
-
-        for app in apps:
-            items_by_app[app] = list(
-                filter(
-                    lambda b: b.metadata.labels[app_label] == app, openshift_obj.items
-                )
-            )
-
-        return items_by_app
+    def _get_builds_by_app_from_cache(self, informer, namespace: str) -> dict:
+        "Group the cached builds of the namespace by app, using the informer's app index."
+        return {
+            app: informer.by_index(BY_APP, (ns, app))
+            for ns, app in informer.index_keys(BY_APP)
+            if ns == namespace
+        }
 
     def generate_metrics(self) -> Iterable[CommitMetric]:
         """Method called by the collect to create a list of metrics to publish"""
         # This will loop and look at OCP builds (calls get_git_commit_time)
 
-        watched_namespaces = self._get_watched_namespaces()
+        self._build_config_namespaces.clear()
+
+        builds_informer = self.cache and self.cache.informer(
+            "build.openshift.io/v1", "Build", label_selector=self.app_label
+        )
 
-        # Initialize metrics list
-        metrics = []
-        for namespace in watched_namespaces:
-            # Initialized variables
-            builds = []
-            builds_by_app = {}
-            app_label = self.app_label
+        app_label = self.app_label
+        if builds_informer:
+            builds_by_app_by_namespace = {
+                namespace: self._get_builds_by_app_from_cache(
+                    builds_informer, namespace
+                )
+                for namespace in self._get_watched_namespaces()
+            }
+        else:
             logging.debug(
-                "Searching for builds with label: %s in namespace: %s"
-                % (app_label, namespace)
+                "Searching for builds with label: %s in namespaces: %s"
+                % (app_label, self.namespaces or "all")
             )
-
             v1_builds = self.kube_client.resources.get(
                 api_version="build.openshift.io/v1", kind="Build"
             )
-            # only use builds that have the app label
-            builds = v1_builds.get(namespace=namespace, label_selector=app_label)
-
-            builds_by_app = self._get_openshift_obj_by_app(builds)
+            # only use builds that have the app label. Without NAMESPACES,
+            # builds of all namespaces are listed at once.
+            builds = namespace_query_planner.list(
+                v1_builds, self.namespaces, label_selector=app_label
+            )
+            builds_by_app_by_namespace = {
+                namespace: group_by_app(namespace_builds, app_label)
+                for namespace, namespace_builds in group_by_namespace(builds).items()
+            }
 
+        # Builds of all namespaces, collected together once listed
+        builds_to_collect = []
+        for namespace, builds_by_app in builds_by_app_by_namespace.items():
             if builds_by_app:
-                metrics += self.get_metrics_from_apps(builds_by_app, namespace)
+                builds_to_collect += self._get_builds_to_collect(
+                    builds_by_app, namespace
+                )
 
+        metrics = self._collect_from_builds(builds_to_collect)
+        self.commit_store.flush()
         return metrics
 
     @abstractmethod
@@ -212,18 +333,16 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
 
     def get_metrics_from_apps(self, apps, namespace):
         """Expects a sorted array of build data sorted by app label"""
-        metrics = []
+        return self._collect_from_builds(self._get_builds_to_collect(apps, namespace))
+
+    def _get_builds_to_collect(self, apps, namespace) -> list[tuple]:
+        """
+        Select the builds of each app that carry commit data,
+        as (build, app, namespace, repo_url) tuples.
+        """
+        builds_to_collect = []
         for app in apps:
-            builds = apps[app]
-            jenkins_builds = list(
-                filter(lambda b: b.spec.strategy.type == "JenkinsPipeline", builds)
-            )
-            code_builds = list(
-                filter(
-                    lambda b: b.spec.strategy.type in ["Source", "Binary", "Docker"],
-                    builds,
-                )
-            )
+            jenkins_builds, code_builds = split_by_strategy(apps[app])
             # assume for now that there will only be one repo/branch per app
             # For jenkins pipelines, we need to grab the repo data
             # then find associated s2i/docker builds from which to pull commit & image data
@@ -231,17 +350,55 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
             logging.debug("Repo URL for app %s is currently %s" % (app, repo_url))
 
             for build in code_builds:
-                try:
-                    metric = self.get_metric_from_build(build, app, namespace, repo_url)
-                    if metric:
-                        logging.debug("Adding metric for app %s" % app)
-                        metrics.append(metric)
-                except Exception:
-                    logging.error(
-                        "Cannot collect metrics from build: %s" % (build.metadata.name)
-                    )
+                builds_to_collect.append((build, app, namespace, repo_url))
 
-        return metrics
+        return builds_to_collect
+
+    def _collect_from_builds(self, builds_to_collect: list[tuple]) -> list:
+        """
+        Get the metric of every build, looking commits up concurrently.
+        The most recent builds are looked up first, so they get the API rate
+        limit left before the older ones. Metrics are returned in the order of the builds.
+        """
+        # ISO 8601 creation timestamps sort chronologically
+        newest_first = sorted(
+            range(len(builds_to_collect)),
+            key=lambda i: get_nested(
+                builds_to_collect[i][0], "metadata.creationTimestamp", default=None
+            )
+            or "",
+            reverse=True,
+        )
+        results: list = [None] * len(builds_to_collect)
+        if self.commit_lookup_workers <= 1 or len(builds_to_collect) <= 1:
+            for i in newest_first:
+                results[i] = self._get_metric_or_log(*builds_to_collect[i])
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.commit_lookup_workers,
+                    thread_name_prefix="pelorus-commit-lookup",
+                )
+            futures = {
+                i: self._executor.submit(self._get_metric_or_log, *builds_to_collect[i])
+                for i in newest_first
+            }
+            for i, future in futures.items():
+                results[i] = future.result()
+
+        return [metric for metric in results if metric]
+
+    def _get_metric_or_log(self, build, app, namespace, repo_url):
+        try:
+            metric = self.get_metric_from_build(build, app, namespace, repo_url)
+            if metric:
+                logging.debug("Adding metric for app %s" % app)
+            return metric
+        except Exception:
+            logging.error(
+                "Cannot collect metrics from build: %s" % (build.metadata.name)
+            )
+            return None
 
     def get_metric_from_build(self, build, app, namespace, repo_url):
         errors = []
@@ -251,10 +408,11 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
             if not self._is_metric_ready(namespace, metric, build):
                 return None
 
-            # Populate annotations and labels required by
-            # subsequent _set_ functions.
-            metric.annotations = vars(build.metadata.annotations)
-            metric.labels = vars(build.metadata.labels)
+            # Populate the annotations required by subsequent _set_ functions.
+            metric.annotations = pick_annotations(
+                build.metadata.annotations,
+                (self.hash_annotation_name, self.repo_url_annotation_name),
+            )
 
             metric = self._set_repo_url(metric, repo_url, build, errors)
 
@@ -371,6 +529,29 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
         else:
             return True
 
+    @contextmanager
+    def _lookup_slot(self, metric: CommitMetric) -> Iterator[None]:
+        """
+        Serialize the lookups of the same commit, so it is only looked up once,
+        and bound the concurrent lookups against the same git server.
+        """
+        with self._limits_lock:
+            commit_lock = self._lookup_locks.setdefault(
+                metric.commit_hash, threading.Lock()
+            )
+            host_limit = self._host_limits.get(metric.git_fqdn)
+            if host_limit is None:
+                host_limit = threading.BoundedSemaphore(
+                    max(self.commit_lookup_workers_per_host, 1)
+                )
+                self._host_limits[metric.git_fqdn] = host_limit
+        try:
+            with commit_lock, host_limit:
+                yield
+        finally:
+            with self._limits_lock:
+                self._lookup_locks.pop(metric.commit_hash, None)
+
     # TODO: be specific about the API modifying in place or returning a new metric.
     # Right now, it appears to do both.
     def _set_commit_timestamp(
@@ -380,30 +561,63 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
         Check the cache for the commit_time.
         If absent, call the API implemented by the subclass.
         """
-        if metric.commit_hash and metric.commit_hash not in self.commit_dict:
-            logging.debug(
-                "sha: %s, commit_timestamp not found in cache, executing API call.",
-                metric.commit_hash,
-            )
-            try:
-                metric = self.get_commit_time(metric)
-            except UnsupportedGITProvider as ex:
-                errors.append(ex.message)
-                return None
-            # If commit time is None, then we could not get the value from the API
-            if metric.commit_time is None:
-                errors.append("Couldn't get commit time")
-            else:
-                # Add the timestamp to the cache
-                self.commit_dict[metric.commit_hash] = metric.commit_timestamp
-        elif metric.commit_hash:
-            metric.commit_timestamp = self.commit_dict[metric.commit_hash]
+        if not metric.commit_hash:
+            return metric
+
+        commit_timestamp = self.commit_store.get(metric.repo_url, metric.commit_hash)
+        if commit_timestamp is None:
+            with self._lookup_slot(metric):
+                # A concurrent lookup of the same commit may have finished meanwhile
+                commit_timestamp = self.commit_store.get(
+                    metric.repo_url, metric.commit_hash
+                )
+                if commit_timestamp is None:
+                    return self._look_commit_up(metric, errors)
+
+        metric.commit_timestamp = commit_timestamp
+        logging.debug(
+            "Returning sha: %s, commit_timestamp: %s, from cache.",
+            metric.commit_hash,
+            metric.commit_timestamp,
+        )
+        return metric
+
+    def _look_commit_up(
+        self, metric: CommitMetric, errors: list
+    ) -> Optional[CommitMetric]:
+        "Call the API for the commit time, unless the commit is backing off from a failure."
+        repo_url, commit_hash = metric.repo_url, metric.commit_hash
+        if not self.lookup_failures.should_retry(repo_url, commit_hash):
             logging.debug(
-                "Returning sha: %s, commit_timestamp: %s, from cache.",
-                metric.commit_hash,
-                metric.commit_timestamp,
+                "sha: %s, lookup failed recently, skipping until its backoff expires.",
+                commit_hash,
             )
+            return None
 
+        logging.debug(
+            "sha: %s, commit_timestamp not found in cache, executing API call.",
+            commit_hash,
+        )
+        try:
+            metric = self.get_commit_time(metric)
+        except UnsupportedGITProvider as ex:
+            errors.append(ex.message)
+            return None
+        except (RateLimitDeferred, CircuitOpenError) as ex:
+            # not a failure of the commit, it is looked up on a later collection
+            logging.debug("sha: %s, lookup deferred: %s", commit_hash, ex)
+            return None
+        except Exception:
+            self.lookup_failures.record_failure(repo_url, commit_hash)
+            raise
+        # If commit time is None, then we could not get the value from the API
+        if metric.commit_time is None:
+            self.lookup_failures.record_failure(repo_url, commit_hash)
+            errors.append("Couldn't get commit time")
+        else:
+            # Add the timestamp to the cache
+            self.lookup_failures.record_success(repo_url, commit_hash)
+            self.commit_store.put(repo_url, commit_hash, metric.commit_timestamp)
         return metric
 
     def get_repo_from_jenkins(self, jenkins_builds):
@@ -440,18 +654,71 @@ class AbstractCommitCollector(pelorus.AbstractPelorusExporter):
         :param build: the Build resource
         :return: repo_url as a str or None if not found
         """
-        v1_build_configs = self.kube_client.resources.get(
-            api_version="build.openshift.io/v1", kind="BuildConfig"
-        )
-        build_config = v1_build_configs.get(
-            namespace=build.status.config.namespace, name=build.status.config.name
+        namespace = build.status.config.namespace
+        with self._build_configs_lock:
+            list_lock = self._build_config_list_locks.setdefault(
+                namespace, threading.Lock()
+            )
+        # lookups of builds of other namespaces don't wait for this list
+        with list_lock:
+            with self._build_configs_lock:
+                listed = namespace in self._build_config_namespaces
+            if not listed:
+                self._list_build_config_repos(namespace)
+        with self._build_configs_lock:
+            _, repo_url = self._build_config_repos.get(
+                (namespace, build.status.config.name), (None, None)
+            )
+        return repo_url
+
+    def _list_build_config_repos(self, namespace: str) -> None:
+        """
+        Refresh the repo urls of the BuildConfigs of the namespace, with one list per collection.
+        Only the BuildConfigs whose resourceVersion changed are read again.
+        The list is made without holding the lock of the repo urls.
+        """
+        informer = self.cache and self.cache.informer(
+            "build.openshift.io/v1", "BuildConfig"
         )
-        if build_config:
-            if build_config.spec.source.git:
-                git_uri = str(build_config.spec.source.git.uri)
-                if git_uri.endswith(".git"):
-                    return git_uri
-                else:
-                    return git_uri + ".git"
-
-        return None
+        if informer:
+            build_configs = informer.by_index(BY_NAMESPACE, namespace)
+        else:
+            v1_build_configs = self.kube_client.resources.get(
+                api_version="build.openshift.io/v1", kind="BuildConfig"
+            )
+            build_configs = v1_build_configs.get(namespace=namespace).items
+
+        with self._build_configs_lock:
+            known = {
+                key: cached
+                for key, cached in self._build_config_repos.items()
+                if key[0] == namespace
+            }
+
+        repos = {}
+        for build_config in build_configs:
+            key = (namespace, build_config.metadata.name)
+            resource_version = build_config.metadata.resourceVersion
+            cached = known.get(key)
+            if cached and cached[0] == resource_version:
+                repos[key] = cached
+            else:
+                repos[key] = (resource_version, _repo_from_build_config(build_config))
+
+        with self._build_configs_lock:
+            # forget the BuildConfigs that were deleted
+            for key in known:
+                del self._build_config_repos[key]
+            self._build_config_repos.update(repos)
+            self._build_config_namespaces.add(namespace)
+
+
+def _repo_from_build_config(build_config) -> Optional[str]:
+    if build_config.spec.source.git:
+        git_uri = str(build_config.spec.source.git.uri)
+        if git_uri.endswith(".git"):
+            return git_uri
+        else:
+            return git_uri + ".git"
+
+    return None
@@ -8,10 +8,11 @@ import requests.exceptions
 from attrs import define, field
 
 import pelorus
-from committime import CommitMetric
+from committime import CommitMetric, parse_repo_url
 from committime.collector_base import AbstractCommitCollector, UnsupportedGITProvider
 from pelorus.timeutil import parse_tz_aware
-from pelorus.utils import set_up_requests_session
+from pelorus.utils import HttpClient, set_up_requests_session
+from pelorus.utils.resilience import CircuitOpenError
 
 
 class APIVersion(ABC):
@@ -50,21 +51,11 @@ class Version1(APIVersion):
         git_server = metric.git_server
         sha = metric.commit_hash
 
-        # URL munging copied from original code.
-        # TODO: this is messy. We should investigate the parsing that CommitMetric is doing.
-
-        # Due to the BB V1 git pattern differences, need remove '/scm' and parse again.
-        old_url = metric.repo_url
-        # Parse out the V1 /scm, for whatever reason why it is present.
-        new_url = old_url.replace("/scm", "")
-        # set the new url, so the parsing will happen
-        metric.repo_url = new_url
-        # set the new project name
-        project_name = metric.repo_project
-        # set the new group
-        group = metric.repo_group
-        # set the URL back to the original
-        metric.repo_url = old_url
+        # Due to the BB V1 git pattern differences, the group and project
+        # are parsed from the URL without the '/scm' it contains.
+        repo = parse_repo_url(metric.repo_url.replace("/scm", "").strip("/"))
+        project_name = repo.project
+        group = repo.group
 
         return pelorus.url_joiner(
             git_server,
@@ -144,7 +135,7 @@ class BitbucketCommitCollector(AbstractCommitCollector):
 
     cached_server_api_versions: dict[str, APIVersion] = field(factory=dict, init=False)
 
-    session: requests.Session = field(factory=requests.Session, init=False)
+    session: HttpClient = field(factory=HttpClient, init=False)
 
     def __attrs_post_init__(self):
         super().__attrs_post_init__()
@@ -180,6 +171,9 @@ class BitbucketCommitCollector(AbstractCommitCollector):
             api_version.update_metric_from_api(metric, api_dict)
 
             return metric
+        except CircuitOpenError:
+            # the server is known to be down, its other commits fail fast too
+            raise
         except requests.exceptions.SSLError as e:
             logging.error(
                 "TLS error talking to %s for build %s: %s",
@@ -15,20 +15,40 @@
 #    under the License.
 #
 
-import json
+import bisect
+import heapq
+import itertools
 import logging
-import queue
-import subprocess
 import threading
 import time
-from typing import Dict, Iterable, Optional, Tuple
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
-from attr import define
+import requests
+from attr import Factory, define, field
 from openshift.dynamic.resource import ResourceField
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+    Metric,
+)
+from prometheus_client.utils import floatToGoString
 
 from committime import CommitMetric
 from committime.collector_base import AbstractCommitCollector
-from pelorus.timeutil import parse_guessing_timezone_DYNAMIC, to_epoch_from_string
+from committime.image_label_store import ImageCommit, MemoryImageLabelStore
+from committime.registry import (
+    CA_CRT_DIR,
+    ImageReference,
+    RegistryClient,
+    RegistryError,
+)
+from pelorus.timeutil import (
+    parse_assuming_utc,
+    parse_guessing_timezone_DYNAMIC,
+    to_epoch_from_string,
+)
 from provider_common.openshift import (
     filter_pods_by_replica_uid,
     get_and_log_namespaces,
@@ -36,221 +56,251 @@ from provider_common.openshift import (
     get_running_pods,
 )
 
-skopeo_lock = threading.Lock()
-
-# A queue to store image URI values to be processed
-image_shas_uris_queue = queue.Queue()
-# Use to track if the image is already in the queue
-sha_in_queue = set()
-
-# Cache threshold in seconds, used by our in memory cache or storing image labels.
-# The cache may expire only when the image is not in use by running Pod anymore,
-# so we don't waste the skopeo calls to the external registries, but we still allow
-# pods to be not running for a while before we expire it's metric.
-CACHE_THRESHOLD_1_DAYS = 60 * 60 * 24
-
-# We store skopeo failures and we re-try maximum SKOPEO_MAX_RETRY times per
-# one image URI. This is to prevent too many calls to the external container
-# registries. We have a timeout here, so after some time the failed image URI
-# will be retried anyway. If the pod is not Running anymore the cache expires
-# right away.
-skopeo_failures_lock = threading.Lock()
-# The dictionary where the key is an uuid and the value a Tuple
-# where we store number of retries and the time of last check
-skopeo_failures: Dict[str, Tuple[int, float]] = {}
-SKOPEO_MAX_RETRY = 3
-CACHE_SKOPEO_FAILURE_THRESHOLD_2_DAYS = 60 * 60 * 24 * 2
-
-image_label_cache_lock = threading.Lock()
-image_label_cache: Dict[str, Tuple[Dict, float]] = {}
+DEFAULT_IMAGE_LABEL_WORKERS = 8
+DEFAULT_IMAGE_LABEL_WORKERS_PER_REGISTRY = 4
+DEFAULT_IMAGE_LABEL_TIMEOUT_SECONDS = 60
+# Buckets of the image label lookup latency histogram, in seconds
+LOOKUP_SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
-# Store pods that are running, needed for cleanup
-running_pods_shas_lock = threading.Lock()
-running_pods_shas = set()
+_CREATION_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-# The directory where ca.crt is mounted
-CA_CRT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount/"
+# Created when the first image is looked up, shared by the worker threads.
+registry_client_lock = threading.Lock()
+registry_client: Optional[RegistryClient] = None
 
 
-class SkopeoDataException(Exception):
-    "An error that occurred Skopeo call"
+class ImageLabelsException(Exception):
+    "An error that occurred getting the labels of an image from its registry"
     pass
 
 
-def _add_to_cleanup_set(sha_256: str) -> None:
-    with running_pods_shas_lock:
-        running_pods_shas.add(sha_256)
+def _get_registry_client() -> RegistryClient:
+    global registry_client
+    with registry_client_lock:
+        if registry_client is None:
+            registry_client = RegistryClient(CA_CRT_DIR)
+        return registry_client
 
 
-def _clear_cleanup_set() -> None:
-    with running_pods_shas_lock:
-        running_pods_shas.clear()
-
-
-def _cache_container_images_labels(sha_256: str, labels: Dict) -> None:
-    with image_label_cache_lock:
-        if sha_256 not in image_label_cache:
-            logging.debug(f"Adding SHA256 to the cache: {sha_256} ")
-            image_label_cache[sha_256] = (labels, time.time())
-
-
-def _cleanup_cache() -> None:
-    with running_pods_shas_lock, image_label_cache_lock:
-        current_time = time.time()
-
-        expired_shas = [
-            sha
-            for sha, (_, insertion_time) in image_label_cache.items()
-            if current_time - insertion_time > CACHE_THRESHOLD_1_DAYS
-            and sha not in running_pods_shas
-        ]
-        for sha_256 in expired_shas:
-            image_label_cache.pop(sha_256, None)
-
-
-def _add_skopeo_failure(sha_256: str) -> None:
-    with skopeo_failures_lock:
-        logging.debug(f"Adding SHA256 to the failures: {sha_256} ")
-        if sha_256 not in skopeo_failures:
-            skopeo_failures[sha_256] = (1, time.time())
-        else:
-            skopeo_failures[sha_256] = (skopeo_failures[sha_256][0] + 1, time.time())
-
-
-def _remove_from_skopeo_failure(sha_256: str) -> None:
-    with skopeo_failures_lock:
-        if sha_256 in skopeo_failures:
-            logging.debug(f"Removing SHA256 from the failures: {sha_256} ")
-            skopeo_failures.pop(sha_256, None)
+def get_labels_from_image(
+    image_uri: str, timeout: Optional[float] = None
+) -> Dict[str, str]:
+    logging.debug(f"Getting image labels of {image_uri}")
+    try:
+        return _get_registry_client().get_labels(image_uri, timeout)
+    except (RegistryError, requests.RequestException) as e:
+        logging.debug(f"Error from the registry for {image_uri}: {e}")
+        raise ImageLabelsException(str(e)) from e
 
 
-def _sha256_valid_to_be_checked(sha_256: str) -> bool:
+@define(eq=False)
+class ImageLabelWorkers:
     """
-    Checks if the sha256 of an image was previously in
-    failures. If it was then it checks if the number of retries
-    was above threashold.
-
-    If it was then we check if the time treshold was met.
+    Pool of threads getting the labels of images from their registries.
+
+    An image is queued only once, until its lookup ends, and not at all once
+    its commit labels are in the `store`, or while its failures are backing off.
+    The most recently created images are looked up first, among the registries
+    that have fewer than `workers_per_registry` lookups running: each registry
+    has its own queue, so a busy one doesn't hold back the others.
+    Each lookup must end within `timeout` seconds.
+    The threads are started when the first image is submitted.
     """
-    with skopeo_failures_lock:
-        if sha_256 not in skopeo_failures:
-            return True
-
-        no_failures, timestamp = skopeo_failures[sha_256]
-        if no_failures < SKOPEO_MAX_RETRY:
-            return True
-
-    # Must be outside of the failures lock, otherwise we will
-    # deadlock with the _remove_from_skopeo_failure() call
-    if time.time() - timestamp > CACHE_SKOPEO_FAILURE_THRESHOLD_2_DAYS:
-        _remove_from_skopeo_failure(sha_256)
-        return True
-
-    return False
 
-
-def get_labels_from_image(sha_256: str, image_uri: str) -> Dict[str, str]:
-    # Check if the sha_256 is in the failures
-    # and if we should continue based on the SKOPEO_MAX_RETRY
-    # or CACHE_SKOPEO_FAILURE_THRESHOLD_2_DAYS
-    if not _sha256_valid_to_be_checked(sha_256):
-        logging.debug(f"Skipping skopeo for: {sha_256}")
-        raise SkopeoDataException("Sha not to be checked")
-
-    logging.debug(f"Running skopeo for: {sha_256}")
-    command = f"skopeo inspect --cert-dir {CA_CRT_DIR} {image_uri}"
-    logging.debug(f"Running shell command: {command}")
-    process = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
+    workers: int = field(default=DEFAULT_IMAGE_LABEL_WORKERS, converter=int)
+    workers_per_registry: int = field(
+        default=DEFAULT_IMAGE_LABEL_WORKERS_PER_REGISTRY, converter=int
     )
-    output, stderr = process.communicate()
-    output = output.decode("utf-8").strip()
-    if process.returncode != 0:
-        _add_skopeo_failure(sha_256)
-        stderr = stderr.decode().strip()
-        logging.debug(f"Error from skopeo for {command}: {stderr}")
-        raise SkopeoDataException(stderr)
+    timeout: float = field(default=DEFAULT_IMAGE_LABEL_TIMEOUT_SECONDS, converter=float)
+    store: MemoryImageLabelStore = field(factory=MemoryImageLabelStore)
+    hash_label: str = CommitMetric._ANNOTATION_MAPPIG["commit_hash"]
+    date_label: str = CommitMetric._ANNOTATION_MAPPIG["commit_time"]
 
-    try:
-        image_data = json.loads(output)
-        labels = image_data.get("Labels", {})
-    except json.JSONDecodeError as e:
-        _add_skopeo_failure(sha_256)
-        logging.debug(f"Error from decoding JSON for {sha_256}: {e.msg}")
-        raise SkopeoDataException("Error: Invalid JSON output")
-
-    # We got the labels, so remove them from the potential
-    # existence in the failures.
-    _remove_from_skopeo_failure(sha_256)
-    return labels
-
-
-def _skopeo_worker() -> None:
-    loop_count = 1
-    while True:
-        logging.debug(f"Worker loop: {loop_count}")
-        loop_count += 1
-        sha_pop = image_shas_uris_queue.get()
-        try:
-            for sha_256, sha_uri in sha_pop.items():
-                labels = get_labels_from_image(sha_256, sha_uri)
-                _cache_container_images_labels(sha_256, labels)
-        except Exception:
-            # We do not care about the error, but we want to continue
-            # our daemon worker.
-            pass
+    lookups_total: Counter = field(factory=Counter, init=False)
+    """Number of finished lookups by result, "success" or "failure"."""
 
-        image_shas_uris_queue.task_done()
+    # registry -> heap of (-creation time, submission order, sha, image URI)
+    _queues: dict[str, list[tuple[float, int, str, str]]] = field(
+        factory=dict, init=False
+    )
+    # registry -> number of lookups running against it
+    _active: Counter = field(factory=Counter, init=False)
+    _submissions: Iterator[int] = field(factory=itertools.count, init=False)
+    # shas queued or being looked up
+    _in_flight: set[str] = field(factory=set, init=False)
+    # bucket counts of the lookup latency, the last one is +Inf
+    _latency_buckets: list[int] = field(
+        factory=lambda: [0] * (len(LOOKUP_SECONDS_BUCKETS) + 1), init=False
+    )
+    _latency_sum: float = field(default=0.0, init=False)
+    _threads: list[threading.Thread] = field(factory=list, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+    # notified when images are queued and when lookups end
+    _changed: threading.Condition = field(
+        default=Factory(lambda self: threading.Condition(self._lock), takes_self=True),
+        init=False,
+    )
 
+    @property
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(len(queued) for queued in self._queues.values())
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def submit(self, sha_256: str, image_uri: str, created_at: float = 0.0) -> bool:
+        """
+        Queue the lookup of the image's labels,
+        unless they are stored, the image is already queued,
+        or it failed too many times recently.
+        Images with a later `created_at` timestamp are looked up first.
+        Returns whether it was queued.
+        """
+        if sha_256 in self.store:
+            return False
+        if not self.store.should_retry(sha_256):
+            logging.debug(f"Skipping image labels lookup for: {sha_256}")
+            return False
+        registry = ImageReference.parse(image_uri).registry
+        with self._changed:
+            if sha_256 in self._in_flight:
+                return False
+            self._in_flight.add(sha_256)
+            if not self._threads:
+                self._start()
+            logging.debug(f"Adding SHA256 to the image labels queue: {sha_256}")
+            heapq.heappush(
+                self._queues.setdefault(registry, []),
+                (-created_at, next(self._submissions), sha_256, image_uri),
+            )
+            self._changed.notify_all()
+        return True
 
-# Start the daemon thread which checks for the queue and gathers
-# labels for the queued items.
-skopeo_cache_thread = threading.Thread(target=_skopeo_worker, daemon=True)
-skopeo_cache_thread.start()
+    def join(self) -> None:
+        "Wait until every queued image was looked up."
+        with self._changed:
+            self._changed.wait_for(lambda: not self._in_flight)
+
+    def wait(self, shas: Iterable[str], timeout: float) -> bool:
+        """
+        Wait up to `timeout` seconds until the lookups of the given images ended.
+        Returns whether they all did.
+        """
+        shas = set(shas)
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self._in_flight.isdisjoint(shas), timeout
+            )
+
+    def _start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"pelorus-image-labels-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _next(self) -> Optional[Tuple[str, str, str]]:
+        """
+        Take the newest queued image of the registries that have a lookup slot free.
+        Returns its registry, sha and URI, or None. Call with the lock held.
+        """
+        ready = [
+            (queued[0], registry)
+            for registry, queued in self._queues.items()
+            if self._active[registry] < self.workers_per_registry
+        ]
+        if not ready:
+            return None
+        (_, _, sha_256, image_uri), registry = min(ready)
+        queued = self._queues[registry]
+        heapq.heappop(queued)
+        if not queued:
+            del self._queues[registry]
+        self._active[registry] += 1
+        return registry, sha_256, image_uri
+
+    def _work(self) -> None:
+        while True:
+            with self._changed:
+                registry, sha_256, image_uri = self._changed.wait_for(self._next)
+            try:
+                self._look_up(sha_256, image_uri)
+            except Exception:
+                # We do not care about the error, but we want to continue
+                # our daemon worker.
+                logging.debug("Image labels worker failed", exc_info=True)
+            finally:
+                with self._changed:
+                    self._active[registry] -= 1
+                    self._in_flight.discard(sha_256)
+                    self._changed.notify_all()
+
+    def _look_up(self, sha_256: str, image_uri: str) -> None:
+        start = time.monotonic()
+        try:
+            labels = get_labels_from_image(image_uri, self.timeout)
+        except ImageLabelsException:
+            self.store.record_failure(sha_256)
+            result = "failure"
+        else:
+            self.store.put(
+                sha_256,
+                ImageCommit(labels.get(self.hash_label), labels.get(self.date_label)),
+            )
+            result = "success"
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.lookups_total[result] += 1
+            self._latency_sum += elapsed
+            self._latency_buckets[
+                bisect.bisect_left(LOOKUP_SECONDS_BUCKETS, elapsed)
+            ] += 1
+
+    def metrics(self) -> Iterable[Metric]:
+        queued = GaugeMetricFamily(
+            "pelorus_image_labels_queue_depth",
+            "Number of images waiting for their labels to be looked up",
+        )
+        queued.add_metric([], self.queue_depth)
+        yield queued
 
+        lookups = CounterMetricFamily(
+            "pelorus_image_label_lookups",
+            "Number of finished image label lookups",
+            labels=["result"],
+        )
+        with self._lock:
+            for result in ("success", "failure"):
+                lookups.add_metric([result], self.lookups_total[result])
+            buckets = []
+            cumulative = 0
+            for bound, count in zip(
+                [*LOOKUP_SECONDS_BUCKETS, float("inf")], self._latency_buckets
+            ):
+                cumulative += count
+                buckets.append((floatToGoString(bound), cumulative))
+            latency_sum = self._latency_sum
+        yield lookups
+
+        latency = HistogramMetricFamily(
+            "pelorus_image_label_lookup_seconds",
+            "Time taken to look the labels of an image up",
+        )
+        latency.add_metric([], buckets, latency_sum)
+        yield latency
 
-def _add_image_to_get_label_queue(sha_256: str, image_uri: str) -> None:
-    """
-    Function that puts the sha and corresponding image uri to the queue
-    to be processed by our skopeo worker Thread.
-    """
 
-    with image_label_cache_lock:
-        if sha_256 in image_label_cache:
-            return
-    #    TODO_1: Do not add to queue if already there
-    #    with skopeo_lock:
-    #        if sha_256 in sha_in_queue:
-    #            return
-    logging.debug(f"Adding SHA256 to the SKOPEO queue: {sha_256}")
-    image_shas_uris_queue.put({sha_256: image_uri})
-
-
-def _set_commit_metadata(
-    pod: ResourceField,
-    date_label: str,
-    hash_label: str,
-    sha_256: str,
-    date_format: str = None,
-) -> None:
-    with image_label_cache_lock:
-        labels = image_label_cache.get(sha_256, None)
-        if labels and isinstance(labels, Tuple) and isinstance(labels[0], dict):
-            pod.metadata.commit_hash = labels[0].get(hash_label)
-            commit_time = labels[0].get(date_label)
-            if commit_time:
-                try:
-                    pod.metadata.commit_timestamp = to_epoch_from_string(
-                        commit_time
-                    ).timestamp()
-                except (ValueError, AttributeError):
-                    try:
-                        # Do nothing here as we tried with EPOCH timestamp
-                        pod.metadata.commit_timestamp = parse_guessing_timezone_DYNAMIC(
-                            commit_time, format=date_format
-                        ).timestamp()
-                    except ValueError:
-                        logging.debug(f"Can't get commit timestamp for sha: {sha_256}")
+def _created_at(pod: ResourceField) -> float:
+    "The creation time of the pod, 0 if unknown."
+    try:
+        return parse_assuming_utc(
+            pod.metadata.creationTimestamp, _CREATION_TIMESTAMP_FORMAT
+        ).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
 
 
 @define(kw_only=True)
@@ -260,15 +310,61 @@ class ContainerImageCommitCollector(AbstractCommitCollector):
     date_annotation_name: str = CommitMetric._ANNOTATION_MAPPIG["commit_time"]
     hash_annotation_name: str = CommitMetric._ANNOTATION_MAPPIG["commit_hash"]
 
+    label_workers: ImageLabelWorkers = field(
+        default=Factory(
+            lambda self: ImageLabelWorkers(
+                hash_label=self.hash_annotation_name,
+                date_label=self.date_annotation_name,
+            ),
+            takes_self=True,
+        )
+    )
+    label_wait: float = field(default=0.0, converter=float)
+    """
+    Seconds a collection waits for the lookups of the images of running pods,
+    so new images get their metric on the same scrape. 0 to not wait.
+    """
+
     def get_commit_time(self, metric) -> Optional[CommitMetric]:
         return super().get_commit_time(metric)
 
+    def collect(self):
+        yield from super().collect()
+        yield from self.label_workers.metrics()
+
+    def _commit_of(self, sha_256: str) -> Tuple[Optional[str], Optional[float]]:
+        """
+        The commit hash and timestamp of the image, from its stored labels.
+        They aren't set on the pod, which may be shared by the watch cache.
+        """
+        commit = self.label_workers.store.get(sha_256)
+        if commit is None:
+            return None, None
+        return commit.commit_hash, self._commit_timestamp(sha_256, commit.commit_date)
+
+    def _commit_timestamp(
+        self, sha_256: str, commit_time: Optional[str]
+    ) -> Optional[float]:
+        if not commit_time:
+            return None
+        try:
+            return to_epoch_from_string(commit_time).timestamp()
+        except (ValueError, AttributeError):
+            try:
+                # Do nothing here as we tried with EPOCH timestamp
+                return parse_guessing_timezone_DYNAMIC(
+                    commit_time, format=self.date_format
+                ).timestamp()
+            except ValueError:
+                logging.debug(f"Can't get commit timestamp for sha: {sha_256}")
+                return None
+
     # overrides collector_base.generate_metric()
     def generate_metrics(self) -> Iterable[CommitMetric]:
         metrics = []
 
         namespaces = get_and_log_namespaces(
-            self.kube_client, self.namespaces, self.prod_label
+            self.kube_client, self.namespaces, self.prod_label, self.cache
         )
 
         if not namespaces:
@@ -276,38 +372,45 @@ class ContainerImageCommitCollector(AbstractCommitCollector):
 
         logging.debug("generate_metrics: start")
 
-        _clear_cleanup_set()
-
-        pods = get_running_pods(self.kube_client, namespaces, self.app_label)
+        pods = get_running_pods(
+            self.kube_client, namespaces, self.app_label, cache=self.cache
+        )
 
         # Build dictionary with controllers and retrieved pods
         replica_pods_dict = filter_pods_by_replica_uid(pods)
 
-        for pod in replica_pods_dict.values():
-            # Since a commit will be built into a particular image and there could be multiple
-            # containers (images) per pod, we will push one metric per image/container in the
-            # pod template
-            images = get_images_from_pod(pod)
-
-            for sha, image_uri in images.items():
-                _add_to_cleanup_set(sha)
-                _add_image_to_get_label_queue(sha, image_uri)
-                _set_commit_metadata(
-                    pod,
-                    self.date_annotation_name,
-                    self.hash_annotation_name,
-                    sha,
-                    self.date_format,
+        # Since a commit will be built into a particular image and there could be multiple
+        # containers (images) per pod, we will push one metric per image/container in the
+        # pod template
+        images = [
+            (pod, sha, image_uri)
+            for pod in replica_pods_dict.values()
+            for sha, image_uri in get_images_from_pod(pod).items()
+        ]
+        # images of running pods, kept in the store even when not used for a while
+        in_use = {sha for _, sha, _ in images}
+
+        for pod, sha, image_uri in images:
+            self.label_workers.submit(sha, image_uri, _created_at(pod))
+        if self.label_wait > 0 and not self.label_workers.wait(in_use, self.label_wait):
+            logging.debug(
+                "Some image labels were not looked up within %ss, "
+                "their metrics are left for a later scrape",
+                self.label_wait,
+            )
+
+        for pod, sha, _ in images:
+            commit_hash, commit_timestamp = self._commit_of(sha)
+            if commit_timestamp and commit_hash:
+                metric = CommitMetric(
+                    name=pod.metadata.labels[self.app_label],
+                    namespace=pod.metadata.namespace,
+                    commit_hash=commit_hash,
+                    commit_timestamp=commit_timestamp,
+                    image_hash=sha,
                 )
-                if pod.metadata.commit_timestamp and pod.metadata.commit_hash:
-                    metric = CommitMetric(
-                        name=pod.metadata.labels[self.app_label],
-                        namespace=pod.metadata.namespace,
-                        labels=pod.metadata.labels,
-                        commit_hash=pod.metadata.commit_hash,
-                        commit_timestamp=pod.metadata.commit_timestamp,
-                        image_hash=sha,
-                    )
-                    yield metric
-
-        _cleanup_cache()
+                yield metric
+
+        store = self.label_workers.store
+        store.expire(in_use)
+        store.flush()
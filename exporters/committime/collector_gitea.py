@@ -1,13 +1,12 @@
 import logging
 
 import attrs
-import requests
 from attrs import define, field
 
 from committime import CommitMetric
 from pelorus.config.converters import pass_through
 from pelorus.timeutil import parse_assuming_utc, second_precision
-from pelorus.utils import Url, set_up_requests_session
+from pelorus.utils import HttpClient, Url, set_up_requests_session
 
 from .collector_base import AbstractCommitCollector, UnsupportedGITProvider
 
@@ -18,7 +17,7 @@ DEFAULT_GITEA_API = Url.parse("https://try.gitea.io")
 
 @define(kw_only=True)
 class GiteaCommitCollector(AbstractCommitCollector):
-    session: requests.Session = field(factory=requests.Session, init=False)
+    session: HttpClient = field(factory=HttpClient, init=False)
 
     # overrides with default
     git_api: Url = field(
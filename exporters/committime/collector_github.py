@@ -1,13 +1,18 @@
 import logging
 
 import attrs
-import requests
 from attrs import define, field
 
 from committime import CommitMetric
 from pelorus.config.converters import pass_through
-from pelorus.utils import Url, set_up_requests_session
-from provider_common.github import parse_datetime
+from pelorus.utils import HttpClient, Url, set_up_requests_session
+from provider_common.github import (
+    RateLimitBudget,
+    get_github,
+    parse_datetime,
+    rate_limit_budget,
+    rate_limit_metrics,
+)
 
 from .collector_base import AbstractCommitCollector, UnsupportedGITProvider
 
@@ -16,7 +21,8 @@ DEFAULT_GITHUB_API = Url.parse("api.github.com")
 
 @define(kw_only=True)
 class GitHubCommitCollector(AbstractCommitCollector):
-    session: requests.Session = field(factory=requests.Session, init=False)
+    session: HttpClient = field(factory=HttpClient, init=False)
+    _budget: RateLimitBudget = field(init=False)
 
     # overrides with default
     git_api: Url = field(
@@ -31,6 +37,11 @@ class GitHubCommitCollector(AbstractCommitCollector):
         set_up_requests_session(
             self.session, self.tls_verify, username=self.username, token=self.token
         )
+        self._budget = rate_limit_budget(self.token)
+
+    def collect(self):
+        yield from super().collect()
+        yield from rate_limit_metrics()
 
     def get_commit_time(self, metric: CommitMetric):
         """Method called to collect data and send to Prometheus"""
@@ -52,7 +63,8 @@ class GitHubCommitCollector(AbstractCommitCollector):
             hash=metric.commit_hash,
         )
         url = self.git_api._replace(path=path).url
-        response = self.session.get(url)
+        # Commit times are stored once found, so lookups can wait for a later cycle
+        response = get_github(self.session, url, self._budget, priority=False)
         if response.status_code != 200:
             # This will occur when trying to make an API call to non-Github
             logging.warning(
@@ -16,14 +16,14 @@
 #
 
 import logging
+import threading
 
 import gitlab
-import requests
 from attrs import define, field
 
 from committime import CommitMetric
 from pelorus.timeutil import parse_tz_aware
-from pelorus.utils import set_up_requests_session
+from pelorus.utils import HttpClient, set_up_requests_session
 
 from .collector_base import AbstractCommitCollector, UnsupportedGITProvider
 
@@ -32,7 +32,11 @@ _DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
 
 @define(kw_only=True)
 class GitLabCommitCollector(AbstractCommitCollector):
-    session: requests.Session = field(factory=requests.Session, init=False)
+    session: HttpClient = field(factory=HttpClient, init=False)
+
+    # git server -> client, reused by all the metrics of the server
+    _gitlab_clients: dict[str, gitlab.Gitlab] = field(factory=dict, init=False)
+    _gitlab_clients_lock: threading.Lock = field(factory=threading.Lock, init=False)
 
     def __attrs_post_init__(self):
         super().__attrs_post_init__()
@@ -44,27 +48,33 @@ class GitLabCommitCollector(AbstractCommitCollector):
         """Method to connect to Gitlab instance."""
         git_server = metric.git_server
 
-        gitlab_client = None
-
-        if self.token:
-            # Private or personal token
-            logging.debug("Connecting to GitLab server using token: %s" % (git_server))
-            gitlab_client = gitlab.Gitlab(
-                git_server,
-                private_token=self.token,
-                api_version=4,
-                session=self.session,
-            )
-        else:
-            # Public repo without token
-            logging.debug(
-                "Connecting to GitLab server without token: %s" % (git_server)
-            )
-            gitlab_client = gitlab.Gitlab(
-                git_server, api_version=4, session=self.session
-            )
-
-        return gitlab_client
+        with self._gitlab_clients_lock:
+            gitlab_client = self._gitlab_clients.get(git_server)
+            if gitlab_client is not None:
+                return gitlab_client
+
+            if self.token:
+                # Private or personal token
+                logging.debug(
+                    "Connecting to GitLab server using token: %s" % (git_server)
+                )
+                gitlab_client = gitlab.Gitlab(
+                    git_server,
+                    private_token=self.token,
+                    api_version=4,
+                    session=self.session.session(git_server),
+                )
+            else:
+                # Public repo without token
+                logging.debug(
+                    "Connecting to GitLab server without token: %s" % (git_server)
+                )
+                gitlab_client = gitlab.Gitlab(
+                    git_server, api_version=4, session=self.session.session(git_server)
+                )
+
+            self._gitlab_clients[git_server] = gitlab_client
+            return gitlab_client
 
     # base class impl
     def get_commit_time(self, metric: CommitMetric):
@@ -18,14 +18,22 @@
 import logging
 from typing import Iterable, Optional
 
-from attrs import define
+from attrs import define, field
 
-from committime import CommitMetric
+from committime import CommitMetric, pick_annotations
 from pelorus.timeutil import parse_guessing_timezone_DYNAMIC, to_epoch_from_string
-from pelorus.utils import collect_bad_attribute_path_error, get_nested
+from pelorus.utils import (
+    collect_bad_attribute_path_error,
+    get_nested,
+    paginate_resource,
+)
 
 from .collector_base import AbstractCommitCollector
 
+# Number of Images requested at once. Images are large, as they carry their
+# whole dockerImageMetadata, so only this many are held in memory at a time.
+DEFAULT_IMAGE_PAGE_SIZE = 500
+
 
 @define(kw_only=True)
 class ImageCommitCollector(AbstractCommitCollector):
@@ -33,6 +41,15 @@ class ImageCommitCollector(AbstractCommitCollector):
 
     date_annotation_name: str = CommitMetric._ANNOTATION_MAPPIG["commit_time"]
 
+    image_page_size: int = field(default=DEFAULT_IMAGE_PAGE_SIZE, converter=int)
+
+    # Image name, which is its digest -> (resourceVersion, metric or None if data is missing).
+    # The image content never changes, but its labels and annotations may,
+    # in which case its resourceVersion changes too.
+    _metrics_by_image: dict[str, tuple[Optional[str], Optional[CommitMetric]]] = field(
+        factory=dict, init=False
+    )
+
     # maps attributes to their location in a `image.openshift.io/v1`.
     # Similar to Build Mapping from committime.__init__.py
     _IMAGE_MAPPING = dict(
@@ -82,6 +99,10 @@ class ImageCommitCollector(AbstractCommitCollector):
                 value = get_nested(image, path, name="image")
                 setattr(metric, attr_name, value)
 
+        metric.annotations = pick_annotations(
+            metric.annotations, (self.date_annotation_name, self.hash_annotation_name)
+        )
+
         # First get metrics within Labels
         attribute_mapping = (
             ImageCommitCollector._DOCKER_LABEL_MAPPING.items() if image_labels else []
@@ -152,8 +173,6 @@ class ImageCommitCollector(AbstractCommitCollector):
 
     # overrides collector_base.generate_metric()
     def generate_metrics(self) -> Iterable[CommitMetric]:
-        # Initialize metrics list
-        metrics = []
         app_label = self.app_label
 
         logging.debug("Searching for images with label: %s" % app_label)
@@ -162,41 +181,56 @@ class ImageCommitCollector(AbstractCommitCollector):
             api_version="image.openshift.io/v1", kind="Image"
         )
 
-        images = v1_images.get(label_selector=app_label)
-
-        images_by_app = self._get_openshift_obj_by_app(images)
-
-        if images_by_app:
-            metrics += self._get_metrics_by_apps_from_images(images_by_app)
-
-        return metrics
-
-    def _get_metrics_by_apps_from_images(self, images_by_app):
-        metrics = []
-        for app in images_by_app:
-            images = images_by_app[app]
-            for image in images:
-                metric = None
-                errors = []
+        # Images are processed page by page as they are received,
+        # so they are not all held in memory at once.
+        images = paginate_resource(
+            v1_images, dict(label_selector=app_label), limit=self.image_page_size
+        )
+        # only the images still listed are remembered
+        metrics_by_image = {}
+        processed = 0
+        for image in images:
+            labels = image.metadata.labels
+            app = labels[app_label] if labels else None
+            if app is None:
+                continue
+
+            name = image.metadata.name
+            version = image.metadata.resourceVersion
+            memo = self._metrics_by_image.get(name)
+            if memo is None or memo[0] != version:
+                memo = (version, self._get_metric_from_image(app, image))
+                processed += 1
+            metrics_by_image[name] = memo
+            if memo[1]:
+                yield memo[1]
+
+        self._metrics_by_image = metrics_by_image
+        logging.debug(
+            "Processed %d new or changed images out of %d",
+            processed,
+            len(metrics_by_image),
+        )
 
-                try:
-                    metric = self.commit_metric_from_image(app, image, errors)
-                except Exception:
-                    logging.error(
-                        "Cannot collect metrics from image: %s" % (image.metadata.name)
-                    )
-                    raise
+    def _get_metric_from_image(self, app: str, image) -> Optional[CommitMetric]:
+        errors = []
 
-                if errors:
-                    msg = (
-                        f"Missing data for CommitTime metric from Image "
-                        f"{metric.image_hash} in app {app}: "
-                        f"{'.'.join(str(e) for e in errors)}"
-                    )
-                    logging.warning(msg)
-                    continue
+        try:
+            metric = self.commit_metric_from_image(app, image, errors)
+        except Exception:
+            logging.error(
+                "Cannot collect metrics from image: %s" % (image.metadata.name)
+            )
+            raise
 
-                logging.debug("Adding metric for app %s" % app)
-                metrics.append(metric)
+        if errors:
+            msg = (
+                f"Missing data for CommitTime metric from Image "
+                f"{metric.image_hash} in app {app}: "
+                f"{'.'.join(str(e) for e in errors)}"
+            )
+            logging.warning(msg)
+            return None
 
-        return metrics
+        logging.debug("Adding metric for app %s" % app)
+        return metric
@@ -0,0 +1,239 @@
+"""
+Stores of the commit times looked up by the committime collectors.
+
+A commit's time never changes, so once it is looked up it can be kept
+for as long as the commit is in use. The stores are keyed by repository URL
+and commit hash, and bounded: the least recently used entries are evicted.
+
+`SQLiteCommitTimeStore` also persists entries to a file, and loads them back
+when the exporter starts, so a restart doesn't look every commit up again.
+
+`CommitLookupFailures` is the negative counterpart: it remembers the commits
+whose lookup failed, so they are retried with an exponential backoff instead
+of on every collection.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from attrs import define, field
+
+DEFAULT_MAX_ENTRIES = 10_000
+
+# Delay before the first retry of a failed commit lookup, doubled after each failure
+DEFAULT_FAILURE_BACKOFF_SECONDS = 60
+# Once a commit failed DEFAULT_FAILURE_MAX_RETRIES times, it is only retried
+# after DEFAULT_FAILURE_MAX_BACKOFF_SECONDS, the same as the image label failures
+DEFAULT_FAILURE_MAX_RETRIES = 5
+DEFAULT_FAILURE_MAX_BACKOFF_SECONDS = 60 * 60 * 24 * 2
+
+CommitKey = tuple[str, str]
+
+
+class CommitTimeStore(ABC):
+    "Commit timestamps by (repo URL, commit hash)."
+
+    @abstractmethod
+    def get(self, repo_url: Optional[str], commit_hash: str) -> Optional[float]:
+        "Get the timestamp of the commit, or None if it is not stored."
+        pass
+
+    @abstractmethod
+    def put(self, repo_url: Optional[str], commit_hash: str, timestamp: float) -> None:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    def flush(self) -> None:
+        "Write pending changes, if the store batches them. Called after each collection."
+        pass
+
+
+def _key(repo_url: Optional[str], commit_hash: str) -> CommitKey:
+    return (repo_url or "", commit_hash)
+
+
+@define(eq=False)
+class MemoryCommitTimeStore(CommitTimeStore):
+    "In-memory LRU store of at most `max_entries` commits."
+
+    max_entries: int = field(default=DEFAULT_MAX_ENTRIES, converter=int)
+
+    _entries: OrderedDict[CommitKey, float] = field(factory=OrderedDict, init=False)
+    _lock: threading.RLock = field(factory=threading.RLock, init=False)
+
+    def get(self, repo_url: Optional[str], commit_hash: str) -> Optional[float]:
+        key = _key(repo_url, commit_hash)
+        with self._lock:
+            timestamp = self._entries.get(key)
+            if timestamp is not None:
+                self._entries.move_to_end(key)
+            return timestamp
+
+    def put(self, repo_url: Optional[str], commit_hash: str, timestamp: float) -> None:
+        key = _key(repo_url, commit_hash)
+        with self._lock:
+            self._entries[key] = timestamp
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                logging.debug("Evicted commit %s of %s from the store", *evicted[::-1])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@define(eq=False)
+class SQLiteCommitTimeStore(MemoryCommitTimeStore):
+    """
+    LRU store persisted to an SQLite database at `path`.
+
+    Lookups are served from memory. New entries are written right away,
+    while the recency of lookups is written, and the database trimmed to
+    `max_entries`, when the store is flushed.
+    """
+
+    path: str = field(kw_only=True)
+
+    _connection: sqlite3.Connection = field(init=False)
+    # last time each key was read since the last flush
+    _touched: dict[CommitKey, float] = field(factory=dict, init=False)
+
+    def __attrs_post_init__(self):
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS commit_times (
+                    repo_url TEXT NOT NULL,
+                    commit_hash TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (repo_url, commit_hash)
+                )"""
+            )
+        self._warm()
+
+    def _warm(self) -> None:
+        "Load the most recently used entries, oldest first to keep the LRU order."
+        rows = self._connection.execute(
+            "SELECT repo_url, commit_hash, timestamp FROM commit_times"
+            " ORDER BY last_used DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for repo_url, commit_hash, timestamp in reversed(rows):
+            super().put(repo_url, commit_hash, timestamp)
+        logging.info("Loaded %d commit times from %s", len(rows), self.path)
+
+    def get(self, repo_url: Optional[str], commit_hash: str) -> Optional[float]:
+        timestamp = super().get(repo_url, commit_hash)
+        if timestamp is not None:
+            with self._lock:
+                self._touched[_key(repo_url, commit_hash)] = time.time()
+        return timestamp
+
+    def put(self, repo_url: Optional[str], commit_hash: str, timestamp: float) -> None:
+        super().put(repo_url, commit_hash, timestamp)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO commit_times VALUES (?, ?, ?, ?)",
+                (*_key(repo_url, commit_hash), timestamp, time.time()),
+            )
+
+    def flush(self) -> None:
+        with self._lock, self._connection:
+            touched, self._touched = self._touched, {}
+            self._connection.executemany(
+                "UPDATE commit_times SET last_used = ?"
+                " WHERE repo_url = ? AND commit_hash = ?",
+                ((used, *key) for key, used in touched.items()),
+            )
+            self._connection.execute(
+                "DELETE FROM commit_times WHERE rowid NOT IN"
+                " (SELECT rowid FROM commit_times ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
+
+
+@define(eq=False)
+class CommitLookupFailures:
+    """
+    Negative cache of the commits whose lookup failed.
+
+    After its n-th failure, a commit is not looked up again for
+    `backoff * 2 ** (n - 1)` seconds, capped at `max_backoff`.
+    After `max_retries` failures, it is only retried every `max_backoff` seconds.
+    """
+
+    backoff: float = DEFAULT_FAILURE_BACKOFF_SECONDS
+    max_backoff: float = DEFAULT_FAILURE_MAX_BACKOFF_SECONDS
+    max_retries: int = DEFAULT_FAILURE_MAX_RETRIES
+    max_entries: int = DEFAULT_MAX_ENTRIES
+
+    failures_total: int = field(default=0, init=False)
+    """Number of failed lookups."""
+    skipped_total: int = field(default=0, init=False)
+    """Number of lookups skipped because the commit was backing off."""
+
+    # key -> (number of failures, time the commit can be looked up again)
+    _failures: OrderedDict[CommitKey, tuple[int, float]] = field(
+        factory=OrderedDict, init=False
+    )
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def should_retry(self, repo_url: Optional[str], commit_hash: str) -> bool:
+        "Whether the commit can be looked up now. Counts a skipped lookup if not."
+        with self._lock:
+            failure = self._failures.get(_key(repo_url, commit_hash))
+            if failure is None or time.time() >= failure[1]:
+                return True
+            self.skipped_total += 1
+            return False
+
+    def record_failure(self, repo_url: Optional[str], commit_hash: str) -> None:
+        key = _key(repo_url, commit_hash)
+        with self._lock:
+            count = self._failures.pop(key, (0, 0.0))[0] + 1
+            if count >= self.max_retries:
+                delay = self.max_backoff
+            else:
+                delay = min(self.backoff * 2 ** (count - 1), self.max_backoff)
+            self._failures[key] = (count, time.time() + delay)
+            self.failures_total += 1
+            while len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
+        logging.debug(
+            "Lookup of commit %s of %s failed %d times, retrying in %ss",
+            commit_hash,
+            repo_url,
+            count,
+            delay,
+        )
+
+    def record_success(self, repo_url: Optional[str], commit_hash: str) -> None:
+        with self._lock:
+            self._failures.pop(_key(repo_url, commit_hash), None)
+
+    def __len__(self) -> int:
+        return len(self._failures)
+
+
+def make_commit_time_store(
+    path: Optional[str], max_entries: int = DEFAULT_MAX_ENTRIES
+) -> CommitTimeStore:
+    "Persist the store to `path` if it is given, otherwise keep it in memory."
+    if path:
+        return SQLiteCommitTimeStore(max_entries, path=path)
+    return MemoryCommitTimeStore(max_entries)
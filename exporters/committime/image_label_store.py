@@ -0,0 +1,265 @@
+"""
+Stores of the commit labels of container images, for the containerimage collector.
+
+Images are addressed by digest and immutable, so their labels can be kept for
+as long as they are in use. Only the two labels the collector reads, the commit
+hash and date, are stored. The images whose lookup failed are stored as well,
+so they are retried after a backoff instead of on every collection.
+
+Entries are evicted when the store is full, least recently used first, and when
+they were not used for `max_age` seconds. `SQLiteImageLabelStore` also persists
+entries to a file, and loads them back when the exporter starts, so a restart
+doesn't look every running image up again.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from attrs import define, field, frozen
+
+DEFAULT_MAX_ENTRIES = 10_000
+# Entries not used for a day are evicted
+DEFAULT_MAX_AGE_SECONDS = 60 * 60 * 24
+
+# An image is looked up again right away after each of its first
+# DEFAULT_FAILURE_MAX_RETRIES failures, then only after DEFAULT_FAILURE_BACKOFF_SECONDS.
+DEFAULT_FAILURE_MAX_RETRIES = 3
+DEFAULT_FAILURE_BACKOFF_SECONDS = 60 * 60 * 24 * 2
+
+
+@frozen
+class ImageCommit:
+    "The commit labels of an image."
+
+    commit_hash: Optional[str]
+    commit_date: Optional[str]
+
+
+@define(eq=False)
+class MemoryImageLabelStore:
+    "In-memory store of the commit labels and lookup failures of images, by digest."
+
+    max_entries: int = field(default=DEFAULT_MAX_ENTRIES, converter=int)
+    max_age: float = field(default=DEFAULT_MAX_AGE_SECONDS, converter=float)
+    failure_max_retries: int = DEFAULT_FAILURE_MAX_RETRIES
+    failure_backoff: float = DEFAULT_FAILURE_BACKOFF_SECONDS
+
+    # digest -> (commit labels, last time used)
+    _entries: OrderedDict[str, tuple[ImageCommit, float]] = field(
+        factory=OrderedDict, init=False
+    )
+    # digest -> (number of failures, time of the last failure)
+    _failures: dict[str, tuple[int, float]] = field(factory=dict, init=False)
+    _lock: threading.RLock = field(factory=threading.RLock, init=False)
+
+    def get(self, sha_256: str) -> Optional[ImageCommit]:
+        with self._lock:
+            entry = self._entries.get(sha_256)
+            if entry is None:
+                return None
+            self._touch(sha_256, entry[0])
+            return entry[0]
+
+    def __contains__(self, sha_256: str) -> bool:
+        return sha_256 in self._entries
+
+    def put(self, sha_256: str, commit: ImageCommit) -> None:
+        with self._lock:
+            self._failures.pop(sha_256, None)
+            self._touch(sha_256, commit)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                logging.debug("Evicted image %s from the label store", evicted)
+
+    def _touch(self, sha_256: str, commit: ImageCommit) -> None:
+        self._entries[sha_256] = (commit, time.time())
+        self._entries.move_to_end(sha_256)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # region failures
+
+    def should_retry(self, sha_256: str) -> bool:
+        """
+        Whether the image can be looked up: it never failed, failed fewer than
+        `failure_max_retries` times, or its last failure is older than `failure_backoff`.
+        """
+        with self._lock:
+            failure = self._failures.get(sha_256)
+        if failure is None:
+            return True
+        count, failed_at = failure
+        return (
+            count < self.failure_max_retries
+            or time.time() - failed_at > self.failure_backoff
+        )
+
+    def record_failure(self, sha_256: str) -> None:
+        with self._lock:
+            count = self._failures.get(sha_256, (0, 0.0))[0] + 1
+            self._failures[sha_256] = (count, time.time())
+        logging.debug("Lookup of the labels of %s failed %d times", sha_256, count)
+
+    def has_failed(self, sha_256: str) -> bool:
+        return sha_256 in self._failures
+
+    @property
+    def failures(self) -> int:
+        return len(self._failures)
+
+    # endregion
+
+    def expire(self, in_use: Iterable[str] = ()) -> None:
+        """
+        Mark the images in use as used now, then evict the entries
+        not used for `max_age` seconds, and the failures older than the backoff.
+        """
+        now = time.time()
+        with self._lock:
+            for sha_256 in in_use:
+                entry = self._entries.get(sha_256)
+                if entry is not None:
+                    self._touch(sha_256, entry[0])
+            expired = [
+                sha_256
+                for sha_256, (_, used_at) in self._entries.items()
+                if now - used_at > self.max_age
+            ]
+            for sha_256 in expired:
+                del self._entries[sha_256]
+            for sha_256, (_, failed_at) in list(self._failures.items()):
+                if now - failed_at > self.failure_backoff:
+                    del self._failures[sha_256]
+        if expired:
+            logging.debug("Expired %d images from the label store", len(expired))
+
+    def flush(self) -> None:
+        "Write pending changes, if the store batches them. Called after each collection."
+        pass
+
+
+@define(eq=False)
+class SQLiteImageLabelStore(MemoryImageLabelStore):
+    """
+    Image label store persisted to an SQLite database at `path`.
+
+    Lookups are served from memory. New entries and failures are written
+    right away, while the recency of lookups is written, and the database
+    expired and trimmed to `max_entries`, when the store is flushed.
+    """
+
+    path: str = field(kw_only=True)
+
+    _connection: sqlite3.Connection = field(init=False)
+    # digests used since the last flush
+    _touched: set[str] = field(factory=set, init=False)
+
+    def __attrs_post_init__(self):
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS image_commits (
+                    sha_256 TEXT PRIMARY KEY,
+                    commit_hash TEXT,
+                    commit_date TEXT,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS image_label_failures (
+                    sha_256 TEXT PRIMARY KEY,
+                    failures INTEGER NOT NULL,
+                    failed_at REAL NOT NULL
+                )"""
+            )
+        self._warm()
+
+    def _warm(self) -> None:
+        "Load the entries that did not expire, oldest first to keep the LRU order."
+        now = time.time()
+        rows = self._connection.execute(
+            "SELECT sha_256, commit_hash, commit_date, last_used FROM image_commits"
+            " WHERE last_used >= ? ORDER BY last_used DESC LIMIT ?",
+            (now - self.max_age, self.max_entries),
+        ).fetchall()
+        for sha_256, commit_hash, commit_date, last_used in reversed(rows):
+            self._entries[sha_256] = (ImageCommit(commit_hash, commit_date), last_used)
+        for sha_256, failures, failed_at in self._connection.execute(
+            "SELECT sha_256, failures, failed_at FROM image_label_failures"
+            " WHERE failed_at >= ?",
+            (now - self.failure_backoff,),
+        ):
+            self._failures[sha_256] = (failures, failed_at)
+        logging.info(
+            "Loaded %d image labels and %d failures from %s",
+            len(self._entries),
+            len(self._failures),
+            self.path,
+        )
+
+    def _touch(self, sha_256: str, commit: ImageCommit) -> None:
+        super()._touch(sha_256, commit)
+        self._touched.add(sha_256)
+
+    def put(self, sha_256: str, commit: ImageCommit) -> None:
+        super().put(sha_256, commit)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO image_commits VALUES (?, ?, ?, ?)",
+                (sha_256, commit.commit_hash, commit.commit_date, time.time()),
+            )
+            self._connection.execute(
+                "DELETE FROM image_label_failures WHERE sha_256 = ?", (sha_256,)
+            )
+
+    def record_failure(self, sha_256: str) -> None:
+        super().record_failure(sha_256)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO image_label_failures VALUES (?, ?, ?)",
+                (sha_256, *self._failures[sha_256]),
+            )
+
+    def flush(self) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            touched, self._touched = self._touched, set()
+            self._connection.executemany(
+                "UPDATE image_commits SET last_used = ? WHERE sha_256 = ?",
+                (
+                    (self._entries[sha_256][1], sha_256)
+                    for sha_256 in touched
+                    if sha_256 in self._entries
+                ),
+            )
+            self._connection.execute(
+                "DELETE FROM image_commits WHERE last_used < ? OR rowid NOT IN"
+                " (SELECT rowid FROM image_commits ORDER BY last_used DESC LIMIT ?)",
+                (now - self.max_age, self.max_entries),
+            )
+            self._connection.execute(
+                "DELETE FROM image_label_failures WHERE failed_at < ?",
+                (now - self.failure_backoff,),
+            )
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
+
+
+def make_image_label_store(
+    path: Optional[str],
+    max_entries: int = DEFAULT_MAX_ENTRIES,
+    max_age: float = DEFAULT_MAX_AGE_SECONDS,
+) -> MemoryImageLabelStore:
+    "Persist the store to `path` if it is given, otherwise keep it in memory."
+    if path:
+        return SQLiteImageLabelStore(max_entries, max_age, path=path)
+    return MemoryImageLabelStore(max_entries, max_age)
@@ -0,0 +1,293 @@
+"""
+Minimal client of the OCI distribution API, to read the labels of container images.
+
+Only what is needed to get the labels of an image by digest is implemented:
+the manifest (resolving image indexes to the manifest of one platform) and the
+config blob it points to. Registries asking for a bearer token get one
+anonymously, and the token is reused until it expires. Each registry gets its
+own pooled HTTP session, which trusts the certifi roots, Pelorus' custom
+certificates and the certificates in `ca_dir`, like `skopeo --cert-dir` did.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import requests
+from attrs import define, field, frozen
+
+from pelorus.certificates import set_up_requests_certs
+from pelorus.utils import HttpClient
+from pelorus.utils.resilience import NO_RETRY
+
+# The directory where ca.crt is mounted
+CA_CRT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount/"
+
+DEFAULT_TIMEOUT_SECONDS = 30
+DEFAULT_POOL_SIZE = 10
+# Lifetime of a token when the registry doesn't say, as the distribution spec says
+DEFAULT_TOKEN_EXPIRES_IN_SECONDS = 60
+
+DOCKER_HUB = "docker.io"
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+
+OCI_INDEX = "application/vnd.oci.image.index.v1+json"
+OCI_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+DOCKER_MANIFEST_LIST = "application/vnd.docker.distribution.manifest.list.v2+json"
+DOCKER_MANIFEST = "application/vnd.docker.distribution.manifest.v2+json"
+DOCKER_MANIFEST_V1 = "application/vnd.docker.distribution.manifest.v1+json"
+MANIFEST_MEDIA_TYPES = (
+    OCI_MANIFEST,
+    DOCKER_MANIFEST,
+    OCI_INDEX,
+    DOCKER_MANIFEST_LIST,
+    DOCKER_MANIFEST_V1,
+)
+INDEX_MEDIA_TYPES = {OCI_INDEX, DOCKER_MANIFEST_LIST}
+
+_CHALLENGE_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+
+class RegistryError(Exception):
+    "The registry didn't return the manifest or config of an image."
+
+
+@frozen
+class ImageReference:
+    registry: str
+    repository: str
+    reference: str
+    "A digest or a tag"
+
+    @classmethod
+    def parse(cls, image_uri: str) -> ImageReference:
+        """
+        Parse an image reference, such as the `docker://` URIs given to skopeo.
+
+        >>> ImageReference.parse("docker://quay.io/org/app@sha256:abc")
+        ImageReference(registry='quay.io', repository='org/app', reference='sha256:abc')
+        >>> ImageReference.parse("localhost:5000/app:v1")
+        ImageReference(registry='localhost:5000', repository='app', reference='v1')
+        >>> ImageReference.parse("python")
+        ImageReference(registry='registry-1.docker.io', repository='library/python', reference='latest')
+        """
+        name = image_uri.split("://", 1)[-1]
+        if "@" in name:
+            name, reference = name.split("@", 1)
+        elif ":" in name.rsplit("/", 1)[-1]:
+            name, reference = name.rsplit(":", 1)
+        else:
+            reference = "latest"
+
+        registry, _, repository = name.partition("/")
+        if not repository or not (
+            "." in registry or ":" in registry or registry == "localhost"
+        ):
+            registry, repository = DOCKER_HUB, name
+        if registry == DOCKER_HUB:
+            registry = DOCKER_HUB_REGISTRY
+            if "/" not in repository:
+                repository = f"library/{repository}"
+        return cls(registry, repository, reference)
+
+
+def _parse_json(response: requests.Response) -> dict:
+    try:
+        return response.json()
+    except ValueError as e:
+        raise RegistryError(f"Invalid JSON from {response.url}: {e}") from e
+
+
+@define(eq=False)
+class RegistryClient:
+    """
+    Reads image labels from registries, keeping a connection pool and
+    the bearer tokens of each registry between calls. Thread-safe.
+    """
+
+    ca_dir: Optional[str] = CA_CRT_DIR
+    timeout: float = DEFAULT_TIMEOUT_SECONDS
+    pool_size: int = DEFAULT_POOL_SIZE
+    scheme: str = "https"
+    "Only meant to be changed to reach a local registry in tests."
+    platform: tuple[str, str] = ("linux", "amd64")
+    "The (os, architecture) to pick from multi-platform images."
+
+    _http: Optional[HttpClient] = field(default=None, init=False)
+    # (registry, repository) -> (token, expiry time)
+    _tokens: dict[tuple[str, str], tuple[str, float]] = field(factory=dict, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def get_labels(
+        self, image_uri: str, timeout: Optional[float] = None
+    ) -> dict[str, str]:
+        """
+        Get the labels of the image, from its config.
+        If `timeout` is given, all the requests must be done within that many seconds.
+        """
+        image = ImageReference.parse(image_uri)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        manifest = self.get_manifest(image, deadline=deadline)
+        if "history" in manifest and "config" not in manifest:
+            # schema 1 manifests embed the config
+            config = json.loads(manifest["history"][0]["v1Compatibility"])
+        else:
+            config = self.get_blob(
+                image, manifest["config"]["digest"], deadline=deadline
+            )
+        return (config.get("config") or {}).get("Labels") or {}
+
+    def get_manifest(
+        self, image: ImageReference, *, deadline: Optional[float] = None
+    ) -> dict:
+        "Get the manifest of the image, resolving indexes to the configured platform."
+        response = self._get(
+            image,
+            f"manifests/{image.reference}",
+            headers={"Accept": ", ".join(MANIFEST_MEDIA_TYPES)},
+            deadline=deadline,
+        )
+        manifest = _parse_json(response)
+        media_type = manifest.get("mediaType") or response.headers.get(
+            "Content-Type", ""
+        )
+        if media_type.split(";")[0] not in INDEX_MEDIA_TYPES:
+            return manifest
+
+        digest = self._platform_digest(manifest, image)
+        return self.get_manifest(
+            ImageReference(image.registry, image.repository, digest), deadline=deadline
+        )
+
+    def get_blob(
+        self, image: ImageReference, digest: str, *, deadline: Optional[float] = None
+    ) -> dict:
+        "Get a JSON blob of the image's repository, verifying its digest."
+        response = self._get(image, f"blobs/{digest}", deadline=deadline)
+        algorithm, _, expected = digest.partition(":")
+        if algorithm == "sha256":
+            actual = hashlib.sha256(response.content).hexdigest()
+            if actual != expected:
+                raise RegistryError(f"Blob {digest} has digest sha256:{actual}")
+        return _parse_json(response)
+
+    def _platform_digest(self, index: dict, image: ImageReference) -> str:
+        manifests = index.get("manifests") or []
+        if not manifests:
+            raise RegistryError(f"Image index of {image} is empty")
+        os, architecture = self.platform
+        for manifest in manifests:
+            platform = manifest.get("platform") or {}
+            if (
+                platform.get("os") == os
+                and platform.get("architecture") == architecture
+            ):
+                return manifest["digest"]
+        return manifests[0]["digest"]
+
+    # region HTTP
+
+    def _session(self, registry: str) -> requests.Session:
+        with self._lock:
+            if self._http is None:
+                # addressed by digest, and the labels read from them are stored already
+                self._http = HttpClient(
+                    pool_size=self.pool_size,
+                    cache=None,
+                    # lookups have a deadline, and are retried on a later collection
+                    retry=NO_RETRY,
+                    verify=set_up_requests_certs(
+                        extra_files=sorted(Path(self.ca_dir).glob("*.crt"))
+                        if self.ca_dir
+                        else ()
+                    ),
+                )
+        return self._http.session(f"{self.scheme}://{registry}")
+
+    def _timeout(self, deadline: Optional[float]) -> float:
+        "The timeout of the next request, so it ends before the deadline."
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RegistryError("Timed out")
+        return min(self.timeout, remaining)
+
+    def _get(
+        self,
+        image: ImageReference,
+        path: str,
+        headers: Optional[dict] = None,
+        deadline: Optional[float] = None,
+    ) -> requests.Response:
+        session = self._session(image.registry)
+        url = f"{self.scheme}://{image.registry}/v2/{image.repository}/{path}"
+        headers = dict(headers or {})
+
+        token = self._cached_token(image)
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        response = session.get(url, headers=headers, timeout=self._timeout(deadline))
+
+        if response.status_code == 401:
+            challenge = response.headers.get("WWW-Authenticate", "")
+            if not challenge.lower().startswith("bearer"):
+                raise RegistryError(f"{url} requires authentication: {challenge}")
+            token = self._fetch_token(session, image, challenge, deadline)
+            headers["Authorization"] = f"Bearer {token}"
+            response = session.get(
+                url, headers=headers, timeout=self._timeout(deadline)
+            )
+
+        if not response.ok:
+            raise RegistryError(f"GET {url}: {response.status_code} {response.reason}")
+        return response
+
+    def _cached_token(self, image: ImageReference) -> Optional[str]:
+        with self._lock:
+            token, expires_at = self._tokens.get(
+                (image.registry, image.repository), (None, 0.0)
+            )
+        return token if time.time() < expires_at else None
+
+    def _fetch_token(
+        self,
+        session: requests.Session,
+        image: ImageReference,
+        challenge: str,
+        deadline: Optional[float] = None,
+    ) -> str:
+        params = dict(_CHALLENGE_PARAM.findall(challenge))
+        realm = params.pop("realm", None)
+        if not realm:
+            raise RegistryError(f"No realm in the challenge of {image.registry}")
+        params.setdefault("scope", f"repository:{image.repository}:pull")
+
+        logging.debug("Getting a token for %s from %s", image.repository, realm)
+        response = session.get(realm, params=params, timeout=self._timeout(deadline))
+        if not response.ok:
+            raise RegistryError(
+                f"Token request to {realm}: {response.status_code} {response.reason}"
+            )
+        body = _parse_json(response)
+        token = body.get("token") or body.get("access_token")
+        if not token:
+            raise RegistryError(f"No token in the response of {realm}")
+        expires_in = body.get("expires_in") or DEFAULT_TOKEN_EXPIRES_IN_SECONDS
+        with self._lock:
+            self._tokens[(image.registry, image.repository)] = (
+                token,
+                time.time() + expires_in,
+            )
+        return token
+
+    # endregion
+
+
+__all__ = ["CA_CRT_DIR", "ImageReference", "RegistryClient", "RegistryError"]
@@ -1,24 +1,33 @@
 import logging
-import time
-from typing import Iterable
+from typing import Any, Iterable, Optional
 
+import attrs
 from attrs import field, frozen
 from openshift.dynamic import DynamicClient
-from prometheus_client import start_http_server
-from prometheus_client.core import REGISTRY, GaugeMetricFamily
+from prometheus_client.core import GaugeMetricFamily
 
 import pelorus
 from deploytime import DeployTimeMetric
 from pelorus.config import load_and_log, no_env_vars
 from pelorus.config.converters import comma_separated
-from pelorus.timeutil import METRIC_TIMESTAMP_THRESHOLD_MINUTES, is_out_of_date
+from pelorus.runtime import run_exporter
+from pelorus.timeutil import (
+    METRIC_TIMESTAMP_THRESHOLD_MINUTES,
+    out_of_date_cutoff,
+    to_iso,
+)
 from provider_common import format_app_name
+from provider_common.informer import WatchCache, make_watch_cache
 from provider_common.openshift import (
+    convert_datetime,
     filter_pods_by_replica_uid,
+    filter_raw_pods_by_replica_uid,
     get_and_log_namespaces,
     get_images_from_pod,
-    get_owner_object_from_child,
+    get_images_from_raw_pod,
+    get_owner_creation_timestamps,
     get_running_pods,
+    namespace_query_planner,
 )
 
 
@@ -27,6 +36,9 @@ class DeployTimeCollector(pelorus.AbstractPelorusExporter):
     client: DynamicClient = field(metadata=no_env_vars())
     namespaces: set[str] = field(factory=set, converter=comma_separated(set))
     prod_label: str = field(default=pelorus.DEFAULT_PROD_LABEL)
+    cache: Optional[WatchCache] = field(default=None, metadata=no_env_vars())
+    raw_lists: bool = field(default=True, converter=attrs.converters.to_bool)
+    "List pods as plain dicts, without the watch cache."
 
     def __attrs_post_init__(self):
         if self.namespaces and (self.prod_label != pelorus.DEFAULT_PROD_LABEL):
@@ -42,44 +54,31 @@ class DeployTimeCollector(pelorus.AbstractPelorusExporter):
             labels=["namespace", "app", "image_sha"],
         )
 
-        number_of_dropped = 0
-
         for m in metrics:
-            if not is_out_of_date(str(m.deploy_time_timestamp)):
-                logging.debug(
-                    "Collected deploy_timestamp{namespace=%s, app=%s, image=%s} %s (%s)",
-                    m.namespace,
-                    m.name,
-                    m.image_sha,
-                    m.deploy_time_timestamp,
-                    m.deploy_time,
-                )
-                deploy_timestamp_metric.add_metric(
-                    [m.namespace, format_app_name(m.name), m.image_sha],
-                    m.deploy_time_timestamp,
-                    timestamp=m.deploy_time_timestamp,
-                )
-            else:
-                number_of_dropped += 1
-                logging.debug(
-                    "Deployment too old to be collected: deploy_timestamp{namespace=%s, app=%s, image=%s} %s (%s)",
-                    m.namespace,
-                    m.name,
-                    m.image_sha,
-                    m.deploy_time_timestamp,
-                    m.deploy_time_timestamp,
-                )
-        if number_of_dropped:
             logging.debug(
-                "Number of deployments that are older then %smin and won't be collected: %s",
-                METRIC_TIMESTAMP_THRESHOLD_MINUTES,
-                number_of_dropped,
+                "Collected deploy_timestamp{namespace=%s, app=%s, image=%s} %s (%s)",
+                m.namespace,
+                m.name,
+                m.image_sha,
+                m.deploy_time_timestamp,
+                m.deploy_time,
+            )
+            deploy_timestamp_metric.add_metric(
+                [m.namespace, format_app_name(m.name), m.image_sha],
+                m.deploy_time_timestamp,
+                timestamp=m.deploy_time_timestamp,
             )
         yield deploy_timestamp_metric
+        yield from namespace_query_planner.metrics()
 
     def generate_metrics(self) -> Iterable[DeployTimeMetric]:
+        """
+        The deployments of the running pods, deployed within the last
+        METRIC_TIMESTAMP_THRESHOLD_MINUTES. Older ones are pruned as early
+        as possible, before their owners are looked up or images parsed.
+        """
         namespaces = get_and_log_namespaces(
-            self.client, self.namespaces, self.prod_label
+            self.client, self.namespaces, self.prod_label, self.cache
         )
 
         if not namespaces:
@@ -87,37 +86,112 @@ class DeployTimeCollector(pelorus.AbstractPelorusExporter):
 
         logging.debug("generate_metrics: start")
 
-        pods = get_running_pods(self.client, namespaces, self.app_label)
+        raw = self.raw_lists and self.cache is None
+        pods = get_running_pods(
+            self.client, namespaces, self.app_label, cache=self.cache, raw=raw
+        )
 
         # Build dictionary with controllers and retrieved pods
-        replica_pods_dict = filter_pods_by_replica_uid(pods)
+        if raw:
+            replica_pods_dict = filter_raw_pods_by_replica_uid(pods)
+        else:
+            replica_pods_dict = filter_pods_by_replica_uid(pods)
+
+        cutoff = out_of_date_cutoff()
+        # An owner is created before its pods, so the owners of pods created before
+        # the cutoff are too old, and don't need to be looked up.
+        replica_pods_dict = _created_since(replica_pods_dict, to_iso(cutoff), raw)
+
+        deploy_times = _deployed_since(
+            get_owner_creation_timestamps(self.client, replica_pods_dict, self.cache),
+            cutoff.timestamp(),
+        )
 
         for uid, pod in replica_pods_dict.items():
-            replicas = get_owner_object_from_child(self.client, uid, pod)
+            if raw:
+                metadata = pod["metadata"]
+                namespace, name = metadata.get("namespace"), metadata.get("name")
+                app = (metadata.get("labels") or {}).get(self.app_label)
+            else:
+                namespace, name = pod.metadata.namespace, pod.metadata.name
+                app = pod.metadata.labels[self.app_label]
+
+            deploy_time = deploy_times.get(uid)
+            if deploy_time is None:
+                logging.debug(
+                    "Owner %s of pod %s/%s not found or too old, skipping",
+                    uid,
+                    namespace,
+                    name,
+                )
+                continue
 
             # Since a commit will be built into a particular image and there could be multiple
             # containers (images) per pod, we will push one metric per image/container in the
             # pod template
-            images = get_images_from_pod(pod)
+            if raw:
+                images = get_images_from_raw_pod(pod)
+            else:
+                images = get_images_from_pod(pod)
 
             for sha in images.keys():
                 metric = DeployTimeMetric(
-                    name=pod.metadata.labels[self.app_label],
-                    namespace=pod.metadata.namespace,
-                    labels=pod.metadata.labels,
-                    deploy_time=replicas.get(uid).metadata.creationTimestamp,
+                    name=app,
+                    namespace=namespace,
+                    deploy_time=deploy_time,
                     image_sha=sha,
                 )
                 yield metric
 
 
+def _created_since(
+    pods_by_owner_uid: dict[str, Any], cutoff: str, raw: bool
+) -> dict[str, Any]:
+    """
+    Drop the pods created before the cutoff, given as an ISO string.
+    Kubernetes timestamps all have the same format, so they compare as strings.
+    """
+    recent = {}
+    for uid, pod in pods_by_owner_uid.items():
+        if raw:
+            created = pod["metadata"].get("creationTimestamp")
+        else:
+            created = pod.metadata.creationTimestamp
+        comparable = isinstance(created, str) and len(created) == len(cutoff)
+        if not comparable or created >= cutoff:
+            recent[uid] = pod
+    if len(recent) < len(pods_by_owner_uid):
+        logging.debug(
+            "Skipped %d owners of pods created more than %smin ago",
+            len(pods_by_owner_uid) - len(recent),
+            METRIC_TIMESTAMP_THRESHOLD_MINUTES,
+        )
+    return recent
+
+
+def _deployed_since(deploy_times: dict[str, Any], cutoff: float) -> dict[str, Any]:
+    "Drop the deploy times before the cutoff, given as an epoch timestamp."
+    recent = {
+        uid: deploy_time
+        for uid, deploy_time in deploy_times.items()
+        if convert_datetime(deploy_time).timestamp() >= cutoff
+    }
+    if len(recent) < len(deploy_times):
+        logging.debug(
+            "Number of deployments that are older then %smin and won't be collected: %s",
+            METRIC_TIMESTAMP_THRESHOLD_MINUTES,
+            len(deploy_times) - len(recent),
+        )
+    return recent
+
+
 if __name__ == "__main__":
     pelorus.setup_logging()
     dyn_client = pelorus.utils.get_k8s_client()
 
-    collector = load_and_log(DeployTimeCollector, other=dict(client=dyn_client))
+    collector = load_and_log(
+        DeployTimeCollector,
+        other=dict(client=dyn_client, cache=make_watch_cache(dyn_client)),
+    )
 
-    REGISTRY.register(collector)
-    start_http_server(8080)
-    while True:
-        time.sleep(1)
+    run_exporter(collector)
@@ -9,16 +9,24 @@ from datetime import datetime
 from functools import partial
 from typing import Any, Iterable, NamedTuple, Optional, cast
 
-from attrs import field, frozen
+from attrs import Factory, field, frozen
 from prometheus_client.core import GaugeMetricFamily
-from requests import Session
 
 from pelorus import AbstractPelorusExporter
 from pelorus.certificates import set_up_requests_certs
 from pelorus.config import REDACT, env_vars, load_and_log, log
 from pelorus.config.converters import comma_or_whitespace_separated
-from pelorus.utils import TokenAuth, join_url_path_components
-from provider_common.github import GitHubError, paginate_github, parse_datetime
+from pelorus.utils import HttpClient, TokenAuth, join_url_path_components
+from pelorus.utils.http import http_client_metrics
+from provider_common.github import (
+    GitHubError,
+    RateLimitBudget,
+    RateLimitDeferred,
+    paginate_github,
+    parse_datetime,
+    rate_limit_budget,
+    rate_limit_metrics,
+)
 
 
 class Release(NamedTuple):
@@ -99,7 +107,15 @@ class GitHubReleaseCollector(AbstractPelorusExporter):
     host: str = field(default="api.github.com", metadata=env_vars("GIT_API"))
     token: Optional[str] = field(default=None, metadata=log(REDACT), repr=False)
 
-    _session: Session = field(factory=Session, init=False)
+    _session: HttpClient = field(factory=HttpClient, init=False)
+    _budget: RateLimitBudget = field(
+        default=Factory(lambda self: rate_limit_budget(self.token), takes_self=True),
+        init=False,
+    )
+    # project -> (releases, tagged commits) of its last complete collection
+    _last_collected: dict[ProjectSpec, tuple[set[Release], dict[str, str]]] = field(
+        factory=dict, init=False
+    )
 
     def __attrs_post_init__(self):
         if not self.projects:
@@ -118,13 +134,27 @@ class GitHubReleaseCollector(AbstractPelorusExporter):
         )
 
         for project in self.projects:
-            releases = set(self._get_releases_for_project(project))
-            logging.debug("Got %d releases for project %s", len(releases), project)
-
-            commits = self._get_each_tag_commit(
-                project, set(release.tag_name for release in releases)
-            )
-            logging.debug("Got %d tagged commits for project %s", len(commits), project)
+            try:
+                releases = set(self._get_releases_for_project(project))
+                logging.debug("Got %d releases for project %s", len(releases), project)
+
+                commits = self._get_each_tag_commit(
+                    project, set(release.tag_name for release in releases)
+                )
+                logging.debug(
+                    "Got %d tagged commits for project %s", len(commits), project
+                )
+            except RateLimitDeferred as e:
+                # keep the project's deployments until it can be collected again
+                releases, commits = self._last_collected.get(project, (set(), {}))
+                logging.warning(
+                    "Reusing the last %d releases of project %s: %s",
+                    len(releases),
+                    project,
+                    e,
+                )
+            else:
+                self._last_collected[project] = (releases, commits)
 
             namespace, app = project.organization, project.app
 
@@ -151,6 +181,8 @@ class GitHubReleaseCollector(AbstractPelorusExporter):
                     )
 
         yield metric
+        yield from http_client_metrics()
+        yield from rate_limit_metrics()
 
     def _get_releases_for_project(self, project: ProjectSpec) -> Iterable[Release]:
         """
@@ -165,7 +197,7 @@ class GitHubReleaseCollector(AbstractPelorusExporter):
             first_url = f"https://{self.host}/" + join_url_path_components(
                 "repos", project.organization, project.repo, "releases"
             )
-            for release in paginate_github(self._session, first_url):
+            for release in paginate_github(self._session, first_url, self._budget):
                 release = cast(dict[str, Any], release)
                 if release["draft"]:
                     continue
@@ -201,7 +233,7 @@ class GitHubReleaseCollector(AbstractPelorusExporter):
             url = f"https://{self.host}/" + join_url_path_components(
                 "repos", project.organization, project.repo, "tags"
             )
-            for tag in paginate_github(self._session, url):
+            for tag in paginate_github(self._session, url, self._budget):
                 tag_name = tag["name"]
 
                 if tag_name in tags:
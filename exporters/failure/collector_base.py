@@ -4,9 +4,11 @@ import logging
 from abc import abstractmethod
 from typing import Collection, Iterable, Union
 
+from attrs import frozen
 from prometheus_client.core import GaugeMetricFamily
 
 import pelorus
+from pelorus.utils.http import http_client_metrics
 from provider_common import format_app_name
 
 # TODO 1: CI needs to create failures on the fly to enable this
@@ -80,6 +82,8 @@ class AbstractFailureCollector(pelorus.AbstractPelorusExporter):
             yield (creation_metric)
             yield (failure_metric)
 
+        yield from http_client_metrics()
+
     def generate_metrics(
         self, issues: Iterable[TrackerIssue]
     ) -> Iterable[FailureMetric]:
@@ -87,14 +91,14 @@ class AbstractFailureCollector(pelorus.AbstractPelorusExporter):
         for issue in issues:
             # Create the FailureMetric
             metric = FailureMetric(
-                issue.creationdate, False, labels=[issue.app, issue.issue_number]
+                issue.creationdate, False, labels=(issue.app, issue.issue_number)
             )
             metrics.append(metric)
             # If the issue has a resolution date, then
             if issue.resolutiondate:
                 # Add the end metric
                 metric = FailureMetric(
-                    issue.resolutiondate, True, labels=[issue.app, issue.issue_number]
+                    issue.resolutiondate, True, labels=(issue.app, issue.issue_number)
                 )
                 metrics.append(metric)
         return metrics
@@ -105,27 +109,19 @@ class AbstractFailureCollector(pelorus.AbstractPelorusExporter):
         pass
 
 
+@frozen
 class TrackerIssue:
-    def __init__(
-        self,
-        issue_number,
-        creationdate: Union[str, float, int],
-        resolutiondate: Union[str, float, int],
-        app,
-    ):
-        self.creationdate = creationdate
-        self.resolutiondate = resolutiondate
-        self.issue_number = issue_number
-        self.app = app
+    issue_number: str
+    creationdate: Union[str, float, int]
+    resolutiondate: Union[str, float, int, None]
+    app: str
 
 
+@frozen
 class FailureMetric:
-    def __init__(
-        self, time_stamp: Union[str, float, int], is_resolution=False, labels=[]
-    ):
-        self.time_stamp = time_stamp
-        self.is_resolution = is_resolution
-        self.labels = labels
+    time_stamp: Union[str, float, int]
+    is_resolution: bool = False
+    labels: tuple[str, str] = ()
 
     def get_value(self):
         """Returns the timestamp"""
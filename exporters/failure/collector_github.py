@@ -26,8 +26,15 @@ from pelorus.config import env_var_names, env_vars
 from pelorus.config.converters import comma_or_whitespace_separated
 from pelorus.config.log import REDACT, log
 from pelorus.errors import FailureProviderAuthenticationError
-from pelorus.utils import TokenAuth, set_up_requests_session
-from provider_common.github import parse_datetime
+from pelorus.utils import HttpClient, TokenAuth, set_up_requests_session
+from provider_common.github import (
+    RateLimitBudget,
+    RateLimitDeferred,
+    get_github,
+    parse_datetime,
+    rate_limit_budget,
+    rate_limit_metrics,
+)
 
 # One query limit, exporter will query multiple times.
 # Do not exceed 100 results
@@ -62,15 +69,20 @@ class GithubFailureCollector(AbstractFailureCollector):
 
     tls_verify: bool = field(default=True)
 
-    session: requests.Session = field(factory=requests.Session, init=False)
+    session: HttpClient = field(factory=HttpClient, init=False)
 
     issue_label: str = field(
         default=DEFAULT_GITHUB_ISSUE_LABEL, metadata=env_vars("GITHUB_ISSUE_LABEL")
     )
 
+    _budget: RateLimitBudget = field(init=False)
+    # project -> issues of its last successful listing
+    _issues_by_project: dict[str, list] = field(factory=dict, init=False)
+
     def __attrs_post_init__(self):
         # disable .netrc
         self.session.trust_env = False
+        self._budget = rate_limit_budget(self.token)
 
         if self.token:
             set_up_requests_session(
@@ -96,7 +108,9 @@ class GithubFailureCollector(AbstractFailureCollector):
         params: Optional[dict[str, str]],
         url: str,
     ) -> Union[list, dict[str, Any]]:
-        resp = self.session.get(url, headers=headers, params=params)
+        resp = get_github(
+            self.session, url, self._budget, headers=headers, params=params
+        )
         try:
             resp.raise_for_status()
             logging.debug("GitHub successfully returned %s", resp.text)
@@ -118,10 +132,23 @@ class GithubFailureCollector(AbstractFailureCollector):
             }
             params = {"state": "all"}
 
-            issues = self._make_request(headers, params, url)
+            try:
+                issues = self._make_request(headers, params, url)
+            except RateLimitDeferred as e:
+                # keep the project's failures until its issues can be listed again
+                issues = self._issues_by_project.get(proj, [])
+                logging.warning(
+                    "Reusing the last %d issues of %s: %s", len(issues), proj, e
+                )
+            else:
+                self._issues_by_project[proj] = issues
             all_issues.extend(issues)
         return all_issues
 
+    def collect(self):
+        yield from super().collect()
+        yield from rate_limit_metrics()
+
     def search_issues(self) -> list[TrackerIssue]:
         critical_issues = []
         all_issues = self.get_issues()
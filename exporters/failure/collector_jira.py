@@ -16,8 +16,10 @@
 #
 
 import logging
-from typing import List, Optional
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
 
+import requests
 from attrs import define, field
 from jira import JIRA, Issue
 from jira.exceptions import JIRAError
@@ -27,6 +29,7 @@ from pelorus.config import env_var_names, env_vars
 from pelorus.config.converters import comma_or_whitespace_separated
 from pelorus.config.log import REDACT, log
 from pelorus.timeutil import parse_tz_aware, second_precision
+from pelorus.utils.resilience import circuit_breakers
 
 QUERY_RESULT_FIELDS = (
     "summary,labels,created,resolutiondate,status,statuscategorychangedate"
@@ -101,8 +104,33 @@ class JiraFailureCollector(AbstractFailureCollector):
                 f'{self.jql_query_string} AND project in ("{_projects}")'
             )
 
+    @contextmanager
+    def _calling_jira(self) -> Iterator[None]:
+        """
+        Make JIRA calls in the block, unless the circuit of the server is open.
+
+        The JIRA client retries 429 and 503 responses itself. Blocks whose calls
+        still fail open the circuit, so the server fails fast while it is down.
+        """
+        breaker = circuit_breakers.for_url(self.tracker_api)
+        breaker.check()
+        try:
+            yield
+        except JIRAError as error:
+            if error.status_code is None or error.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+
     def _connect_to_jira(self) -> JIRA:
-        """Connect to JIRA instance which may be cloud based or self-hosted."""
+        """
+        Connect to JIRA instance which may be cloud based or self-hosted.
+        """
         try:
             # Connect to JIRA
             if not self.username:
@@ -117,12 +145,12 @@ class JiraFailureCollector(AbstractFailureCollector):
                 )
             # Ensure connection was performed
             jira_client.session()
-            return jira_client
         except JIRAError as error:
             logging.error(
                 "Status: %s, Error Response: %s", error.status_code, error.text
             )
             raise
+        return jira_client
 
     def _filter_projects_in_query_string(self, error_text: str) -> str:
         """
@@ -221,20 +249,23 @@ class JiraFailureCollector(AbstractFailureCollector):
         List[TrackerIssue]
             A list with the issues, if no error occurs; else, an empty list.
         """
-        jira_client = self._connect_to_jira()
-        try:
-            return self._jql_query_issues(jira_client, self.jql_query_string)
-        except JIRAError as error:
-            if error.status_code == 400:
-                logging.error(
-                    "Status: %s, Error Response: %s", error.status_code, error.text
-                )
-                if NON_EXISTING_PROJECT_ERROR_END in error.text:
-                    new_query = self._filter_projects_in_query_string(error.text)
-                    if new_query:
-                        return self._jql_query_issues(jira_client, new_query)
-                return []
-            raise
+        # the connection and the searches succeed or fail together,
+        # a server that accepts connections but fails searches is still down
+        with self._calling_jira():
+            jira_client = self._connect_to_jira()
+            try:
+                return self._jql_query_issues(jira_client, self.jql_query_string)
+            except JIRAError as error:
+                if error.status_code == 400:
+                    logging.error(
+                        "Status: %s, Error Response: %s", error.status_code, error.text
+                    )
+                    if NON_EXISTING_PROJECT_ERROR_END in error.text:
+                        new_query = self._filter_projects_in_query_string(error.text)
+                        if new_query:
+                            return self._jql_query_issues(jira_client, new_query)
+                    return []
+                raise
 
     def _get_resolved_timestamp(
         self, issue: Issue, resolved_statuses: Optional[str] = None
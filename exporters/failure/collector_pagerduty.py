@@ -25,7 +25,7 @@ from pelorus.config.converters import comma_or_whitespace_separated
 from pelorus.config.log import REDACT, log
 from pelorus.errors import FailureProviderAuthenticationError
 from pelorus.timeutil import parse_assuming_utc, second_precision
-from pelorus.utils import TokenAuth, set_up_requests_session
+from pelorus.utils import HttpClient, TokenAuth, set_up_requests_session
 
 _DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
@@ -44,7 +44,7 @@ class PagerdutyFailureCollector(AbstractFailureCollector):
 
     tls_verify: bool = field(default=True)
 
-    session: requests.Session = field(factory=requests.Session, init=False)
+    session: HttpClient = field(factory=HttpClient, init=False)
 
     incident_urgency: set[str] = field(
         factory=set,
@@ -1,13 +1,12 @@
 import logging
 
-import requests
 from attrs import define, field
 
 import pelorus
 from failure.collector_base import AbstractFailureCollector, TrackerIssue
 from pelorus.config import REDACT, env_var_names, env_vars, log
 from pelorus.timeutil import parse_assuming_utc, second_precision
-from pelorus.utils import set_up_requests_session
+from pelorus.utils import HttpClient, set_up_requests_session
 
 SN_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
 SN_QUERY = "/api/now/table/incident?sysparm_fields={0}%2C{1}%2Cstate%2Cnumber%2C{2} \
@@ -41,7 +40,7 @@ class ServiceNowFailureCollector(AbstractFailureCollector):
     )
 
     tls_verify: bool = field(default=True)
-    session: requests.Session = field(factory=requests.Session, init=False)
+    session: HttpClient = field(factory=HttpClient, init=False)
 
     offset: int = field(default=0, init=False)
 
@@ -113,11 +112,12 @@ class ServiceNowFailureCollector(AbstractFailureCollector):
         # Check for HTTP codes other than 200
 
         if response.status_code != 200:
+            # server errors are retried by the session, this is the last response
             logging.error(
                 "Status:, %s, Headers:, %s, Error Response: %s",
                 response.status_code,
                 response.headers,
-                response.json(),
+                response.text,
             )
             raise RuntimeError("Error connecting to Service now")
         # Decode the JSON response into a dictionary and use the data
@@ -16,7 +16,7 @@ import os
 import shutil
 import tempfile
 from pathlib import Path
-from typing import Optional, Union
+from typing import Iterable, Optional, Union
 
 import certifi
 
@@ -25,11 +25,13 @@ DEFAULT_CERT_DIR = Path("/etc/pelorus/custom_certs")
 
 # TODO: validate and/or automate making sure the file is PEM versus DER?
 # TODO: what if the certs are missing trailing newlines? Will they still work?
-def _combine_certificates(dir_to_check: Path = DEFAULT_CERT_DIR) -> str:
+def _combine_certificates(
+    dir_to_check: Path = DEFAULT_CERT_DIR, extra_files: Iterable[Path] = ()
+) -> str:
     """
     Combines the certificates with the certificates from `certifi`.
     All certificates ending in `.pem` under each directory under `dir_to_check`
-    is combined (e.g. `dir_to_check/*/*.pem`).
+    is combined (e.g. `dir_to_check/*/*.pem`), as well as the `extra_files`.
     Returns the path of the combined file.
     """
     target_fd, target_path = tempfile.mkstemp(suffix=".pem", prefix="custom-certs")
@@ -38,7 +40,7 @@ def _combine_certificates(dir_to_check: Path = DEFAULT_CERT_DIR) -> str:
         with open(certifi.where(), "rb") as source:
             shutil.copyfileobj(source, target)
 
-        for source_path in dir_to_check.glob("*/*.pem"):
+        for source_path in [*dir_to_check.glob("*/*.pem"), *extra_files]:
             logging.info("Combining custom certificate file %s", source_path)
 
             with source_path.open("rb") as source:
@@ -56,7 +58,9 @@ def _register_cleanup(path: str):
     atexit.register(os.remove, path)
 
 
-def set_up_requests_certs(verify: Optional[bool] = None) -> Union[bool, str]:
+def set_up_requests_certs(
+    verify: Optional[bool] = None, extra_files: Iterable[Path] = ()
+) -> Union[bool, str]:
     """
     Set up custom certificates based on the way requests is configured.
 
@@ -71,7 +75,8 @@ def set_up_requests_certs(verify: Optional[bool] = None) -> Union[bool, str]:
     We'll have to revisit this if there comes a use case for multiple Sessions.
 
     If `verify` is set to `True` or `None`, then this function will combine
-    the certifi certs and the custom certs under `/etc/pelorus/custom_certs/*/*.pem`.
+    the certifi certs and the custom certs under `/etc/pelorus/custom_certs/*/*.pem`,
+    plus any `extra_files`.
 
     It will combine them into a temporary file, the path of which is returned.
     It will also register that file for removal at program exit.
@@ -86,7 +91,7 @@ def set_up_requests_certs(verify: Optional[bool] = None) -> Union[bool, str]:
         )
         return False
 
-    file = _combine_certificates()
+    file = _combine_certificates(extra_files=extra_files)
     _register_cleanup(file)
 
     return file
@@ -0,0 +1,188 @@
+"""
+Runtime shared by the exporters' `__main__` entrypoints.
+
+Collectors do all of their work inside `collect()`, which prometheus_client
+calls on every scrape. With enough namespaces, builds or issues that makes
+scrapes slow enough to time out, and every Prometheus replica scraping the
+exporter multiplies the load put on the upstream APIs.
+
+`BackgroundCollector` runs the wrapped collector on its own schedule instead,
+and scrapes are served from the last completed snapshot.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Iterable, NoReturn, Optional
+
+from attrs import define, field, frozen
+from prometheus_client import start_http_server
+from prometheus_client.core import (
+    REGISTRY,
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    Metric,
+)
+from prometheus_client.registry import Collector, CollectorRegistry
+
+from pelorus.config import env_vars, load_and_log
+
+DEFAULT_PORT = 8080
+DEFAULT_REFRESH_INTERVAL_SECONDS = 60
+
+
+@frozen(kw_only=True)
+class RuntimeConfig:
+    # Seconds to wait between the end of one collection and the start of the next.
+    # 0 disables the background refresh: metrics are collected on every scrape.
+    refresh_interval: int = field(
+        default=DEFAULT_REFRESH_INTERVAL_SECONDS,
+        converter=int,
+        metadata=env_vars("REFRESH_INTERVAL"),
+    )
+
+
+@frozen
+class Snapshot:
+    "The metric families produced by one complete collection."
+    families: list[Metric]
+    completed_at: float
+    """Unix timestamp of when the collection finished."""
+    duration: float
+    """How long the collection took, in seconds."""
+
+
+@define(eq=False)
+class BackgroundCollector(Collector):
+    """
+    Wraps a collector, running its `collect()` periodically in a daemon thread.
+
+    Scrapes never call the wrapped collector: they yield the families of the
+    last completed snapshot, along with its age and the time it took to collect.
+    A failed collection is logged and the previous snapshot keeps being served.
+    """
+
+    collector: Collector
+    interval: float = DEFAULT_REFRESH_INTERVAL_SECONDS
+
+    _snapshot: Optional[Snapshot] = field(default=None, init=False)
+    _failures: int = field(default=0, init=False)
+    _stop_event: threading.Event = field(factory=threading.Event, init=False)
+    _thread: Optional[threading.Thread] = field(default=None, init=False)
+
+    @property
+    def snapshot(self) -> Optional[Snapshot]:
+        return self._snapshot
+
+    def refresh(self) -> None:
+        "Run one collection, replacing the snapshot if it succeeds."
+        started = time.monotonic()
+        try:
+            families = list(self.collector.collect())
+        except Exception:
+            self._failures += 1
+            logging.error(
+                "Collection failed, serving the previous snapshot", exc_info=True
+            )
+            return
+        duration = time.monotonic() - started
+
+        self._snapshot = Snapshot(families, time.time(), duration)
+        logging.debug("Collected %d metric families in %.2fs", len(families), duration)
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self.refresh()
+            self._stop_event.wait(self.interval)
+
+    def start(self) -> None:
+        "Start refreshing in the background. The first collection starts right away."
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="pelorus-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        "Stop refreshing, waiting up to `timeout` seconds for a running collection."
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def describe(self) -> Iterable[Metric]:
+        # Registering must not trigger a collection of the wrapped collector.
+        return []
+
+    def collect(self) -> Iterable[Metric]:
+        snapshot = self._snapshot
+
+        failures = CounterMetricFamily(
+            "pelorus_collection_failures",
+            "Number of background collections that raised an error",
+        )
+        failures.add_metric([], self._failures)
+        yield failures
+
+        if snapshot is None:
+            return
+
+        yield from snapshot.families
+
+        age = GaugeMetricFamily(
+            "pelorus_collection_age_seconds",
+            "Seconds since the served metrics were collected",
+        )
+        age.add_metric([], time.time() - snapshot.completed_at)
+        yield age
+
+        duration = GaugeMetricFamily(
+            "pelorus_collection_duration_seconds",
+            "Seconds taken by the collection that produced the served metrics",
+        )
+        duration.add_metric([], snapshot.duration)
+        yield duration
+
+
+def register(collector: Collector, registry: CollectorRegistry = REGISTRY) -> Collector:
+    """
+    Register the collector according to the runtime configuration.
+
+    Returns what was actually registered: a started `BackgroundCollector`,
+    or the collector itself if the background refresh is disabled.
+    """
+    config = load_and_log(RuntimeConfig)
+
+    if config.refresh_interval <= 0:
+        logging.info("Background refresh disabled, collecting on every scrape")
+        registry.register(collector)
+        return collector
+
+    background = BackgroundCollector(collector, config.refresh_interval)
+    registry.register(background)
+    background.start()
+    return background
+
+
+def run_exporter(
+    collector: Collector, registry: CollectorRegistry = REGISTRY
+) -> NoReturn:
+    "Register the collector and serve its metrics forever."
+    register(collector, registry)
+    start_http_server(DEFAULT_PORT, registry=registry)
+
+    while True:
+        time.sleep(1)
+
+
+__all__ = [
+    "DEFAULT_PORT",
+    "DEFAULT_REFRESH_INTERVAL_SECONDS",
+    "RuntimeConfig",
+    "Snapshot",
+    "BackgroundCollector",
+    "register",
+    "run_exporter",
+]
@@ -135,6 +135,16 @@ def to_iso(dt: datetime) -> str:
     return dt.astimezone(timezone.utc).strftime(_ISO_ZULU_FMT)
 
 
+def out_of_date_cutoff() -> datetime:
+    """
+    The time before which metrics are out of date, as `is_out_of_date` decides.
+    Compute it once to filter many timestamps against it.
+    """
+    return datetime.now(timezone.utc) - timedelta(
+        minutes=METRIC_TIMESTAMP_THRESHOLD_MINUTES
+    )
+
+
 def is_out_of_date(timestring: str) -> bool:
     """
     Helper function, which allows to filter out metrics which are older then
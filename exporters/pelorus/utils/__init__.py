@@ -23,7 +23,7 @@ in kubernetes that are not so idiomatic to deal with.
 """
 import logging
 import os
-from typing import ClassVar, Generator, Optional, cast, overload
+from typing import ClassVar, Generator, Optional, Union, cast, overload
 
 import requests
 import requests.auth
@@ -33,6 +33,7 @@ from kubernetes.dynamic import Resource, ResourceInstance
 from openshift.dynamic import DynamicClient
 
 from pelorus.certificates import set_up_requests_certs
+from pelorus.utils.http import HttpClient
 from pelorus.utils.nested import (
     BadAttributePathError,
     collect_bad_attribute_path_error,
@@ -116,23 +117,33 @@ def get_env_var(var_name: str, default_value: Optional[str] = None) -> Optional[
     return env_var
 
 
-def get_k8s_client():
+# The API server compresses large responses when asked to, and urllib3
+# decompresses them transparently, for the DynamicClient and list_raw alike.
+K8S_ACCEPT_ENCODING = "gzip"
+
+
+def get_k8s_client(compress: bool = True):
     """
     `get_k8s_client` provides interface to get dynamic Kubernetes client to access cluster
     information by the exporters.
+
+    With `compress`, responses are requested gzip-compressed, which makes large lists
+    much faster to transfer when the exporter runs far from the API server.
     """
-    k8s_client = None
     try:
-        k8sconfig = config.new_client_from_config()
-        k8s_client = DynamicClient(k8sconfig)
+        api_client = config.new_client_from_config()
     except config.config_exception.ConfigException:
         # Try load config from cluster
         config.load_incluster_config()
         k8sconfig = client.Configuration().get_default_copy()
         client.Configuration.set_default(k8sconfig)
-        k8s_client = DynamicClient(client.ApiClient(k8sconfig))
+        api_client = client.ApiClient(k8sconfig)
+
+    if compress:
+        # before the DynamicClient's discovery calls
+        api_client.set_default_header("Accept-Encoding", K8S_ACCEPT_ENCODING)
 
-    return k8s_client
+    return DynamicClient(api_client)
 
 
 class TokenAuth(requests.auth.AuthBase):
@@ -150,7 +161,7 @@ class TokenAuth(requests.auth.AuthBase):
 
 @overload
 def set_up_requests_session(
-    session: requests.Session,
+    session: Union[requests.Session, HttpClient],
     verify: Optional[bool],
     *,
     auth: Optional[requests.auth.AuthBase] = None,
@@ -160,7 +171,7 @@ def set_up_requests_session(
 
 @overload
 def set_up_requests_session(
-    session: requests.Session,
+    session: Union[requests.Session, HttpClient],
     verify: Optional[bool],
     *,
     username: str,
@@ -170,9 +181,9 @@ def set_up_requests_session(
 
 
 def set_up_requests_session(
-    session: requests.Session, verify: Optional[bool], **kwargs
+    session: Union[requests.Session, HttpClient], verify: Optional[bool], **kwargs
 ):
-    "Configures a requests session for proper TLS handling and auth."
+    "Configures a requests session, or an HttpClient, for proper TLS handling and auth."
     session.verify = set_up_requests_certs(verify)
     if "auth" in kwargs:
         auth: Optional[requests.auth.AuthBase] = kwargs["auth"]
@@ -196,18 +207,23 @@ def paginate_resource(
 ) -> Generator[ResourceInstance, None, None]:
     """
     Paginate requests for openshift resources.
+
+    Pages of `limit` items are requested as the items are consumed,
+    so only one page is held at a time.
     """
     client = cast(DynamicClient, resource.client)
 
     list_ = client.get(resource, **query, limit=limit)
 
-    yield from list_.items
-
-    continue_token = list_.metadata.get("continue")
+    while True:
+        yield from list_.items
 
-    while continue_token:
+        continue_token = list_.metadata.get("continue")
+        if not continue_token:
+            return
+        # let the page be freed before the next one is received
+        list_ = None
         list_ = client.get(resource, **query, limit=limit, _continue=continue_token)
-        yield from list_.items
 
 
 class Url(urllib3.util.Url):
@@ -267,6 +283,7 @@ __all__ = [
     "DEFAULT_VAR_KEYWORD",
     "get_env_var",
     "get_k8s_client",
+    "HttpClient",
     "TokenAuth",
     "set_up_requests_session",
     "join_url_path_components",
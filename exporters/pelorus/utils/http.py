@@ -0,0 +1,424 @@
+"""
+HTTP client shared by the calls of a provider.
+
+`HttpClient` keeps a pooled, keep-alive `requests.Session` per host, so the
+calls to a server reuse their connections, even from many threads, and a slow
+server only ties up its own connections. It is configured like a
+`requests.Session`, so `set_up_requests_session` sets up its TLS and auth.
+
+Its asyncio API lets providers fan calls out without a thread per call.
+It uses httpx if it is installed, with HTTP/2 if `http2` is set and h2 is
+installed too. Otherwise the calls run in a thread pool of `pool_size` threads.
+Either way, responses are `requests.Response` objects.
+
+GET responses are cached and revalidated with conditional requests,
+see `pelorus.utils.http_cache`. Failed calls are retried, and calls to a host
+that keeps failing are cut short, see `pelorus.utils.resilience`.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import importlib.util
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Iterable, Optional, TypeVar, Union
+from urllib.parse import urlsplit
+
+import requests
+import requests.adapters
+from attrs import define, field
+from prometheus_client.core import Metric
+from requests.structures import CaseInsensitiveDict
+
+from pelorus.utils.http_cache import (
+    MemoryResponseCache,
+    response_cache_metrics,
+    shared_response_cache,
+)
+from pelorus.utils.resilience import (
+    IDEMPOTENT_METHODS,
+    RETRY_STATUSES,
+    CircuitBreakers,
+    RetryPolicy,
+    circuit_breakers,
+)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+_HTTP2_SUPPORTED = importlib.util.find_spec("h2") is not None
+
+DEFAULT_POOL_SIZE = 10
+# Timeout of the async calls, so a server that hangs doesn't hang a collection.
+DEFAULT_TIMEOUT_SECONDS = 30.0
+
+T = TypeVar("T")
+
+
+def host_of(url: str) -> str:
+    """
+    The scheme and authority of the URL, which connections are pooled by.
+
+    >>> host_of("https://api.github.com/repos/org/app?page=2")
+    'https://api.github.com'
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+@define(eq=False)
+class HttpClient:
+    """
+    HTTP client with a connection pool per host, and an asyncio API. Thread-safe.
+
+    `verify`, `auth`, `headers` and `trust_env` are applied to the session of each
+    host as it is created, so set them before the first call.
+    """
+
+    pool_size: int = DEFAULT_POOL_SIZE
+    "Maximum number of connections kept open to each host."
+    http2: bool = False
+    "Make the async calls over HTTP/2, if httpx and h2 are installed."
+    timeout: float = DEFAULT_TIMEOUT_SECONDS
+    "Seconds the async calls that aren't given a `timeout` wait for the server."
+
+    verify: Union[bool, str] = True
+    auth: Any = None
+    headers: CaseInsensitiveDict = field(factory=CaseInsensitiveDict)
+    trust_env: bool = True
+    cache: Optional[MemoryResponseCache] = field(factory=shared_response_cache)
+    "Cache of GET responses, None to not cache them."
+    retry: RetryPolicy = field(factory=RetryPolicy)
+    breakers: Optional[CircuitBreakers] = circuit_breakers
+    "Circuit breakers of the hosts called, None to always call them."
+
+    _sessions: dict[str, requests.Session] = field(factory=dict, init=False)
+    _executor: Optional[ThreadPoolExecutor] = field(default=None, init=False)
+    # event loop -> host -> httpx.AsyncClient, since connections belong to a loop
+    _async_clients: weakref.WeakKeyDictionary = field(
+        factory=weakref.WeakKeyDictionary, init=False
+    )
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def session(self, url: str) -> requests.Session:
+        "The session of the host of the URL, created on first use."
+        host = host_of(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.verify = self.verify
+                session.auth = self.auth
+                session.trust_env = self.trust_env
+                session.headers.update(self.headers)
+                adapter = CachingAdapter(
+                    self.cache,
+                    retry=self.retry,
+                    breakers=self.breakers,
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                )
+                session.mount(f"{host}/", adapter)
+                self._sessions[host] = session
+            return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        "Make a request like `requests.Session.request`."
+        return self.session(url).request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+            executor, self._executor = self._executor, None
+        for session in sessions.values():
+            session.close()
+        if executor:
+            executor.shutdown(wait=False)
+
+    # region asyncio
+
+    async def request_async(
+        self, method: str, url: str, *, timeout: Optional[float] = None, **kwargs
+    ) -> requests.Response:
+        """
+        Make a request without blocking the event loop.
+        Takes the arguments of `requests.Request`, and a `timeout`,
+        the client's one by default.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        client = self._async_client(url)
+        if client is None:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(
+                self.request, method, url, timeout=timeout, **kwargs
+            )
+            return await loop.run_in_executor(self._get_executor(), call)
+
+        # prepared by the host's session, for its headers and auth
+        prepared = self.session(url).prepare_request(
+            requests.Request(method, url, **kwargs)
+        )
+        cached = self.cache and self.cache.prepare(prepared)
+        response = await self._send_async(client, prepared, timeout)
+        if self.cache:
+            return self.cache.respond(prepared, response, cached)
+        return response
+
+    async def _send_async(
+        self, client: Any, request: requests.PreparedRequest, timeout: float
+    ) -> requests.Response:
+        "Send the request with httpx, with the retries and circuit breaking of `ResilientAdapter`."
+        call = _Call(
+            urlsplit(request.url or "").netloc,
+            request.method or "",
+            self.retry,
+            self.breakers,
+        )
+        call.start()
+        try:
+            while True:
+                try:
+                    response = await client.request(
+                        request.method,
+                        request.url,
+                        headers=dict(request.headers),
+                        content=request.body,
+                        timeout=timeout,
+                    )
+                except httpx.TransportError as e:
+                    delay = call.retry_delay(error=e)
+                    if delay is None:
+                        raise
+                else:
+                    converted = _to_requests_response(response, request)
+                    delay = call.retry_delay(converted)
+                    if delay is None:
+                        break
+                await asyncio.sleep(delay)
+        except Exception:
+            call.failed()
+            raise
+        call.finished(converted)
+        return converted
+
+    async def get_async(self, url: str, **kwargs) -> requests.Response:
+        return await self.request_async("GET", url, **kwargs)
+
+    def gather(
+        self, calls: Iterable[Awaitable[T]], return_exceptions: bool = False
+    ) -> list[T]:
+        """
+        Run the calls concurrently from synchronous code, and return their results in order.
+        With `return_exceptions`, failed calls return their exception instead of raising it.
+        """
+
+        async def run() -> list:
+            try:
+                return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+            finally:
+                await self.aclose()
+
+        return asyncio.run(run())
+
+    async def aclose(self) -> None:
+        "Close the async connections of the running event loop."
+        with self._lock:
+            clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+    def _async_client(self, url: str):
+        if httpx is None:
+            return None
+        host = host_of(url)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(host)
+            if client is None:
+                if self.http2 and not _HTTP2_SUPPORTED:
+                    logging.warning("HTTP/2 needs the h2 package, using HTTP/1.1")
+                client = httpx.AsyncClient(
+                    verify=self.verify,
+                    trust_env=self.trust_env,
+                    http2=self.http2 and _HTTP2_SUPPORTED,
+                    follow_redirects=True,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                    ),
+                )
+                clients[host] = client
+            return client
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.pool_size, thread_name_prefix="pelorus-http"
+                )
+            return self._executor
+
+    # endregion
+
+
+@define
+class _Call:
+    "Decides on the retries of a call, and reports its outcome to the host's breaker."
+
+    host: str
+    method: str
+    retry: RetryPolicy
+    breakers: Optional[CircuitBreakers]
+    retries: int = 0
+
+    def start(self) -> None:
+        "Raise `CircuitOpenError` if the host should not be called."
+        if self.breakers is not None:
+            self.breakers.get(self.host).check()
+
+    def retry_delay(
+        self,
+        response: Optional[requests.Response] = None,
+        error: Optional[Exception] = None,
+    ) -> Optional[float]:
+        "Seconds to wait before retrying after the response or error, None to not retry."
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            return None
+        if self.method not in IDEMPOTENT_METHODS or isinstance(
+            error, requests.exceptions.SSLError
+        ):
+            return None
+        delay = self.retry.delay(self.retries, response)
+        if delay is None:
+            return None
+        reason = str(response.status_code) if response is not None else "error"
+        logging.debug(
+            "Retrying %s call to %s in %.2fs after %s",
+            self.method,
+            self.host,
+            delay,
+            error or response.status_code,
+        )
+        self.retries += 1
+        if self.breakers is not None:
+            self.breakers.record_retry(self.host, reason)
+        if response is not None:
+            response.close()
+        return delay
+
+    def finished(self, response: requests.Response) -> None:
+        if self.breakers is not None:
+            breaker = self.breakers.get(self.host)
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+    def failed(self) -> None:
+        if self.breakers is not None:
+            self.breakers.get(self.host).record_failure()
+
+
+class ResilientAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter retrying the calls that fail with a 429, a 5xx or no response,
+    and failing right away the calls to hosts whose circuit is open.
+    """
+
+    def __init__(
+        self,
+        retry: RetryPolicy = RetryPolicy(),
+        breakers: Optional[CircuitBreakers] = None,
+        **kwargs,
+    ):
+        self.retry = retry
+        self.breakers = breakers
+        super().__init__(**kwargs)
+
+    def send(
+        self, request: requests.PreparedRequest, *args, **kwargs
+    ) -> requests.Response:
+        call = _Call(
+            urlsplit(request.url or "").netloc,
+            request.method or "",
+            self.retry,
+            self.breakers,
+        )
+        call.start()
+        try:
+            while True:
+                try:
+                    response = super().send(request, *args, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    delay = call.retry_delay(error=e)
+                    if delay is None:
+                        raise
+                else:
+                    delay = call.retry_delay(response)
+                    if delay is None:
+                        break
+                time.sleep(delay)
+        except Exception:
+            call.failed()
+            raise
+        call.finished(response)
+        return response
+
+
+class CachingAdapter(ResilientAdapter):
+    "Transport adapter answering GET requests from a response cache, if given one."
+
+    def __init__(self, cache: Optional[MemoryResponseCache] = None, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def send(
+        self, request: requests.PreparedRequest, stream: bool = False, **kwargs
+    ) -> requests.Response:
+        # streamed bodies are left to the caller
+        if self.cache is None or stream:
+            return super().send(request, stream=stream, **kwargs)
+        cached = self.cache.prepare(request)
+        response = super().send(request, stream=stream, **kwargs)
+        return self.cache.respond(request, response, cached)
+
+
+def _to_requests_response(
+    response: Any, request: requests.PreparedRequest
+) -> requests.Response:
+    "Convert an httpx response, with its body decoded, to a `requests.Response`."
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.headers = CaseInsensitiveDict(response.headers.multi_items())
+    converted._content = response.content
+    converted.encoding = response.encoding
+    converted.url = str(response.url)
+    converted.request = request
+    return converted
+
+
+def http_client_metrics() -> Iterable[Metric]:
+    "The metrics of the response cache and circuit breakers shared by the HTTP clients."
+    yield from response_cache_metrics()
+    yield from circuit_breakers.metrics()
+
+
+__all__ = [
+    "DEFAULT_POOL_SIZE",
+    "DEFAULT_TIMEOUT_SECONDS",
+    "HttpClient",
+    "host_of",
+    "http_client_metrics",
+]
@@ -0,0 +1,395 @@
+"""
+Cache of the responses of provider APIs, revalidated with conditional requests.
+
+Releases, tags, issues and commits rarely change between two collections, but
+were downloaded again on every one. A GET whose response is cached is sent with
+`If-None-Match` and `If-Modified-Since`, and a `304 Not Modified` is answered
+with the cached response, with the headers of the 304 on top, so rate limit
+headers stay current. GitHub doesn't count 304s against the rate limit.
+
+Only GET responses with an `ETag` or `Last-Modified` header are cached. They are
+keyed by URL, `Accept` header and a hash of the `Authorization` header, since
+what a token can see differs. Entries are evicted least recently used first,
+once there are more than `max_entries` or they take more than `max_bytes`.
+Bodies larger than `max_entry_bytes`, such as commits with big patches, aren't
+cached at all.
+`SQLiteResponseCache` also persists them to a file, so the first collection
+after a restart is revalidated too.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+
+import attrs.converters
+import requests
+import requests.utils
+from attrs import define, field, frozen
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_MAX_ENTRIES = 1_000
+# Bounds the memory taken by the cached bodies and headers.
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_MAX_ENTRY_BYTES = 1024 * 1024
+
+# Describe the body as it was sent, not the decoded one that is cached,
+# or the body of a 304.
+_NOT_CACHED_HEADERS = {"content-length", "content-encoding", "transfer-encoding"}
+
+
+@frozen
+class CachedResponse:
+    "A 200 response, and the validators it is revalidated with."
+
+    headers: tuple[tuple[str, str], ...]
+    content: bytes
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        "Approximate number of bytes taken by the response."
+        return len(self.content) + sum(
+            len(name) + len(value) for name, value in self.headers
+        )
+
+
+def cache_key(request: requests.PreparedRequest) -> Optional[str]:
+    "The key of the cached response of the request, None if it can't be cached."
+    if request.method != "GET" or not request.url:
+        return None
+    authorization = request.headers.get("Authorization") or ""
+    return "\n".join(
+        (
+            request.url,
+            request.headers.get("Accept") or "",
+            hashlib.sha256(authorization.encode()).hexdigest(),
+        )
+    )
+
+
+def _host_of(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+@define(eq=False)
+class MemoryResponseCache:
+    "In-memory cache of responses to GET requests, revalidated when they are reused."
+
+    max_entries: int = field(default=DEFAULT_MAX_ENTRIES, converter=int)
+    max_bytes: int = field(default=DEFAULT_MAX_BYTES, converter=int)
+    max_entry_bytes: int = field(default=DEFAULT_MAX_ENTRY_BYTES, converter=int)
+
+    _entries: OrderedDict[str, CachedResponse] = field(factory=OrderedDict, init=False)
+    # total size of the entries
+    _bytes: int = field(default=0, init=False)
+    # (host, "hit" or "miss") -> number of GET requests
+    requests_total: Counter = field(factory=Counter, init=False)
+    _lock: threading.RLock = field(factory=threading.RLock, init=False)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CachedResponse) -> bool:
+        """
+        Cache the entry, evicting the least recently used ones to make room.
+        Returns whether it was cached: entries larger than `max_entry_bytes` aren't.
+        """
+        with self._lock:
+            if entry.size > min(self.max_entry_bytes, self.max_bytes):
+                self.remove(key)
+                return False
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._discarded(evicted_key)
+            return True
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+                self._discarded(key)
+
+    def _discarded(self, key: str) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def bytes(self) -> int:
+        "Approximate number of bytes taken by the cached responses."
+        return self._bytes
+
+    def prepare(self, request: requests.PreparedRequest) -> Optional[CachedResponse]:
+        """
+        Make the request conditional if its response is cached, and return that response.
+        Validators set by the caller are kept.
+        """
+        key = cache_key(request)
+        entry = key and self.get(key)
+        if not entry:
+            return None
+        if entry.etag:
+            request.headers.setdefault("If-None-Match", entry.etag)
+        if entry.last_modified:
+            request.headers.setdefault("If-Modified-Since", entry.last_modified)
+        return entry
+
+    def respond(
+        self,
+        request: requests.PreparedRequest,
+        response: requests.Response,
+        cached: Optional[CachedResponse],
+    ) -> requests.Response:
+        """
+        Serve the cached response if the server answered that it's not modified,
+        otherwise cache the response if it can be revalidated. Reads the response.
+        """
+        key = cache_key(request)
+        if key is None:
+            return response
+
+        hit = cached is not None and response.status_code == 304
+        with self._lock:
+            self.requests_total[(_host_of(request.url), "hit" if hit else "miss")] += 1
+
+        if hit:
+            response.content  # release the connection
+            headers = CaseInsensitiveDict(cached.headers)
+            for name, value in response.headers.items():
+                if name.lower() not in _NOT_CACHED_HEADERS:
+                    headers[name] = value
+            response.status_code = 200
+            response.reason = "OK"
+            response.headers = headers
+            response._content = cached.content
+            response.encoding = requests.utils.get_encoding_from_headers(headers)
+            logging.debug(
+                "Not modified, serving the cached response of %s", request.url
+            )
+        elif response.status_code == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if etag or last_modified:
+                headers = tuple(
+                    (name, value)
+                    for name, value in response.headers.items()
+                    if name.lower() not in _NOT_CACHED_HEADERS
+                )
+                self.put(
+                    key,
+                    CachedResponse(
+                        headers,
+                        response.content,
+                        etag,
+                        last_modified,
+                    ),
+                )
+            elif cached is not None:
+                self.remove(key)
+        return response
+
+    def metrics(self) -> Iterable[Metric]:
+        requests_metric = CounterMetricFamily(
+            "pelorus_http_cache_requests",
+            "Number of GET requests to provider APIs, by whether the cache answered them",
+            labels=["host", "result"],
+        )
+        ratio = GaugeMetricFamily(
+            "pelorus_http_cache_hit_ratio",
+            "Share of the GET requests to provider APIs answered by the cache",
+            labels=["host"],
+        )
+        with self._lock:
+            counts = dict(self.requests_total)
+        for (host, result), count in sorted(counts.items()):
+            requests_metric.add_metric([host, result], count)
+        for host in sorted({host for host, _ in counts}):
+            hits = counts.get((host, "hit"), 0)
+            ratio.add_metric([host], hits / (hits + counts.get((host, "miss"), 0)))
+        yield requests_metric
+        yield ratio
+
+        entries = GaugeMetricFamily(
+            "pelorus_http_cache_entries", "Number of responses in the HTTP cache"
+        )
+        entries.add_metric([], len(self))
+        yield entries
+
+        size = GaugeMetricFamily(
+            "pelorus_http_cache_bytes",
+            "Approximate size of the responses in the HTTP cache, in bytes",
+        )
+        size.add_metric([], self.bytes)
+        yield size
+
+
+@define(eq=False)
+class SQLiteResponseCache(MemoryResponseCache):
+    """
+    Response cache persisted to an SQLite database at `path`.
+
+    Responses are served from memory. Stored and evicted entries are written
+    right away, and the most recently stored ones that fit the limits are loaded
+    back on start.
+    """
+
+    path: str = field(kw_only=True)
+
+    _connection: sqlite3.Connection = field(init=False)
+
+    def __attrs_post_init__(self):
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS http_responses (
+                    key TEXT PRIMARY KEY,
+                    headers TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    stored_at REAL NOT NULL DEFAULT (julianday('now'))
+                )"""
+            )
+        self._warm()
+
+    def _warm(self) -> None:
+        "Load the most recently stored entries, oldest first to keep the LRU order."
+        rows = self._connection.execute(
+            "SELECT key, headers, content, etag, last_modified"
+            " FROM http_responses ORDER BY stored_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        loaded = []
+        size = 0
+        for key, headers, content, etag, last_modified in rows:
+            entry = CachedResponse(
+                tuple(tuple(header) for header in json.loads(headers)),
+                content,
+                etag,
+                last_modified,
+            )
+            if entry.size > self.max_entry_bytes:
+                continue
+            if size + entry.size > self.max_bytes:
+                break
+            size += entry.size
+            loaded.append((key, entry))
+        for key, entry in reversed(loaded):
+            self._entries[key] = entry
+        self._bytes = size
+        logging.info("Loaded %d HTTP responses from %s", len(self._entries), self.path)
+
+    def put(self, key: str, entry: CachedResponse) -> bool:
+        with self._lock, self._connection:
+            if not super().put(key, entry):
+                return False
+            self._connection.execute(
+                "INSERT OR REPLACE INTO http_responses"
+                " (key, headers, content, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    json.dumps(entry.headers),
+                    entry.content,
+                    entry.etag,
+                    entry.last_modified,
+                ),
+            )
+            return True
+
+    def _discarded(self, key: str) -> None:
+        self._connection.execute("DELETE FROM http_responses WHERE key = ?", (key,))
+
+    def remove(self, key: str) -> None:
+        with self._lock, self._connection:
+            super().remove(key)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def make_response_cache(
+    path: Optional[str],
+    max_entries: int = DEFAULT_MAX_ENTRIES,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> MemoryResponseCache:
+    "Persist the cache to `path` if it is given, otherwise keep it in memory."
+    if path:
+        return SQLiteResponseCache(max_entries, max_bytes, path=path)
+    return MemoryResponseCache(max_entries, max_bytes)
+
+
+@frozen(kw_only=True)
+class ResponseCacheConfig:
+    http_cache: bool = field(default=True, converter=attrs.converters.to_bool)
+    http_cache_path: Optional[str] = field(default=None)
+    http_cache_max_entries: int = field(default=DEFAULT_MAX_ENTRIES, converter=int)
+    http_cache_max_bytes: int = field(default=DEFAULT_MAX_BYTES, converter=int)
+
+
+_shared_cache: Optional[MemoryResponseCache] = None
+_shared_cache_loaded = False
+_shared_cache_lock = threading.Lock()
+
+
+def shared_response_cache() -> Optional[MemoryResponseCache]:
+    """
+    The response cache shared by the HTTP clients of the exporter,
+    configured from the environment on first use. None if it is disabled.
+    """
+    global _shared_cache, _shared_cache_loaded
+    # pelorus.config imports pelorus.utils, which imports this module
+    from pelorus.config import load_and_log
+
+    with _shared_cache_lock:
+        if not _shared_cache_loaded:
+            config = load_and_log(ResponseCacheConfig)
+            if config.http_cache:
+                _shared_cache = make_response_cache(
+                    config.http_cache_path,
+                    config.http_cache_max_entries,
+                    config.http_cache_max_bytes,
+                )
+            _shared_cache_loaded = True
+        return _shared_cache
+
+
+def response_cache_metrics() -> Iterable[Metric]:
+    "The metrics of the shared response cache, if it is in use."
+    cache = _shared_cache
+    if cache is not None:
+        yield from cache.metrics()
+
+
+__all__ = [
+    "DEFAULT_MAX_ENTRIES",
+    "DEFAULT_MAX_BYTES",
+    "DEFAULT_MAX_ENTRY_BYTES",
+    "CachedResponse",
+    "MemoryResponseCache",
+    "SQLiteResponseCache",
+    "ResponseCacheConfig",
+    "make_response_cache",
+    "shared_response_cache",
+    "response_cache_metrics",
+]
@@ -0,0 +1,245 @@
+"""
+Retries and circuit breakers of the calls to upstream servers.
+
+Calls that fail with a 429 or a 5xx response, or don't get one, are retried
+after a jittered exponential backoff, or after the delay of their `Retry-After`
+header. Only idempotent calls are retried.
+
+A circuit breaker per host stops calling a server after `failure_threshold`
+consecutive failed calls: it opens, and calls fail right away with
+`CircuitOpenError` for `reset_timeout` seconds. Then a single trial call is let
+through (half-open), which closes the circuit if it succeeds, or opens it again.
+So a server that is down doesn't stall the collection of every other one.
+"""
+from __future__ import annotations
+
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+
+import requests
+from attrs import define, field, frozen
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+DEFAULT_MAX_BACKOFF_SECONDS = 30.0
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT_SECONDS = 30.0
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """
+    The delay of the `Retry-After` header of the response, in seconds or as a date.
+
+    >>> response = requests.Response()
+    >>> response.headers["Retry-After"] = "120"
+    >>> retry_after_seconds(response)
+    120.0
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+@frozen
+class RetryPolicy:
+    max_retries: int = DEFAULT_MAX_RETRIES
+    backoff: float = DEFAULT_BACKOFF_SECONDS
+    "Maximum delay before the first retry. It doubles on each retry."
+    max_backoff: float = DEFAULT_MAX_BACKOFF_SECONDS
+    "Maximum delay before a retry, including the `Retry-After` ones."
+
+    def delay(
+        self, retries: int, response: Optional[requests.Response] = None
+    ) -> Optional[float]:
+        """
+        Seconds to wait before retrying a call retried `retries` times already,
+        None if it shouldn't be retried.
+        """
+        if retries >= self.max_retries:
+            return None
+        retry_after = retry_after_seconds(response) if response is not None else None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_backoff else None
+        # "full jitter", so the retries of concurrent calls don't line up
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**retries))
+
+
+NO_RETRY = RetryPolicy(max_retries=0)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    "Raised instead of calling a host whose circuit is open."
+
+    def __init__(self, host: str):
+        self.host = host
+        super().__init__(f"Not calling {host}, too many of its calls failed")
+
+
+@define(eq=False)
+class CircuitBreaker:
+    """
+    Circuit breaker of the calls to a host. Thread-safe.
+    Call `check` before each call, then `record_success` or `record_failure`.
+    """
+
+    host: str
+    failure_threshold: int = DEFAULT_FAILURE_THRESHOLD
+    reset_timeout: float = DEFAULT_RESET_TIMEOUT_SECONDS
+    registry: Optional[CircuitBreakers] = field(default=None, repr=False)
+
+    state: str = field(default=CLOSED, init=False)
+    failures: int = field(default=0, init=False)
+    """Number of consecutive failed calls."""
+    _opened_at: float = field(default=0.0, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def check(self) -> None:
+        "Raise `CircuitOpenError` if the host should not be called now."
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if (
+                self.state == OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout
+            ):
+                # this call is the trial, the others keep failing until it ends
+                self._set(HALF_OPEN)
+                return
+        raise CircuitOpenError(self.host)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._set(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._set(OPEN)
+
+    def _set(self, state: str) -> None:
+        log = logging.warning if state == OPEN else logging.info
+        log("Circuit of %s is now %s", self.host, state)
+        self.state = state
+        if self.registry is not None:
+            self.registry.record_transition(self.host, state)
+
+
+@define(eq=False)
+class CircuitBreakers:
+    "The circuit breakers of the hosts called, and the retries of their calls."
+
+    failure_threshold: int = DEFAULT_FAILURE_THRESHOLD
+    reset_timeout: float = DEFAULT_RESET_TIMEOUT_SECONDS
+
+    _breakers: dict[str, CircuitBreaker] = field(factory=dict, init=False)
+    # (host, state) -> number of transitions to the state
+    transitions_total: Counter = field(factory=Counter, init=False)
+    # (host, reason) -> number of retried calls
+    retries_total: Counter = field(factory=Counter, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def get(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    host, self.failure_threshold, self.reset_timeout, self
+                )
+                self._breakers[host] = breaker
+            return breaker
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        "The circuit breaker of the host of the URL."
+        return self.get(urlsplit(url).netloc)
+
+    def record_transition(self, host: str, state: str) -> None:
+        with self._lock:
+            self.transitions_total[(host, state)] += 1
+
+    def record_retry(self, host: str, reason: str) -> None:
+        with self._lock:
+            self.retries_total[(host, reason)] += 1
+
+    def metrics(self) -> Iterable[Metric]:
+        states = GaugeMetricFamily(
+            "pelorus_http_circuit_state",
+            "Whether the circuit breaker of an upstream host is in the state",
+            labels=["host", "state"],
+        )
+        transitions = CounterMetricFamily(
+            "pelorus_http_circuit_transitions",
+            "Number of times the circuit breaker of an upstream host entered the state",
+            labels=["host", "state"],
+        )
+        retries = CounterMetricFamily(
+            "pelorus_http_retries",
+            "Number of calls to an upstream host retried, by the reason of the retry",
+            labels=["host", "reason"],
+        )
+        with self._lock:
+            breakers = sorted(self._breakers.items())
+            transition_counts = sorted(self.transitions_total.items())
+            retry_counts = sorted(self.retries_total.items())
+        for host, breaker in breakers:
+            for state in STATES:
+                states.add_metric([host, state], float(breaker.state == state))
+        for (host, state), count in transition_counts:
+            transitions.add_metric([host, state], count)
+        for (host, reason), count in retry_counts:
+            retries.add_metric([host, reason], count)
+        yield states
+        yield transitions
+        yield retries
+
+
+# Shared by the HTTP clients of the exporter.
+circuit_breakers = CircuitBreakers()
+
+
+__all__ = [
+    "DEFAULT_MAX_RETRIES",
+    "DEFAULT_BACKOFF_SECONDS",
+    "DEFAULT_MAX_BACKOFF_SECONDS",
+    "DEFAULT_FAILURE_THRESHOLD",
+    "DEFAULT_RESET_TIMEOUT_SECONDS",
+    "RETRY_STATUSES",
+    "IDEMPOTENT_METHODS",
+    "NO_RETRY",
+    "RetryPolicy",
+    "CircuitOpenError",
+    "CircuitBreaker",
+    "CircuitBreakers",
+    "circuit_breakers",
+    "retry_after_seconds",
+]
@@ -1,14 +1,18 @@
+import hashlib
 import logging
+import threading
+import time
 from datetime import datetime, timezone
 from itertools import chain
-from typing import Iterable, Iterator
+from typing import Iterable, Iterator, Optional, Union
 from urllib.error import HTTPError
 
 import requests
-from attrs import frozen
+from attrs import define, field, frozen
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
 
 from pelorus.timeutil import parse_assuming_utc
-from pelorus.utils import BadAttributePathError, get_nested
+from pelorus.utils import BadAttributePathError, HttpClient, get_nested
 
 # The maximum number of requests you're permitted to make per hour.
 RATELIMIT_LIMIT_HEADER = "x-ratelimit-limit"
@@ -19,6 +23,13 @@ RATELIMIT_RESET_HEADER = "x-ratelimit-reset"
 
 _DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
+# Share of the rate limit kept for the requests that can't wait for the next cycle.
+DEFAULT_RATELIMIT_RESERVE = 0.1
+# Share of the remaining requests that can be made at once, before pacing them.
+DEFAULT_RATELIMIT_BURST = 0.1
+# Seconds a request waits for its turn before being deferred to the next cycle.
+DEFAULT_RATELIMIT_MAX_WAIT_SECONDS = 10.0
+
 
 def parse_datetime(datetime_str: str) -> datetime:
     """
@@ -38,6 +49,168 @@ class GitHubError(Exception):
     message: str = "Bad response from GitHub"
 
 
+class RateLimitDeferred(Exception):
+    """
+    Raised instead of making a request that the rate limit budget can't fit
+    before the limit resets. The request should be retried on a later collection.
+    """
+
+    def __init__(self, reset_at: float):
+        self.reset_at = reset_at
+        super().__init__(
+            "GitHub rate limit budget exhausted until "
+            + datetime.fromtimestamp(reset_at, timezone.utc).isoformat()
+        )
+
+
+@define(eq=False)
+class RateLimitBudget:
+    """
+    The rate limit of a GitHub token, shared by the requests made with it.
+
+    The limit, remaining requests and reset time come from the rate limit headers
+    of the responses, which count the requests of every client of the token.
+    Requests are paced to spread the remaining requests until the reset:
+    a `burst` share of them can be made at once, then they are spaced evenly.
+    A request that would wait more than `max_wait` seconds is deferred instead,
+    by raising `RateLimitDeferred`. Requests without priority are also deferred
+    once only the `reserve` share of the limit is left.
+    """
+
+    reserve: float = DEFAULT_RATELIMIT_RESERVE
+    burst: float = DEFAULT_RATELIMIT_BURST
+    max_wait: float = DEFAULT_RATELIMIT_MAX_WAIT_SECONDS
+
+    limit: Optional[int] = field(default=None, init=False)
+    remaining: Optional[int] = field(default=None, init=False)
+    reset_at: Optional[float] = field(default=None, init=False)
+    """Unix timestamp of when the rate limit resets."""
+
+    deferred_total: int = field(default=0, init=False)
+    """Number of requests deferred to a later collection."""
+    waited_seconds_total: float = field(default=0.0, init=False)
+    """Time requests waited for their turn."""
+
+    # Token bucket of the requests that can be made now. None until limited.
+    _tokens: Optional[float] = field(default=None, init=False)
+    _refilled_at: float = field(default=0.0, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def update(self, response: requests.Response) -> None:
+        "Take the rate limit headers of the response into account, if it has them."
+        try:
+            limit = int(response.headers[RATELIMIT_LIMIT_HEADER])
+            remaining = int(response.headers[RATELIMIT_REMAINING_HEADER])
+            reset_at = float(response.headers[RATELIMIT_RESET_HEADER])
+        except (KeyError, ValueError):
+            return
+        with self._lock:
+            self.limit, self.remaining, self.reset_at = limit, remaining, reset_at
+
+    def acquire(self, priority: bool = True) -> None:
+        """
+        Wait for the turn of a request, or raise `RateLimitDeferred`
+        if the budget can't fit it.
+        """
+        with self._lock:
+            now = time.time()
+            if self.remaining is None or self.reset_at is None or now >= self.reset_at:
+                # unknown yet, or reset since the last response
+                self._tokens = None
+                return
+
+            available = self.remaining
+            if not priority:
+                available -= int((self.limit or 0) * self.reserve)
+            if available <= 0:
+                self.deferred_total += 1
+                raise RateLimitDeferred(self.reset_at)
+
+            rate = available / (self.reset_at - now)
+            capacity = max(available * self.burst, 1.0)
+            monotonic = time.monotonic()
+            if self._tokens is None:
+                self._tokens = capacity
+            else:
+                self._tokens = min(
+                    self._tokens + (monotonic - self._refilled_at) * rate, capacity
+                )
+            self._refilled_at = monotonic
+
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / rate
+            if wait > self.max_wait:
+                self.deferred_total += 1
+                raise RateLimitDeferred(self.reset_at)
+            # a negative balance queues the following requests after this one
+            self._tokens -= 1
+            self.waited_seconds_total += wait
+
+        if wait:
+            logging.debug("Pacing GitHub request by %.2fs", wait)
+            time.sleep(wait)
+
+
+_budgets: dict[str, RateLimitBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def rate_limit_budget(token: Optional[str]) -> RateLimitBudget:
+    "The budget shared by the requests made with the token, or without one."
+    key = hashlib.sha256((token or "").encode()).hexdigest()
+    with _budgets_lock:
+        return _budgets.setdefault(key, RateLimitBudget())
+
+
+def rate_limit_metrics() -> Iterable[Metric]:
+    "The metrics of the rate limit budgets in use."
+    with _budgets_lock:
+        budgets = list(_budgets.values())
+    if not budgets:
+        return
+
+    remaining = GaugeMetricFamily(
+        "pelorus_github_ratelimit_remaining",
+        "Lowest number of requests left in the GitHub rate limit of the tokens used",
+    )
+    known = [budget.remaining for budget in budgets if budget.remaining is not None]
+    if known:
+        remaining.add_metric([], min(known))
+    yield remaining
+
+    deferred = CounterMetricFamily(
+        "pelorus_github_requests_deferred",
+        "Number of GitHub requests deferred to a later collection by the rate limit",
+    )
+    deferred.add_metric([], sum(budget.deferred_total for budget in budgets))
+    yield deferred
+
+    waited = CounterMetricFamily(
+        "pelorus_github_requests_paced_seconds",
+        "Time GitHub requests waited to spread the rate limit until its reset",
+    )
+    waited.add_metric([], sum(budget.waited_seconds_total for budget in budgets))
+    yield waited
+
+
+def get_github(
+    session: Union[requests.Session, HttpClient],
+    url: str,
+    budget: Optional[RateLimitBudget] = None,
+    priority: bool = True,
+    **kwargs,
+) -> requests.Response:
+    """
+    GET a GitHub API URL, paced by the rate limit budget of the token, if given.
+    May raise `RateLimitDeferred`.
+    """
+    if budget is not None:
+        budget.acquire(priority)
+    response = session.get(url, **kwargs)
+    if budget is not None:
+        budget.update(response)
+    return response
+
+
 def _log_and_validate_ratelimit(response: requests.Response):
     """
     Log ratelimit header values as a debug message,
@@ -121,7 +294,9 @@ class GitHubPageResponse:
 
 
 def paginate_github_with_page(
-    session: requests.Session, start_url: str
+    session: Union[requests.Session, HttpClient],
+    start_url: str,
+    budget: Optional[RateLimitBudget] = None,
 ) -> Iterable[GitHubPageResponse]:
     """
     Paginate github requests the way their API dictates:
@@ -135,8 +310,10 @@ def paginate_github_with_page(
     JSONDecodeError if there's a response with invalid JSON
     ValueError if a response was valid json but wasn't a list
     BadAttributePathError if a response was missing a `next` link or the first was missing a `last` link.
+
+    With a `budget`, requests are paced by it, and RateLimitDeferred is raised as is.
     """
-    response = session.get(start_url)
+    response = get_github(session, start_url, budget)
     try:
         json = _validate_github_response(response)
 
@@ -156,7 +333,7 @@ def paginate_github_with_page(
                 break
 
             url = get_nested(response.links, "next.url")
-            response = session.get(url)
+            response = get_github(session, url, budget)
             json = _validate_github_response(response)
     except (
         HTTPError,
@@ -167,7 +344,11 @@ def paginate_github_with_page(
         raise GitHubError(response) from e
 
 
-def paginate_github(session: requests.Session, start_url: str) -> Iterable:
+def paginate_github(
+    session: Union[requests.Session, HttpClient],
+    start_url: str,
+    budget: Optional[RateLimitBudget] = None,
+) -> Iterable:
     """
     Paginate github requests the way their API dictates:
     https://docs.github.com/en/rest/guides/traversing-with-pagination
@@ -180,5 +361,7 @@ def paginate_github(session: requests.Session, start_url: str) -> Iterable:
     JSONDecodeError if there's a response with invalid JSON
     ValueError if a response was valid json but wasn't a list
     BadAttributePathError if a response was missing a `next` link or the first was missing a `last` link.
+
+    With a `budget`, requests are paced by it, and RateLimitDeferred is raised as is.
     """
-    return chain.from_iterable(paginate_github_with_page(session, start_url))
+    return chain.from_iterable(paginate_github_with_page(session, start_url, budget))
@@ -0,0 +1,379 @@
+"""
+Informer-style watch cache for the Kubernetes objects the exporters read.
+
+Without it, every collection lists Pods, ReplicaSets, ReplicationControllers,
+Builds and Namespaces again, namespace by namespace, which puts the whole
+cost of a collection on the API server.
+
+An `Informer` lists a resource once, then keeps a local store up to date by
+watching it from the resourceVersion of that list. Bookmark events keep the
+resourceVersion fresh while nothing changes, and the informer relists when the
+API server tells it that the resourceVersion expired (410 Gone).
+Collectors read from the store through its indexes instead of calling the API.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, Hashable, Iterable, Optional
+
+import attrs.converters
+from attrs import define, field, frozen
+from kubernetes.dynamic.exceptions import GoneError
+from kubernetes.dynamic.resource import ResourceInstance
+from kubernetes.watch.watch import iter_resp_lines
+from openshift.dynamic import DynamicClient
+from openshift.dynamic.resource import Resource, ResourceField
+
+import pelorus
+from pelorus.config import load_and_log
+
+BY_NAMESPACE = "namespace"
+BY_OWNER_UID = "owner_uid"
+BY_APP = "app"
+
+# Server-side timeout of a single watch request, after which the watch is
+# restarted from the last seen resourceVersion.
+DEFAULT_WATCH_TIMEOUT_SECONDS = 300
+# How long a collection waits for the initial list of a new informer.
+DEFAULT_SYNC_TIMEOUT_SECONDS = 60
+
+_MIN_BACKOFF_SECONDS = 1
+_MAX_BACKOFF_SECONDS = 60
+
+Indexer = Callable[[ResourceField], Iterable[Hashable]]
+
+
+def namespace_index(obj: ResourceField) -> Iterable[Hashable]:
+    namespace = obj.metadata.namespace
+    return (namespace,) if namespace else ()
+
+
+def owner_uid_index(obj: ResourceField) -> Iterable[Hashable]:
+    return tuple(owner.uid for owner in obj.metadata.ownerReferences or [])
+
+
+def label_index(label: str) -> Indexer:
+    """
+    Index objects by `(namespace, value of the label)`,
+    skipping the objects that don't have the label.
+    """
+
+    def _index(obj: ResourceField) -> Iterable[Hashable]:
+        value = obj.metadata.labels[label] if obj.metadata.labels else None
+        return ((obj.metadata.namespace, value),) if value else ()
+
+    return _index
+
+
+class _WatchExpired(Exception):
+    "The resourceVersion being watched is too old, the informer must relist."
+
+
+@define(eq=False)
+class Informer:
+    """
+    Local store of the objects of one resource, kept up to date by a watch.
+
+    The objects are keyed by their UID, and indexed by every function in
+    `indexers`. Reading from the store never calls the API server.
+    """
+
+    resource: Resource
+    label_selector: Optional[str] = None
+    field_selector: Optional[str] = None
+    indexers: dict[str, Indexer] = field(factory=dict)
+    watch_timeout: int = DEFAULT_WATCH_TIMEOUT_SECONDS
+
+    _objects: dict[str, ResourceField] = field(factory=dict, init=False)
+    # index name -> index key -> uid -> object
+    _indexes: dict[str, dict[Hashable, dict[str, ResourceField]]] = field(
+        factory=dict, init=False
+    )
+    # index name -> uid -> keys the object is currently indexed under
+    _indexed_keys: dict[str, dict[str, tuple]] = field(factory=dict, init=False)
+    _resource_version: Optional[str] = field(default=None, init=False)
+
+    _lock: threading.RLock = field(factory=threading.RLock, init=False)
+    _synced: threading.Event = field(factory=threading.Event, init=False)
+    _stop_event: threading.Event = field(factory=threading.Event, init=False)
+    _thread: Optional[threading.Thread] = field(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        self._indexes = {name: {} for name in self.indexers}
+        self._indexed_keys = {name: {} for name in self.indexers}
+
+    @property
+    def resource_version(self) -> Optional[str]:
+        return self._resource_version
+
+    @property
+    def has_synced(self) -> bool:
+        return self._synced.is_set()
+
+    def wait_for_sync(self, timeout: Optional[float] = None) -> bool:
+        "Wait until the initial list was stored. Returns whether it was."
+        return self._synced.wait(timeout)
+
+    def list(self) -> list[ResourceField]:
+        with self._lock:
+            return list(self._objects.values())
+
+    def get(self, uid: str) -> Optional[ResourceField]:
+        with self._lock:
+            return self._objects.get(uid)
+
+    def by_index(self, index_name: str, key: Hashable) -> list[ResourceField]:
+        with self._lock:
+            return list(self._indexes[index_name].get(key, {}).values())
+
+    def index_keys(self, index_name: str) -> list[Hashable]:
+        with self._lock:
+            return list(self._indexes[index_name].keys())
+
+    # region store
+
+    def _add(self, obj: ResourceField) -> None:
+        uid = obj.metadata.uid
+        self._remove(uid)
+        self._objects[uid] = obj
+        for name, indexer in self.indexers.items():
+            keys = tuple(indexer(obj))
+            self._indexed_keys[name][uid] = keys
+            for key in keys:
+                self._indexes[name].setdefault(key, {})[uid] = obj
+
+    def _remove(self, uid: str) -> None:
+        if self._objects.pop(uid, None) is None:
+            return
+        for name in self.indexers:
+            index = self._indexes[name]
+            for key in self._indexed_keys[name].pop(uid, ()):
+                bucket = index.get(key)
+                if bucket is not None:
+                    bucket.pop(uid, None)
+                    if not bucket:
+                        del index[key]
+
+    def _replace(self, items: Iterable[ResourceField], resource_version: str) -> None:
+        with self._lock:
+            self._objects = {}
+            self._indexes = {name: {} for name in self.indexers}
+            self._indexed_keys = {name: {} for name in self.indexers}
+            for obj in items:
+                self._add(obj)
+            self._resource_version = resource_version
+        self._synced.set()
+
+    def apply(self, event: dict) -> None:
+        """
+        Apply one decoded watch event to the store.
+
+        Raises `_WatchExpired` if the API server says the watch must be restarted
+        from a new list.
+        """
+        event_type = event.get("type")
+        raw = event.get("object") or {}
+
+        if event_type == "ERROR":
+            raise _WatchExpired(
+                f"{raw.get('code')} {raw.get('reason')}: {raw.get('message')}"
+            )
+
+        resource_version = (raw.get("metadata") or {}).get("resourceVersion")
+
+        with self._lock:
+            if event_type in ("ADDED", "MODIFIED"):
+                self._add(ResourceInstance(self.resource, raw).attributes)
+            elif event_type == "DELETED":
+                self._remove(raw["metadata"]["uid"])
+            elif event_type != "BOOKMARK":
+                logging.debug("Ignoring watch event of type %s", event_type)
+                return
+            if resource_version:
+                self._resource_version = resource_version
+
+    # endregion
+
+    # region list and watch
+
+    def relist(self) -> None:
+        "List all objects, replacing the store and the resourceVersion to watch from."
+        result = self.resource.get(
+            label_selector=self.label_selector, field_selector=self.field_selector
+        )
+        self._replace(result.items, result.metadata.resourceVersion)
+        logging.debug(
+            "Listed %d %s objects at resourceVersion %s",
+            len(self._objects),
+            self.resource.kind,
+            self._resource_version,
+        )
+
+    def watch(self) -> None:
+        "Watch from the current resourceVersion until the server ends the request."
+        response = self.resource.get(
+            label_selector=self.label_selector,
+            field_selector=self.field_selector,
+            resource_version=self._resource_version,
+            timeout_seconds=self.watch_timeout,
+            watch=True,
+            query_params=[("allowWatchBookmarks", "true")],
+            _request_timeout=self.watch_timeout + 30,
+            serialize=False,
+        )
+        try:
+            for line in iter_resp_lines(response):
+                self.apply(json.loads(line))
+                if self._stop_event.is_set():
+                    return
+        finally:
+            response.close()
+            response.release_conn()
+
+    def _run(self) -> None:
+        backoff = _MIN_BACKOFF_SECONDS
+        while not self._stop_event.is_set():
+            try:
+                if self._resource_version is None:
+                    self.relist()
+                self.watch()
+                backoff = _MIN_BACKOFF_SECONDS
+                continue
+            except (_WatchExpired, GoneError) as e:
+                logging.debug(
+                    "Watch of %s expired, relisting: %s", self.resource.kind, e
+                )
+                self._resource_version = None
+                continue
+            except Exception:
+                logging.warning(
+                    "Watching %s failed, retrying in %ss",
+                    self.resource.kind,
+                    backoff,
+                    exc_info=True,
+                )
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF_SECONDS)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name=f"pelorus-watch-{self.resource.kind}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # endregion
+
+
+@frozen(kw_only=True)
+class WatchCacheConfig:
+    # Serve Kubernetes objects from a watch cache instead of listing them on every
+    # collection. Requires the `watch` verb on the objects the exporter reads.
+    watch_cache: bool = field(default=False, converter=attrs.converters.to_bool)
+
+    app_label: str = pelorus.DEFAULT_APP_LABEL
+
+
+@define(eq=False)
+class WatchCache:
+    """
+    The informers shared by a collector, one per resource kind and selectors.
+
+    Informers are started the first time they are asked for.
+    """
+
+    client: DynamicClient
+    app_label: str = pelorus.DEFAULT_APP_LABEL
+    sync_timeout: float = DEFAULT_SYNC_TIMEOUT_SECONDS
+
+    _informers: dict[tuple, Informer] = field(factory=dict, init=False)
+    # informer key -> time.monotonic() after which lookups stop waiting for it
+    _sync_deadlines: dict[tuple, float] = field(factory=dict, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def informer(
+        self,
+        api_version: str,
+        kind: str,
+        *,
+        label_selector: Optional[str] = None,
+        field_selector: Optional[str] = None,
+    ) -> Optional[Informer]:
+        """
+        Get the synced informer of the given resource and selectors, starting it if needed.
+
+        Returns None if it did not sync within `sync_timeout` seconds of its first
+        lookup, so the caller can fall back to querying the API server.
+        Later lookups don't wait while it is still syncing.
+        """
+        key = (api_version, kind, label_selector, field_selector)
+        with self._lock:
+            informer = self._informers.get(key)
+            if informer is None:
+                resource = self.client.resources.get(api_version=api_version, kind=kind)
+                informer = Informer(
+                    resource,
+                    label_selector=label_selector,
+                    field_selector=field_selector,
+                    indexers={
+                        BY_NAMESPACE: namespace_index,
+                        BY_OWNER_UID: owner_uid_index,
+                        BY_APP: label_index(self.app_label),
+                    },
+                )
+                informer.start()
+                self._informers[key] = informer
+                self._sync_deadlines[key] = time.monotonic() + self.sync_timeout
+            deadline = self._sync_deadlines[key]
+
+        if informer.has_synced:
+            return informer
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.debug("Watch cache for %s still not synced", kind)
+            return None
+        if not informer.wait_for_sync(remaining):
+            logging.warning(
+                "Watch cache for %s not synced after %ss, querying the API instead",
+                kind,
+                self.sync_timeout,
+            )
+            return None
+        return informer
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            informers = list(self._informers.values())
+            self._informers.clear()
+            self._sync_deadlines.clear()
+        for informer in informers:
+            informer.stop(timeout)
+
+
+def make_watch_cache(client: DynamicClient) -> Optional[WatchCache]:
+    "Create the watch cache if it is enabled by the WATCH_CACHE configuration."
+    config = load_and_log(WatchCacheConfig)
+    if not config.watch_cache:
+        return None
+    return WatchCache(client, config.app_label)
+
+
+__all__ = [
+    "BY_NAMESPACE",
+    "BY_OWNER_UID",
+    "BY_APP",
+    "Informer",
+    "WatchCache",
+    "WatchCacheConfig",
+    "make_watch_cache",
+]
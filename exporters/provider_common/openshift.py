@@ -1,20 +1,42 @@
+import json
 import logging
 import re
+import threading
 import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional, Set, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
+from attrs import define, field
 from openshift.dynamic import DynamicClient, ResourceInstance
 from openshift.dynamic.exceptions import ResourceNotFoundError
-from openshift.dynamic.resource import ResourceField
+from openshift.dynamic.resource import Resource, ResourceField
+from prometheus_client.core import CounterMetricFamily
 
 from pelorus.timeutil import parse_assuming_utc
+from provider_common.informer import BY_NAMESPACE, WatchCache
+
+try:
+    import orjson
+
+    # Decodes large lists several times faster than the json module
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 # https://docs.openshift.com/container-platform/4.10/rest_api/objects/index.html#io.k8s.apimachinery.pkg.apis.meta.v1.ObjectMeta
 _DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
 SUPPORTED_REPLICA_OBJECTS = ["ReplicaSet", "ReplicationController"]
 
+# Asks the API server for a PartialObjectMetadataList: the objects without their
+# spec and status. Servers that don't support it answer with the full objects.
+METADATA_ONLY_ACCEPT = (
+    "application/json;as=PartialObjectMetadataList;v=v1;g=meta.k8s.io,"
+    "application/json"
+)
+
 # Cache threshold in seconds, used by every cached_parents_dict entry
 CACHE_THRESHOLD_1_DAY = 60 * 60 * 24
 cached_parents_dict: dict[str, Tuple[ResourceInstance, float]] = {}
@@ -56,6 +78,182 @@ def _remove_expired_objects() -> None:
             del cached_parents_dict[uid]
 
 
+PER_NAMESPACE = "per_namespace"
+CLUSTER = "cluster"
+
+DEFAULT_NAMESPACE_QUERY_WORKERS = 8
+# The cost of one list call, counted in listed items.
+LIST_CALL_COST_ITEMS = 50
+
+
+@define(eq=False)
+class NamespaceQueryPlanner:
+    """
+    Plans how a resource is listed in a set of namespaces: with one call per
+    namespace, run concurrently by up to `workers` threads, or with a single
+    cluster-wide call whose items are then filtered by namespace.
+
+    The plan with the lowest cost is chosen, a call costing `call_cost` items.
+    The number of items each namespace and the whole cluster hold are remembered
+    from the previous lists of the same query. Until the cluster size is known,
+    per-namespace calls are made if they fit in one round of concurrent calls.
+    """
+
+    workers: int = field(default=DEFAULT_NAMESPACE_QUERY_WORKERS, converter=int)
+    call_cost: int = LIST_CALL_COST_ITEMS
+
+    plans_total: Counter = field(factory=Counter, init=False)
+    "Number of lists by (kind, plan)."
+    requests_total: Counter = field(factory=Counter, init=False)
+    "Number of list calls by (kind, plan)."
+
+    # query -> number of items in the whole cluster, as last listed cluster-wide
+    _cluster_sizes: dict[tuple, int] = field(factory=dict, init=False)
+    # query -> number of items by namespace
+    _namespace_sizes: dict[tuple, dict[str, int]] = field(factory=dict, init=False)
+    _executor: Optional[ThreadPoolExecutor] = field(default=None, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def plan(self, query: tuple, namespaces: Set[str]) -> str:
+        "Choose how to list the items of the query in the namespaces."
+        if len(namespaces) <= 1:
+            return PER_NAMESPACE
+        with self._lock:
+            cluster_size = self._cluster_sizes.get(query)
+            namespace_sizes = self._namespace_sizes.get(query, {})
+            if cluster_size is None:
+                return PER_NAMESPACE if len(namespaces) <= self.workers else CLUSTER
+            in_namespaces = sum(namespace_sizes.get(ns, 0) for ns in namespaces)
+        per_namespace_cost = len(namespaces) * self.call_cost + in_namespaces
+        cluster_cost = self.call_cost + cluster_size
+        return CLUSTER if cluster_cost < per_namespace_cost else PER_NAMESPACE
+
+    def list(
+        self,
+        resource: Resource,
+        namespaces: Optional[Set[str]] = None,
+        raw: bool = False,
+        **query,
+    ) -> List[Union[ResourceField, dict]]:
+        """
+        List the items of the resource matching the query in the given namespaces,
+        or in the whole cluster if no namespaces are given.
+        With `raw`, the items are plain dicts, as returned by `list_raw`.
+        """
+
+        def get_items(**kwargs) -> list:
+            if raw:
+                return list_raw(resource, **kwargs)
+            return resource.get(**kwargs).items
+
+        key = (resource.kind, *sorted(query.items()))
+        plan = self.plan(key, namespaces) if namespaces else CLUSTER
+        logging.debug(
+            "Listing %s in %s namespaces with plan %s",
+            resource.kind,
+            len(namespaces) if namespaces else "all",
+            plan,
+        )
+
+        if plan == CLUSTER:
+            items = get_items(**query)
+            calls = 1
+            self._record(key, items, cluster=True)
+            if namespaces:
+                items = [item for item in items if _namespace_of(item) in namespaces]
+        else:
+            calls = len(namespaces)
+            if calls == 1:
+                pages = [get_items(namespace=ns, **query) for ns in namespaces]
+            else:
+                pages = list(
+                    self._get_executor().map(
+                        lambda ns: get_items(namespace=ns, **query), namespaces
+                    )
+                )
+            items = [item for page in pages for item in page]
+            self._record(key, items, cluster=False)
+
+        with self._lock:
+            self.plans_total[(resource.kind, plan)] += 1
+            self.requests_total[(resource.kind, plan)] += calls
+        return items
+
+    def _record(
+        self, key: tuple, items: List[Union[ResourceField, dict]], cluster: bool
+    ) -> None:
+        sizes = Counter(_namespace_of(item) for item in items)
+        with self._lock:
+            if cluster:
+                self._cluster_sizes[key] = len(items)
+                self._namespace_sizes[key] = dict(sizes)
+            else:
+                self._namespace_sizes.setdefault(key, {}).update(sizes)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="pelorus-namespace-query",
+                )
+            return self._executor
+
+    def metrics(self) -> Iterable[CounterMetricFamily]:
+        plans = CounterMetricFamily(
+            "pelorus_namespace_query_plans",
+            "Number of namespaced lists by resource kind and chosen plan",
+            labels=["kind", "plan"],
+        )
+        requests = CounterMetricFamily(
+            "pelorus_namespace_query_requests",
+            "Number of list calls made by resource kind and plan",
+            labels=["kind", "plan"],
+        )
+        with self._lock:
+            for (kind, plan), count in sorted(self.plans_total.items()):
+                plans.add_metric([kind, plan], count)
+            for (kind, plan), count in sorted(self.requests_total.items()):
+                requests.add_metric([kind, plan], count)
+        yield plans
+        yield requests
+
+
+# Shared by the collectors of the exporter, which yield its metrics.
+namespace_query_planner = NamespaceQueryPlanner()
+
+
+def _namespace_of(item: Union[ResourceField, dict]) -> Optional[str]:
+    "The namespace of an item, listed raw or not."
+    if isinstance(item, dict):
+        return item["metadata"].get("namespace")
+    return item.metadata.namespace
+
+
+def list_raw(resource: Resource, **query) -> List[dict]:
+    """
+    List the objects of the resource matching the query as plain dicts.
+
+    The DynamicClient wraps every nested object of a response in a ResourceField,
+    which takes most of the time of listing thousands of pods. Here the response
+    is only decoded, with orjson if it is installed. Read the items with the
+    dict-native helpers, such as `filter_raw_pods_by_replica_uid`.
+    """
+    response = resource.get(serialize=False, **query)
+    return _loads(response.data).get("items") or []
+
+
+def list_metadata(resource: Resource, **query) -> List[ResourceField]:
+    """
+    List the objects of the resource matching the query, getting only their metadata.
+
+    Owners and namespaces are only looked up for their name, uid and creationTimestamp,
+    so there is no need to download and deserialize pod templates or statuses.
+    Only the `metadata` of the returned items can be relied upon.
+    """
+    return resource.get(header_params={"Accept": METADATA_ONLY_ACCEPT}, **query).items
+
+
 def parse_datetime(dt_str: str) -> datetime:
     return parse_assuming_utc(dt_str, _DATETIME_FORMAT)
 
@@ -75,7 +273,10 @@ def get_running_pods(
     namespaces: Optional[Set[str]] = None,
     app_label: Optional[str] = None,
     with_owner_only: bool = True,
-) -> List[ResourceField]:
+    cache: Optional[WatchCache] = None,
+    planner: Optional[NamespaceQueryPlanner] = None,
+    raw: bool = False,
+) -> List[Union[ResourceField, dict]]:
     """
     Retrieves running pods in the OpenShift cluster that have a parent owner,
     which can be either a ReplicaSet or ReplicationController.
@@ -92,23 +293,50 @@ def get_running_pods(
                                    By default, no label is required.
         with_owner_only (bool): A flag that determines whether to return only pods with ownerReferences or all pods.
                                 By default, the function only returns pods with ownerReferences.
+        cache (Optional[WatchCache]): If given, the pods are read from its informer instead of the API.
+        planner (Optional[NamespaceQueryPlanner]): Plans the API calls listing the pods of the namespaces.
+                                                   Defaults to `namespace_query_planner`.
+        raw (bool): If set and no `cache` is given, the pods are returned as plain dicts,
+                    listed with `list_raw`.
 
     Returns:
         List[ResourceField]: A list of ResourceField objects representing the running pods in the
-                             OpenShift cluster that meet the criteria.
+                             OpenShift cluster that meet the criteria, or of dicts if `raw` is used.
     """
+    raw = raw and cache is None
 
-    v1_services = client.resources.get(api_version="v1", kind="Pod")
+    informer = cache and cache.informer(
+        "v1", "Pod", label_selector=app_label, field_selector="status.phase=Running"
+    )
 
     pods = []
 
-    for ns in namespaces or {""}:
-        pods += v1_services.get(
+    if informer:
+        if namespaces:
+            for ns in namespaces:
+                pods += informer.by_index(BY_NAMESPACE, ns)
+        else:
+            pods = informer.list()
+    else:
+        v1_pods = client.resources.get(api_version="v1", kind="Pod")
+
+        pods = (planner or namespace_query_planner).list(
+            v1_pods,
+            namespaces,
+            raw=raw,
             label_selector=app_label,
             field_selector="status.phase=Running",
-            namespace=ns,
-        ).items
+        )
 
+    if with_owner_only and raw:
+        return [
+            pod
+            for pod in pods
+            if any(
+                owner_ref.get("kind") in SUPPORTED_REPLICA_OBJECTS
+                for owner_ref in pod["metadata"].get("ownerReferences") or ()
+            )
+        ]
     if with_owner_only:
         return [
             ocp_object
@@ -123,66 +351,95 @@ def get_running_pods(
     return pods
 
 
-def get_owner_object_from_child(
-    client: DynamicClient, uid: str, child_object: ResourceField
-) -> Dict[str, ResourceInstance]:
+def get_owner_creation_timestamps(
+    client: DynamicClient,
+    pods_by_owner_uid: Dict[str, Union[ResourceField, dict]],
+    cache: Optional[WatchCache] = None,
+) -> Dict[str, Any]:
     """
-    Retrieves the OpenShift Parent object by its UID, using information about the API version and resource type
-    from the given Child object.
+    Resolves the creationTimestamp of the ReplicaSets and ReplicationControllers owning the given pods.
+
+    Getting owners one by one takes one cluster-wide API call per owner. Instead, the owners
+    that are not cached yet are listed once per namespace and kind, and matched by UID.
 
     Args:
         client (DynamicClient): An OpenShift client object.
-        uid (str): The UID of the Parent object.
-        child_object (ResourceField): The Child object that contains the reference to the Parent object.
+        pods_by_owner_uid (Dict[str, ResourceField]): Pods by the UID of their owner,
+                                                      as returned by filter_pods_by_replica_uid,
+                                                      or raw pods by filter_raw_pods_by_replica_uid.
+        cache (Optional[WatchCache]): If given, owners are looked up in its informers first.
 
     Returns:
-        Dict[str, ResourceField]: A dictionary with the UID of the Parent object as the key
-                                  and the Parent object itself as the value.
-                                  An empty dictionary is returned if the Parent object is not found
-                                  or if there is an error during the retrieval.
+        Dict[str, Any]: The creationTimestamp of each owner found, by owner UID.
+                        Owners that are not a supported kind, or that don't exist anymore, are left out.
     """
+    _remove_expired_objects()
 
-    owner_ref = next(
-        (owner for owner in child_object.metadata.ownerReferences if owner.uid == uid),
-        None,
-    )
+    owners: Dict[str, ResourceField] = {}
+    # (apiVersion, kind, namespace) -> UIDs of the owners to list
+    to_list: Dict[Tuple[str, str, str], Set[str]] = defaultdict(set)
+
+    for uid, pod in pods_by_owner_uid.items():
+        owner_ref = _owner_reference(pod, uid)
+        if owner_ref is None or owner_ref[1] not in SUPPORTED_REPLICA_OBJECTS:
+            continue
+        api_version, kind, _ = owner_ref
 
-    if owner_ref:
-        _remove_expired_objects()
-        replica = _get_object_from_cache(owner_ref.uid)
-        if replica:
-            return {owner_ref.uid: replica}
+        owner = _get_object_from_cache(uid)
+        if owner is None and cache:
+            informer = cache.informer(api_version, kind)
+            owner = informer and informer.get(uid)
 
+        if owner:
+            owners[uid] = owner
+        else:
+            to_list[owner_ref].add(uid)
+
+    for (api_version, kind, namespace), uids in to_list.items():
         logging.debug(
-            "Getting replica: %s, kind: %s, api_version: %s",
-            owner_ref.uid,
-            owner_ref.kind,
-            owner_ref.apiVersion,
+            "Listing %s in namespace %s to resolve %d owners",
+            kind,
+            namespace,
+            len(uids),
         )
-
         try:
-            api_resource = client.resources.get(
-                api_version=owner_ref.apiVersion, kind=owner_ref.kind
-            )
-
-            # We don't need to limit for a given namespace, because Replica objects may live in other
-            # then Pod namespace, so we may get multiple replica objects for a given name.
-            # The field_selector does not work on the UID, that's why we need to match separately
-            replica_list = api_resource.get(
-                field_selector=f"metadata.name={owner_ref.name}"
-            )
-
-            for replica in replica_list.items:
-                if replica.metadata.uid == owner_ref.uid:
-                    _add_object_to_cache(owner_ref.uid, replica)
-                    return {owner_ref.uid: replica}
+            api_resource = client.resources.get(api_version=api_version, kind=kind)
+            replicas = list_metadata(api_resource, namespace=namespace)
         except ResourceNotFoundError:
             logging.debug(
-                "API Object not found for version: %s object: %s",
-                owner_ref.apiVersion,
-                owner_ref.uid,
+                "API Object not found for version: %s kind: %s", api_version, kind
             )
-    return {}
+            continue
+
+        for replica in replicas:
+            if replica.metadata.uid in uids:
+                _add_object_to_cache(replica.metadata.uid, replica)
+                owners[replica.metadata.uid] = replica
+
+    return {uid: owner.metadata.creationTimestamp for uid, owner in owners.items()}
+
+
+def _owner_reference(
+    pod: Union[ResourceField, dict], uid: str
+) -> Optional[Tuple[str, str, str]]:
+    "The (apiVersion, kind, namespace) of the owner of the pod with the given UID."
+    if isinstance(pod, dict):
+        metadata = pod["metadata"]
+        namespace = metadata.get("namespace")
+        refs = [
+            (ref.get("uid"), ref.get("apiVersion"), ref.get("kind"))
+            for ref in metadata.get("ownerReferences") or ()
+        ]
+    else:
+        namespace = pod.metadata.namespace
+        refs = [
+            (ref.uid, ref.apiVersion, ref.kind)
+            for ref in pod.metadata.ownerReferences or ()
+        ]
+    for ref_uid, api_version, kind in refs:
+        if ref_uid == uid:
+            return api_version, kind, namespace
+    return None
 
 
 def filter_pods_by_replica_uid(
@@ -214,8 +471,31 @@ def filter_pods_by_replica_uid(
     }
 
 
+def filter_raw_pods_by_replica_uid(pods_list: List[dict]) -> Dict[str, dict]:
+    """
+    Like `filter_pods_by_replica_uid`, for pods listed as plain dicts.
+
+    >>> pods = [
+    ...     dict(metadata=dict(name="a-1", ownerReferences=[dict(uid="a")])),
+    ...     dict(metadata=dict(name="a-2", ownerReferences=[dict(uid="a")])),
+    ...     dict(metadata=dict(name="b-1")),
+    ... ]
+    >>> {uid: pod["metadata"]["name"] for uid, pod in filter_raw_pods_by_replica_uid(pods).items()}
+    {'a': 'a-2'}
+    """
+    return {
+        owner_reference["uid"]: pod
+        for pod in pods_list
+        for owner_reference in pod["metadata"].get("ownerReferences") or ()
+        if "uid" in owner_reference
+    }
+
+
 def get_and_log_namespaces(
-    client: DynamicClient, namespaces: set[str], prod_label: str
+    client: DynamicClient,
+    namespaces: set[str],
+    prod_label: str,
+    cache: Optional[WatchCache] = None,
 ) -> set[str]:
     """
     Get the set of namespaces to watch, and log what they are.
@@ -223,6 +503,7 @@ def get_and_log_namespaces(
     1. The namespaces explicitly specified
     2. The namespaces matched by PROD_LABEL
     3. If neither namespaces nor the PROD_LABEL is given, then implicitly matches all namespaces.
+    Namespaces are read from the watch cache, if one is given.
     """
     if namespaces:
         logging.debug("Watching namespaces %s", namespaces)
@@ -240,8 +521,13 @@ def get_and_log_namespaces(
         )
         query_args = dict()
 
-    all_namespaces = client.resources.get(api_version="v1", kind="Namespace")
-    namespaces = {ns.metadata.name for ns in all_namespaces.get(**query_args).items}
+    informer = cache and cache.informer("v1", "Namespace", **query_args)
+    if informer:
+        namespace_objects = informer.list()
+    else:
+        all_namespaces = client.resources.get(api_version="v1", kind="Namespace")
+        namespace_objects = list_metadata(all_namespaces, **query_args)
+    namespaces = {ns.metadata.name for ns in namespace_objects}
     logging.debug("Watching namespaces %s", namespaces)
     if not namespaces:
         logging.warning(
@@ -293,13 +579,32 @@ def get_images_from_pod(pod: ResourceField) -> Dict[str, str]:
 
     # Once we move fully to python 3.10+ we can replace with:
     # if (containers := replica.spec.template.spec.containers) is not None and containers:
-    image_shas = {}
     if pod and pod.status and pod.status.containerStatuses:
-        for container_status in pod.status.containerStatuses:
-            image_id = container_status.imageID
-            registry, image_name, sha256_value = _parse_container_image_uri(image_id)
-            if sha256_value and registry and image_name:
-                image_shas[
-                    sha256_value
-                ] = f"docker://{registry}{image_name}@{sha256_value}"
+        return _images_from_ids(
+            container_status.imageID or ""
+            for container_status in pod.status.containerStatuses
+        )
+    return {}
+
+
+def get_images_from_raw_pod(pod: dict) -> Dict[str, str]:
+    """
+    Like `get_images_from_pod`, for a pod listed as a plain dict.
+
+    >>> sha = "sha256:" + "a" * 64
+    >>> pod = dict(status=dict(containerStatuses=[dict(imageID=f"quay.io/org/app@{sha}")]))
+    >>> get_images_from_raw_pod(pod)[sha] == f"docker://quay.io/org/app@{sha}"
+    True
+    """
+    statuses = (pod.get("status") or {}).get("containerStatuses") or ()
+    return _images_from_ids(status.get("imageID") or "" for status in statuses)
+
+
+def _images_from_ids(image_ids: Iterable[str]) -> Dict[str, str]:
+    "The URI of the images with a sha256 among the imageIDs of containers, by sha."
+    image_shas = {}
+    for image_id in image_ids:
+        registry, image_name, sha256_value = _parse_container_image_uri(image_id)
+        if sha256_value and registry and image_name:
+            image_shas[sha256_value] = f"docker://{registry}{image_name}@{sha256_value}"
     return image_shas
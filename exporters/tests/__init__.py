@@ -39,7 +39,6 @@ class MockExporter:
     def run_app(self, arguments: Dict[str, str]) -> AbstractPelorusExporter:
         """Run set up of exporter app with desired environment variables."""
         try:
-            collector = None
             logging.getLogger().disabled = False
             for key, value in arguments.items():
                 os.environ[key] = value
@@ -48,10 +47,10 @@ class MockExporter:
                     self.mock_kube_client
                 )
                 collector = self.set_up(prod=False)
+                # register (and so collect) as the runtime does without a refresh interval
+                run_prometheus_register(collector)
             return collector
         finally:
             for key in arguments:
                 del os.environ[key]
-            if collector:
-                REGISTRY.unregister(collector)
             logging.getLogger().disabled = True
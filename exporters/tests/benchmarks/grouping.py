@@ -0,0 +1,105 @@
+"""
+Benchmark of the grouping of builds by app label and build strategy.
+
+Compares the single-pass `group_by_app` and `split_by_strategy` of the committime
+collectors with the jsonpath expression and per-app filtering they replaced.
+
+Run from the exporters directory:
+
+    python -m tests.benchmarks.grouping [--apps N] [--repeat N] [SIZE ...]
+"""
+import argparse
+import time
+from typing import Callable
+
+from jsonpath_ng import parse
+from kubernetes.dynamic.resource import ResourceInstance
+
+import pelorus
+from committime.collector_base import group_by_app, split_by_strategy
+
+APP_LABEL = pelorus.DEFAULT_APP_LABEL
+STRATEGIES = ["Source", "Docker", "Binary", "JenkinsPipeline", "Custom"]
+
+
+def build_list(size: int, apps: int) -> ResourceInstance:
+    return ResourceInstance(
+        None,
+        dict(
+            kind="BuildList",
+            apiVersion="build.openshift.io/v1",
+            metadata=dict(resourceVersion="1"),
+            items=[
+                dict(
+                    metadata=dict(
+                        name=f"build-{i}", labels={APP_LABEL: f"app-{i % apps}"}
+                    ),
+                    spec=dict(strategy=dict(type=STRATEGIES[i % len(STRATEGIES)])),
+                )
+                for i in range(size)
+            ],
+        ),
+    )
+
+
+def legacy(builds: ResourceInstance) -> dict:
+    "The jsonpath and filter grouping used before."
+    jsonpath_expr = parse(f"$['items'][*]['metadata']['labels']['{APP_LABEL}']")
+    apps = {match.value for match in jsonpath_expr.find(builds)}
+    grouped = {}
+    for app in apps:
+        app_builds = list(
+            filter(lambda b: b.metadata.labels[APP_LABEL] == app, builds.items)
+        )
+        jenkins_builds = list(
+            filter(lambda b: b.spec.strategy.type == "JenkinsPipeline", app_builds)
+        )
+        code_builds = list(
+            filter(
+                lambda b: b.spec.strategy.type in ["Source", "Binary", "Docker"],
+                app_builds,
+            )
+        )
+        grouped[app] = (jenkins_builds, code_builds)
+    return grouped
+
+
+def single_pass(builds: ResourceInstance) -> dict:
+    return {
+        app: split_by_strategy(app_builds)
+        for app, app_builds in group_by_app(builds.items, APP_LABEL).items()
+    }
+
+
+def best_time(function: Callable[[ResourceInstance], dict], builds, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(builds)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[10_000, 100_000])
+    parser.add_argument("--apps", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'builds':>8} {'apps':>6} {'legacy':>10} {'single pass':>12} {'speedup':>8}"
+    )
+    for size in args.sizes:
+        builds = build_list(size, args.apps)
+        legacy_time, legacy_result = best_time(legacy, builds, args.repeat)
+        new_time, new_result = best_time(single_pass, builds, args.repeat)
+        assert legacy_result == new_result, "the groupings differ"
+        print(
+            f"{size:>8} {args.apps:>6} {legacy_time:>9.3f}s {new_time:>11.3f}s"
+            f" {legacy_time / new_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
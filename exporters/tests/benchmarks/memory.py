@@ -0,0 +1,119 @@
+"""
+Benchmark of the memory used by the records the exporters collect.
+
+Compares the records with the dict-backed classes and the full copies of
+labels and annotations they replaced, measured with tracemalloc.
+
+Run from the exporters directory:
+
+    python -m tests.benchmarks.memory [COUNT]
+"""
+import argparse
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable
+
+from committime import CommitMetric, pick_annotations
+from deploytime import DeployTimeMetric
+from failure.collector_base import FailureMetric, TrackerIssue
+
+# Annotations and labels of a typical Build or Pod created by a BuildConfig
+ANNOTATIONS = {
+    "openshift.io/build-config.name": "app",
+    "openshift.io/build.number": "12",
+    "openshift.io/build.pod-name": "app-12-build",
+    "io.openshift.build.commit.id": "8d4d2bd1fb8a40c2a6e5b6b4e8e0cf9f6c1f9a2e",
+    "io.openshift.build.source-location": "https://github.com/org/app.git",
+    "kubectl.kubernetes.io/last-applied-configuration": "{" + "x" * 400 + "}",
+}
+LABELS = {
+    "app.kubernetes.io/name": "app",
+    "app.kubernetes.io/part-of": "shop",
+    "buildconfig": "app",
+    "openshift.io/build-config.name": "app",
+    "openshift.io/build.start-policy": "Serial",
+    "pod-template-hash": "5d8f7c9b4",
+}
+NOW = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+class LegacyTrackerIssue:
+    def __init__(self, issue_number, creationdate, resolutiondate, app):
+        self.creationdate = creationdate
+        self.resolutiondate = resolutiondate
+        self.issue_number = issue_number
+        self.app = app
+
+
+class LegacyFailureMetric:
+    def __init__(self, time_stamp, is_resolution=False, labels=[]):
+        self.time_stamp = time_stamp
+        self.is_resolution = is_resolution
+        self.labels = labels
+
+
+def legacy_commit_metric(i: int):
+    metric = CommitMetric("app", namespace="ns", commit_hash=f"{i:040x}")
+    metric.annotations = dict(ANNOTATIONS)
+    metric.labels = dict(LABELS)
+    return metric
+
+
+def commit_metric(i: int):
+    metric = CommitMetric("app", namespace="ns", commit_hash=f"{i:040x}")
+    metric.annotations = pick_annotations(
+        ANNOTATIONS,
+        ("io.openshift.build.commit.id", "io.openshift.build.source-location"),
+    )
+    return metric
+
+
+def legacy_deploy_time_metric(i: int):
+    # the record held the pod's labels, measured on top of the current one
+    return (DeployTimeMetric("app", "ns", NOW, f"sha256:{i:064x}"), dict(LABELS))
+
+
+def deploy_time_metric(i: int):
+    return DeployTimeMetric("app", "ns", NOW, f"sha256:{i:064x}")
+
+
+RECORDS: dict[str, tuple[Callable[[int], object], Callable[[int], object]]] = {
+    "CommitMetric": (legacy_commit_metric, commit_metric),
+    "DeployTimeMetric": (legacy_deploy_time_metric, deploy_time_metric),
+    "TrackerIssue": (
+        lambda i: LegacyTrackerIssue(str(i), 1.0, 2.0, "app"),
+        lambda i: TrackerIssue(str(i), 1.0, 2.0, "app"),
+    ),
+    "FailureMetric": (
+        lambda i: LegacyFailureMetric(1.0, True, labels=["app", str(i)]),
+        lambda i: FailureMetric(1.0, True, labels=("app", str(i))),
+    ),
+}
+
+
+def bytes_per_record(make: Callable[[int], object], count: int) -> float:
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        records = [make(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del records
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("count", nargs="?", type=int, default=50_000)
+    args = parser.parse_args()
+
+    print(f"{'record':<18} {'before':>10} {'after':>10} {'saved':>8}")
+    for name, (legacy, current) in RECORDS.items():
+        before = bytes_per_record(legacy, args.count)
+        after = bytes_per_record(current, args.count)
+        print(f"{name:<18} {before:>9.0f}B {after:>9.0f}B {1 - after / before:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark of listing ReplicaSets as full objects or as metadata only.
+
+Compares the size and deserialization time of a ReplicaSetList with the
+PartialObjectMetadataList returned for the same objects when they are listed
+with `provider_common.openshift.list_metadata`.
+
+Run from the exporters directory:
+
+    python -m tests.benchmarks.metadata [--repeat N] [SIZE ...]
+"""
+import argparse
+import json
+import time
+
+from kubernetes.dynamic.resource import ResourceInstance
+
+
+def metadata(i: int) -> dict:
+    return dict(
+        name=f"app-{i}-5d8f7c9b4",
+        namespace="shop",
+        uid=f"{i:08x}-0000-4000-8000-000000000000",
+        resourceVersion=str(1000 + i),
+        generation=3,
+        creationTimestamp="2023-05-16T18:07:52Z",
+        labels={"app.kubernetes.io/name": f"app-{i}", "pod-template-hash": "5d8f7c9b4"},
+        annotations={
+            "deployment.kubernetes.io/desired-replicas": "2",
+            "deployment.kubernetes.io/max-replicas": "3",
+            "deployment.kubernetes.io/revision": "7",
+        },
+        ownerReferences=[
+            dict(
+                apiVersion="apps/v1",
+                kind="Deployment",
+                name=f"app-{i}",
+                uid=f"{i:08x}-1111-4000-8000-000000000000",
+                controller=True,
+                blockOwnerDeletion=True,
+            )
+        ],
+    )
+
+
+CONTAINER = dict(
+    name="app",
+    image="image-registry.openshift-image-registry.svc:5000/shop/app@sha256:"
+    + "a" * 64,
+    ports=[dict(containerPort=8080, protocol="TCP")],
+    env=[dict(name=f"SETTING_{n}", value=f"value-{n}") for n in range(15)],
+    resources=dict(
+        limits=dict(cpu="500m", memory="512Mi"),
+        requests=dict(cpu="100m", memory="256Mi"),
+    ),
+    readinessProbe=dict(
+        httpGet=dict(path="/health/ready", port=8080, scheme="HTTP"),
+        periodSeconds=10,
+        timeoutSeconds=1,
+    ),
+    livenessProbe=dict(
+        httpGet=dict(path="/health/live", port=8080, scheme="HTTP"),
+        periodSeconds=10,
+        timeoutSeconds=1,
+    ),
+    volumeMounts=[dict(name="config", mountPath="/etc/app")],
+    terminationMessagePath="/dev/termination-log",
+    imagePullPolicy="IfNotPresent",
+)
+
+
+def replica_set(i: int) -> dict:
+    return dict(
+        kind="ReplicaSet",
+        apiVersion="apps/v1",
+        metadata=metadata(i),
+        spec=dict(
+            replicas=2,
+            selector=dict(matchLabels={"app.kubernetes.io/name": f"app-{i}"}),
+            template=dict(
+                metadata=dict(labels={"app.kubernetes.io/name": f"app-{i}"}),
+                spec=dict(
+                    containers=[CONTAINER, dict(CONTAINER, name="sidecar")],
+                    volumes=[dict(name="config", configMap=dict(name="app-config"))],
+                    restartPolicy="Always",
+                    dnsPolicy="ClusterFirst",
+                    securityContext={},
+                ),
+            ),
+        ),
+        status=dict(
+            replicas=2,
+            fullyLabeledReplicas=2,
+            readyReplicas=2,
+            availableReplicas=2,
+            observedGeneration=3,
+        ),
+    )
+
+
+def full_list(size: int) -> bytes:
+    return json.dumps(
+        dict(
+            kind="ReplicaSetList",
+            apiVersion="apps/v1",
+            metadata=dict(resourceVersion="1"),
+            items=[replica_set(i) for i in range(size)],
+        )
+    ).encode()
+
+
+def metadata_list(size: int) -> bytes:
+    return json.dumps(
+        dict(
+            kind="PartialObjectMetadataList",
+            apiVersion="meta.k8s.io/v1",
+            metadata=dict(resourceVersion="1"),
+            items=[
+                dict(
+                    kind="PartialObjectMetadata",
+                    apiVersion="meta.k8s.io/v1",
+                    metadata=metadata(i),
+                )
+                for i in range(size)
+            ],
+        )
+    ).encode()
+
+
+def best_deserialization_time(payload: bytes, repeat: int) -> float:
+    "Time to deserialize the response like the DynamicClient does."
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ResourceInstance(None, json.loads(payload.decode("utf8")))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'objects':>8} {'full':>10} {'metadata':>10}"
+        f" {'full time':>10} {'meta time':>10} {'speedup':>8}"
+    )
+    for size in args.sizes:
+        full, metadata = full_list(size), metadata_list(size)
+        full_time = best_deserialization_time(full, args.repeat)
+        metadata_time = best_deserialization_time(metadata, args.repeat)
+        print(
+            f"{size:>8} {len(full) / 1024:>8.0f}KB {len(metadata) / 1024:>8.0f}KB"
+            f" {full_time:>9.3f}s {metadata_time:>9.3f}s"
+            f" {full_time / metadata_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
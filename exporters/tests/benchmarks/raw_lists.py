@@ -0,0 +1,184 @@
+"""
+Benchmark of reading pod and build lists as ResourceFields or as plain dicts.
+
+Times what a collection does with a list response: deserializing it like the
+DynamicClient does, then getting the pods by owner and their images, or the
+CommitMetric of every build. The raw path decodes the response with
+`provider_common.openshift.list_raw`'s decoder, and reads it with the
+dict-native helpers. The raw path with the json module is shown as well,
+to tell the share of orjson, when it is installed.
+
+Run from the exporters directory:
+
+    python -m tests.benchmarks.raw_lists [--repeat N] [SIZE ...]
+"""
+import argparse
+import json
+import time
+from typing import Callable
+
+from kubernetes.dynamic.resource import ResourceInstance
+
+from committime import commit_metric_from_build, commit_metric_from_raw_build
+from provider_common import openshift
+from provider_common.openshift import (
+    filter_pods_by_replica_uid,
+    filter_raw_pods_by_replica_uid,
+    get_images_from_pod,
+    get_images_from_raw_pod,
+)
+
+SHA = "sha256:" + "a" * 64
+
+CONTAINER = dict(
+    name="app",
+    image=f"image-registry.openshift-image-registry.svc:5000/shop/app@{SHA}",
+    ports=[dict(containerPort=8080, protocol="TCP")],
+    env=[dict(name=f"SETTING_{n}", value=f"value-{n}") for n in range(15)],
+    resources=dict(
+        limits=dict(cpu="500m", memory="512Mi"),
+        requests=dict(cpu="100m", memory="256Mi"),
+    ),
+    volumeMounts=[dict(name="config", mountPath="/etc/app")],
+    imagePullPolicy="IfNotPresent",
+)
+
+
+def pod(i: int) -> dict:
+    # two replicas per ReplicaSet
+    owner = i // 2
+    return dict(
+        kind="Pod",
+        apiVersion="v1",
+        metadata=dict(
+            name=f"app-{owner}-5d8f7c9b4-{i}",
+            namespace=f"ns-{owner % 50}",
+            uid=f"{i:08x}-0000-4000-8000-000000000000",
+            labels={"app.kubernetes.io/name": f"app-{owner}"},
+            ownerReferences=[
+                dict(
+                    apiVersion="apps/v1",
+                    kind="ReplicaSet",
+                    name=f"app-{owner}-5d8f7c9b4",
+                    uid=f"{owner:08x}-1111-4000-8000-000000000000",
+                    controller=True,
+                )
+            ],
+        ),
+        spec=dict(containers=[CONTAINER, dict(CONTAINER, name="sidecar")]),
+        status=dict(
+            phase="Running",
+            podIP="10.128.0.1",
+            conditions=[
+                dict(type=t, status="True", lastTransitionTime="2023-05-16T18:07:52Z")
+                for t in ("Initialized", "Ready", "ContainersReady", "PodScheduled")
+            ],
+            containerStatuses=[
+                dict(
+                    name=name,
+                    ready=True,
+                    restartCount=0,
+                    image=CONTAINER["image"],
+                    imageID=CONTAINER["image"],
+                    state=dict(running=dict(startedAt="2023-05-16T18:07:52Z")),
+                )
+                for name in ("app", "sidecar")
+            ],
+        ),
+    )
+
+
+def build(i: int) -> dict:
+    return dict(
+        kind="Build",
+        apiVersion="build.openshift.io/v1",
+        metadata=dict(
+            name=f"app-{i}",
+            namespace=f"ns-{i % 50}",
+            labels={"app.kubernetes.io/name": "app", "buildconfig": "app"},
+            annotations={"openshift.io/build.number": str(i)},
+        ),
+        spec=dict(
+            source=dict(git=dict(uri="https://github.com/org/app.git")),
+            revision=dict(git=dict(commit=f"{i:040x}", author=dict(name="dev"))),
+            strategy=dict(type="Source"),
+        ),
+        status=dict(
+            phase="Complete",
+            outputDockerImageReference="image-registry/ns/app:latest",
+            output=dict(to=dict(imageDigest=SHA)),
+        ),
+    )
+
+
+def list_of(kind: str, items: list) -> bytes:
+    return json.dumps(dict(kind=f"{kind}List", apiVersion="v1", items=items)).encode()
+
+
+def read_pods(payload: bytes):
+    pods = ResourceInstance(None, json.loads(payload.decode("utf8"))).items
+    for owner_pod in filter_pods_by_replica_uid(pods).values():
+        get_images_from_pod(owner_pod)
+
+
+def raw_pods_reader(loads: Callable) -> Callable[[bytes], None]:
+    def read_raw_pods(payload: bytes):
+        pods = loads(payload)["items"]
+        for owner_pod in filter_raw_pods_by_replica_uid(pods).values():
+            get_images_from_raw_pod(owner_pod)
+
+    return read_raw_pods
+
+
+def read_builds(payload: bytes):
+    for item in ResourceInstance(None, json.loads(payload.decode("utf8"))).items:
+        commit_metric_from_build("app", item, [])
+
+
+def raw_builds_reader(loads: Callable) -> Callable[[bytes], None]:
+    def read_raw_builds(payload: bytes):
+        for item in loads(payload)["items"]:
+            commit_metric_from_raw_build("app", item, [])
+
+    return read_raw_builds
+
+
+def best_time(read: Callable[[bytes], None], payload: bytes, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read(payload)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[1_000, 20_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    decoder = openshift._loads.__module__
+    print(f"raw lists are decoded by {decoder}")
+    print(
+        f"{'list':>6} {'objects':>8} {'fields':>9} {'raw json':>9}"
+        f" {'raw':>9} {'speedup':>8}"
+    )
+    cases = [
+        ("pods", pod, read_pods, raw_pods_reader),
+        ("builds", build, read_builds, raw_builds_reader),
+    ]
+    for size in args.sizes:
+        for name, make, read, raw_reader in cases:
+            payload = list_of(name, [make(i) for i in range(size)])
+            fields = best_time(read, payload, args.repeat)
+            raw_json = best_time(raw_reader(json.loads), payload, args.repeat)
+            raw = best_time(raw_reader(openshift._loads), payload, args.repeat)
+            print(
+                f"{name:>6} {size:>8} {fields:>8.3f}s {raw_json:>8.3f}s"
+                f" {raw:>8.3f}s {fields / raw:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    "Record the delays of `time.sleep` instead of sleeping."
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    return sleeps
@@ -0,0 +1,159 @@
+"""
+A local stand-in of a container registry, serving the OCI distribution API over HTTP.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from urllib.parse import urlparse
+
+from committime.registry import DOCKER_MANIFEST_LIST, OCI_MANIFEST
+from tests.local_server import LocalServer, QuietHandler
+
+TOKEN = "s3cr3t"
+
+
+def digest_of(content: bytes) -> str:
+    return "sha256:" + hashlib.sha256(content).hexdigest()
+
+
+class FakeRegistry(LocalServer):
+    """
+    Serves the manifests and blobs added to it. With `auth`, requests need a
+    bearer token, given by its /token endpoint.
+    """
+
+    def __init__(self, auth: bool = False, delay: float = 0.0):
+        self.auth = auth
+        self.delay = delay
+        "Seconds every response is delayed by"
+        # (repository, reference) -> (media type, content)
+        self.manifests: dict[tuple[str, str], tuple[str, bytes]] = {}
+        # (repository, digest) -> content
+        self.blobs: dict[tuple[str, str], bytes] = {}
+        self.requests: Counter = Counter()
+        self.connections: set = set()
+        self.active = 0
+        self.max_active = 0
+        "Maximum number of requests handled at once"
+        self._active_lock = threading.Lock()
+        super().__init__(self._handler())
+
+    @property
+    def host(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def uri(self, repository: str, reference: str) -> str:
+        separator = "@" if reference.startswith("sha256:") else ":"
+        return f"docker://{self.host}/{repository}{separator}{reference}"
+
+    def add_blob(self, repository: str, content: bytes) -> str:
+        digest = digest_of(content)
+        self.blobs[(repository, digest)] = content
+        return digest
+
+    def add_manifest(
+        self, repository: str, manifest: dict, tag: Optional[str] = None
+    ) -> str:
+        content = json.dumps(manifest).encode()
+        digest = digest_of(content)
+        for reference in filter(None, (digest, tag)):
+            self.manifests[(repository, reference)] = (manifest["mediaType"], content)
+        return digest
+
+    def add_image(
+        self,
+        repository: str,
+        labels: Optional[dict] = None,
+        config: Optional[bytes] = None,
+        tag: Optional[str] = None,
+    ) -> str:
+        "Add an image with the given labels, or raw config. Returns its digest."
+        if config is None:
+            config = json.dumps(dict(config=dict(Labels=labels))).encode()
+        config_digest = self.add_blob(repository, config)
+        manifest = dict(
+            schemaVersion=2,
+            mediaType=OCI_MANIFEST,
+            config=dict(digest=config_digest, size=len(config)),
+            layers=[],
+        )
+        return self.add_manifest(repository, manifest, tag)
+
+    def add_index(self, repository: str, platforms: dict[str, str]) -> str:
+        "Add a manifest list of the image digests by architecture."
+        index = dict(
+            schemaVersion=2,
+            mediaType=DOCKER_MANIFEST_LIST,
+            manifests=[
+                dict(digest=digest, platform=dict(os="linux", architecture=arch))
+                for arch, digest in platforms.items()
+            ],
+        )
+        return self.add_manifest(repository, index)
+
+    def _respond(
+        self, path: str, authorization: Optional[str]
+    ) -> tuple[int, bytes, dict]:
+        "The status, content and headers of the response to a GET of `path`."
+        if path == "/token":
+            return self._token()
+        if self.auth and authorization != f"Bearer {TOKEN}":
+            challenge = f'Bearer realm="http://{self.host}/token",service="{self.host}"'
+            return 401, b"", {"WWW-Authenticate": challenge}
+
+        parts = path.split("/")
+        if len(parts) >= 5 and parts[1] == "v2":
+            repository, kind, reference = "/".join(parts[2:-2]), parts[-2], parts[-1]
+            if kind == "manifests":
+                return self._manifest(repository, reference)
+            if kind == "blobs":
+                return self._blob(repository, reference)
+        return 404, b"", {}
+
+    def _token(self) -> tuple[int, bytes, dict]:
+        return 200, json.dumps(dict(token=TOKEN)).encode(), {}
+
+    def _manifest(self, repository: str, reference: str) -> tuple[int, bytes, dict]:
+        if (repository, reference) not in self.manifests:
+            return 404, b"", {}
+        media_type, content = self.manifests[(repository, reference)]
+        return 200, content, {"Content-Type": media_type}
+
+    def _blob(self, repository: str, digest: str) -> tuple[int, bytes, dict]:
+        if (repository, digest) not in self.blobs:
+            return 404, b"", {}
+        return 200, self.blobs[(repository, digest)], {}
+
+    def _handler(self):
+        registry = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                with registry._active_lock:
+                    registry.active += 1
+                    registry.max_active = max(registry.max_active, registry.active)
+                try:
+                    time.sleep(registry.delay)
+                    self._get()
+                finally:
+                    with registry._active_lock:
+                        registry.active -= 1
+
+            def _get(self):
+                registry.connections.add(self.client_address)
+                path = urlparse(self.path).path
+                registry.requests[path] += 1
+                self._send(*registry._respond(path, self.headers.get("Authorization")))
+
+            def _send(self, status: int, content: bytes, headers: dict = {}):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
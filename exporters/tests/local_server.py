@@ -0,0 +1,55 @@
+"""
+A local HTTP server for the tests of HTTP clients, answering with a given handler.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, TypeVar
+
+import pytest
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    "Request handler keeping connections alive, without logging every request."
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer:
+    "Serves requests with `handler` from a thread, while used as a context manager."
+
+    def __init__(self, handler: type[BaseHTTPRequestHandler]):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_port
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+S = TypeVar("S", bound=LocalServer)
+
+
+def server_fixture(make_server: Callable[[], S]):
+    "A fixture giving each test a new running server, made by `make_server`."
+
+    @pytest.fixture
+    def fixture() -> Iterator[S]:
+        with make_server() as server:
+            yield server
+
+    return fixture
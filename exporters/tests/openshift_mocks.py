@@ -1,6 +1,8 @@
+import json
 from typing import Any, Generic, Optional, TypeVar
 
 import attr
+from kubernetes.dynamic.resource import ResourceInstance
 
 
 @attr.define
@@ -75,3 +77,45 @@ class ResourceGetResponse(Generic[Item]):
     def of(cls, *items: Item):
         """Puts all arguments into the items list"""
         return cls(list(items))
+
+
+@attr.define
+class RawGetResponse:
+    "The response of a list made with `serialize=False`, as used by `list_raw`."
+    data: bytes
+
+    @classmethod
+    def of(cls, items: list):
+        """Serializes the items, which may be attrs mocks, to JSON"""
+        items = [attr.asdict(item) if attr.has(type(item)) else item for item in items]
+        return cls(json.dumps(dict(items=items)).encode())
+
+
+class PagingClient:
+    "Serves `items` in pages, like the API server does with limit and continue."
+
+    def __init__(self, items: list[dict]):
+        self.items = items
+        # (query, continue token) of each request
+        self.calls = []
+
+    def get(self, resource, limit, _continue=None, **query):
+        self.calls.append((query, _continue))
+        start = int(_continue or 0)
+        end = start + limit
+        return ResourceInstance(
+            None,
+            dict(
+                kind="List",
+                apiVersion="v1",
+                metadata={"continue": str(end) if end < len(self.items) else None},
+                items=self.items[start:end],
+            ),
+        )
+
+
+class PagedResource:
+    "A resource whose items are listed in pages."
+
+    def __init__(self, items: list):
+        self.client = PagingClient(items)
@@ -0,0 +1,303 @@
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from unittest.mock import NonCallableMock
+
+import pytest
+from attrs import define, field
+from kubernetes.dynamic.resource import ResourceInstance
+
+import pelorus
+from committime import CommitMetric
+from committime.collector_base import (
+    AbstractCommitCollector,
+    group_by_app,
+    split_by_strategy,
+)
+from provider_common.github import RateLimitDeferred
+
+APP_LABEL = pelorus.DEFAULT_APP_LABEL
+NAMESPACE = "foo_ns"
+REPO = "https://github.com/org/repo.git"
+
+
+def build(
+    name: str,
+    commit: str,
+    repo: Optional[str] = REPO,
+    build_config: str = "foo",
+    app: Optional[str] = "foo",
+    strategy: str = "Source",
+    created: Optional[str] = None,
+):
+    spec = dict(
+        strategy=dict(type=strategy),
+        revision=dict(git=dict(commit=commit, author=dict(name="dev"))),
+    )
+    if repo:
+        spec["source"] = dict(git=dict(uri=repo))
+    return ResourceInstance(
+        None,
+        dict(
+            kind="Build",
+            apiVersion="build.openshift.io/v1",
+            metadata=dict(
+                name=name,
+                namespace=NAMESPACE,
+                labels={"buildconfig": build_config, APP_LABEL: app},
+                annotations={},
+                creationTimestamp=created,
+            ),
+            spec=spec,
+            status=dict(
+                phase="Complete",
+                outputDockerImageReference="registry/foo:latest",
+                output=dict(to=dict(imageDigest=f"sha256:{name}")),
+                config=dict(namespace=NAMESPACE, name=build_config),
+            ),
+        ),
+    )
+
+
+def build_configs(*configs: tuple[str, str, str]) -> ResourceInstance:
+    "A BuildConfigList of (name, resourceVersion, repo) tuples"
+    return ResourceInstance(
+        None,
+        dict(
+            kind="BuildConfigList",
+            apiVersion="build.openshift.io/v1",
+            metadata=dict(resourceVersion="1"),
+            items=[
+                dict(
+                    metadata=dict(
+                        name=name, namespace=NAMESPACE, resourceVersion=version
+                    ),
+                    spec=dict(source=dict(git=dict(uri=repo))),
+                )
+                for name, version, repo in configs
+            ],
+        ),
+    )
+
+
+@define(kw_only=True)
+class SlowCommitCollector(AbstractCommitCollector):
+    "Looks commits up slowly, recording how many lookups run at once."
+
+    delay: float = 0.05
+    failing: set[str] = field(factory=set)
+    deferred: set[str] = field(factory=set)
+
+    lookups: Counter = field(factory=Counter, init=False)
+    running: int = field(default=0, init=False)
+    max_running: int = field(default=0, init=False)
+    _count_lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+    def get_commit_time(self, metric: CommitMetric) -> Optional[CommitMetric]:
+        with self._count_lock:
+            self.lookups[metric.commit_hash] += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self._count_lock:
+            self.running -= 1
+        if metric.commit_hash in self.deferred:
+            raise RateLimitDeferred(time.time() + 60)
+        if metric.commit_hash not in self.failing:
+            metric.commit_time = "2023-01-01T00:00:00Z"
+            metric.commit_timestamp = float(int(metric.commit_hash[-2:], 16))
+        return metric
+
+
+def collector(**kwargs) -> SlowCommitCollector:
+    return SlowCommitCollector(
+        kube_client=NonCallableMock(), username="", token="", **kwargs
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 8])
+def test_metrics_keep_build_order(workers: int):
+    builds = [build(f"b{i}", commit=f"{i:02x}") for i in range(12)]
+    c = collector(commit_lookup_workers=workers)
+
+    metrics = c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert [m.build_name for m in metrics] == [b.metadata.name for b in builds]
+    assert [m.commit_timestamp for m in metrics] == [float(i) for i in range(12)]
+    assert [c.commit_store.get(REPO, f"{i:02x}") for i in range(12)] == [
+        float(i) for i in range(12)
+    ]
+
+
+def test_lookups_are_concurrent_but_bounded_per_host():
+    builds = [build(f"b{i}", commit=f"{i:02x}") for i in range(12)]
+    c = collector(commit_lookup_workers=8, commit_lookup_workers_per_host=3)
+
+    c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert 1 < c.max_running <= 3
+
+
+def test_shared_commit_is_looked_up_once():
+    builds = [build(f"b{i}", commit="0a") for i in range(6)]
+    c = collector(commit_lookup_workers=8)
+
+    metrics = c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert c.lookups == Counter({"0a": 1})
+    assert [m.commit_timestamp for m in metrics] == [10.0] * 6
+
+
+def test_failed_lookup_is_not_cached():
+    builds = [build("b0", commit="0a"), build("b1", commit="0b")]
+    c = collector(commit_lookup_workers=8, failing={"0b"})
+
+    metrics = c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert [m.build_name for m in metrics] == ["b0"]
+    assert c.commit_store.get(REPO, "0a") == 10.0
+    assert c.commit_store.get(REPO, "0b") is None
+
+
+def test_failed_lookup_backs_off():
+    builds = [build("b0", commit="0a"), build("b1", commit="0b")]
+    c = collector(commit_lookup_workers=8, failing={"0b"})
+
+    for _ in range(3):
+        c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert c.lookups == Counter({"0a": 1, "0b": 1})
+    assert c.lookup_failures.failures_total == 1
+    assert c.lookup_failures.skipped_total == 2
+
+    samples = {
+        sample.name: sample.value
+        for family in c._lookup_failure_metrics()
+        for sample in family.samples
+    }
+    assert samples["pelorus_commit_lookup_failures_total"] == 1
+    assert samples["pelorus_commit_lookups_skipped_total"] == 2
+    assert samples["pelorus_commit_lookups_backing_off"] == 1
+
+
+def test_newest_builds_are_looked_up_first():
+    builds = [
+        build(f"b{i}", commit=f"{i:02x}", created=f"2023-05-0{day}T10:00:00Z")
+        for i, day in enumerate([3, 1, 4, 2])
+    ]
+    c = collector(commit_lookup_workers=1)
+
+    metrics = c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert list(c.lookups) == ["02", "00", "03", "01"]
+    assert [m.build_name for m in metrics] == ["b0", "b1", "b2", "b3"]
+
+
+def test_deferred_lookup_is_retried_without_backing_off():
+    builds = [build("b0", commit="0a"), build("b1", commit="0b")]
+    c = collector(commit_lookup_workers=8, deferred={"0b"})
+
+    metrics = c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+    assert [m.build_name for m in metrics] == ["b0"]
+
+    c.deferred.clear()
+    metrics = c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert [m.build_name for m in metrics] == ["b0", "b1"]
+    assert c.lookups == Counter({"0a": 1, "0b": 2})
+    assert c.lookup_failures.failures_total == 0
+
+
+def test_build_configs_are_listed_once_per_namespace():
+    builds = [
+        build(f"b{i}", commit=f"{i:02x}", repo=None, build_config=f"bc{i % 2}")
+        for i in range(6)
+    ]
+    c = collector(commit_lookup_workers=8)
+    v1_build_configs = c.kube_client.resources.get.return_value
+    v1_build_configs.get.return_value = build_configs(
+        ("bc0", "1", "https://github.com/org/zero"),
+        ("bc1", "1", "https://github.com/org/one.git"),
+    )
+
+    metrics = c.get_metrics_from_apps({"foo": builds}, NAMESPACE)
+
+    assert v1_build_configs.get.call_count == 1
+    assert v1_build_configs.get.call_args.kwargs == dict(namespace=NAMESPACE)
+    assert [m.repo_url for m in metrics] == [
+        "https://github.com/org/zero.git",
+        "https://github.com/org/one.git",
+    ] * 3
+
+
+def test_build_config_changes_are_picked_up():
+    c = collector()
+    v1_build_configs = c.kube_client.resources.get.return_value
+    v1_build_configs.get.return_value = build_configs(
+        ("bc", "1", "https://github.com/org/old.git")
+    )
+    assert c._get_repo_from_build_config(build("b0", "0a", None, "bc")) == (
+        "https://github.com/org/old.git"
+    )
+
+    # a new collection lists again, and sees the new resourceVersion
+    c._build_config_namespaces.clear()
+    v1_build_configs.get.return_value = build_configs(
+        ("bc", "2", "https://github.com/org/new.git")
+    )
+    assert c._get_repo_from_build_config(build("b0", "0a", None, "bc")) == (
+        "https://github.com/org/new.git"
+    )
+
+    c._build_config_namespaces.clear()
+    v1_build_configs.get.return_value = build_configs()
+    assert c._get_repo_from_build_config(build("b0", "0a", None, "bc")) is None
+
+
+def test_slow_build_config_list_does_not_hold_up_other_namespaces():
+    c = collector()
+    listing, release = threading.Event(), threading.Event()
+
+    def list_build_configs(namespace):
+        if namespace == "slow_ns":
+            listing.set()
+            release.wait(5)
+        return build_configs(("bc", "1", f"https://github.com/org/{namespace}.git"))
+
+    c.kube_client.resources.get.return_value.get.side_effect = list_build_configs
+    slow = build("b0", "0a", None, "bc")
+    slow.status.config.namespace = "slow_ns"
+    slow_lookup = threading.Thread(target=c._get_repo_from_build_config, args=[slow])
+    slow_lookup.start()
+    try:
+        assert listing.wait(5)
+        started = time.monotonic()
+        assert c._get_repo_from_build_config(build("b1", "0b", None, "bc")) == (
+            f"https://github.com/org/{NAMESPACE}.git"
+        )
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        slow_lookup.join(5)
+
+
+def test_builds_are_grouped_by_app_and_strategy():
+    builds = [
+        build("b0", "00", app="foo"),
+        build("b1", "01", app="bar", strategy="JenkinsPipeline"),
+        build("b2", "02", app=None),
+        build("b3", "03", app="foo", strategy="Custom"),
+        build("b4", "04", app="foo", strategy="Docker"),
+        build("b5", "05", app="foo", strategy="JenkinsPipeline"),
+    ]
+
+    by_app = group_by_app(builds, APP_LABEL)
+
+    assert {app: [b.metadata.name for b in bs] for app, bs in by_app.items()} == {
+        "foo": ["b0", "b3", "b4", "b5"],
+        "bar": ["b1"],
+    }
+    jenkins_builds, code_builds = split_by_strategy(by_app["foo"])
+    assert [b.metadata.name for b in jenkins_builds] == ["b5"]
+    assert [b.metadata.name for b in code_builds] == ["b0", "b4"]
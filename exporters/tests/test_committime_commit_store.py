@@ -0,0 +1,94 @@
+import pytest
+
+from committime.commit_store import (
+    CommitLookupFailures,
+    MemoryCommitTimeStore,
+    SQLiteCommitTimeStore,
+    make_commit_time_store,
+)
+
+REPO = "https://github.com/org/repo.git"
+OTHER_REPO = "https://github.com/org/other.git"
+
+
+def test_entries_are_keyed_by_repo_and_hash():
+    store = MemoryCommitTimeStore()
+    store.put(REPO, "abc", 1.0)
+
+    assert store.get(REPO, "abc") == 1.0
+    assert store.get(OTHER_REPO, "abc") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    store = MemoryCommitTimeStore(max_entries=2)
+    store.put(REPO, "a", 1.0)
+    store.put(REPO, "b", 2.0)
+    store.get(REPO, "a")
+
+    store.put(REPO, "c", 3.0)
+
+    assert len(store) == 2
+    assert store.get(REPO, "b") is None
+    assert store.get(REPO, "a") == 1.0
+    assert store.get(REPO, "c") == 3.0
+
+
+def test_sqlite_store_is_warmed_at_startup(tmp_path):
+    path = str(tmp_path / "commits.db")
+    store = SQLiteCommitTimeStore(path=path)
+    store.put(REPO, "a", 1.0)
+    store.put(OTHER_REPO, "b", 2.0)
+    store.close()
+
+    reopened = SQLiteCommitTimeStore(path=path)
+
+    assert len(reopened) == 2
+    assert reopened.get(REPO, "a") == 1.0
+    assert reopened.get(OTHER_REPO, "b") == 2.0
+
+
+def test_sqlite_store_keeps_most_recently_used(tmp_path):
+    path = str(tmp_path / "commits.db")
+    store = SQLiteCommitTimeStore(3, path=path)
+    for i, commit in enumerate("abc"):
+        store.put(REPO, commit, float(i))
+    store.get(REPO, "a")
+    store.put(REPO, "d", 3.0)
+    store.close()
+
+    reopened = SQLiteCommitTimeStore(3, path=path)
+
+    assert len(reopened) == 3
+    assert reopened.get(REPO, "b") is None
+    assert [reopened.get(REPO, commit) for commit in "acd"] == [0.0, 2.0, 3.0]
+
+
+@pytest.mark.parametrize(
+    "path, expected_type",
+    [(None, MemoryCommitTimeStore), ("db", SQLiteCommitTimeStore)],
+)
+def test_make_commit_time_store(tmp_path, path, expected_type):
+    store = make_commit_time_store(path and str(tmp_path / path))
+
+    assert type(store) is expected_type
+
+
+def test_failed_lookups_back_off_exponentially(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("committime.commit_store.time.time", lambda: now)
+    failures = CommitLookupFailures(backoff=10, max_backoff=100, max_retries=4)
+
+    assert failures.should_retry(REPO, "a")
+    for expected_delay in [10, 20, 40, 100, 100]:
+        failures.record_failure(REPO, "a")
+        now += expected_delay - 1
+        assert not failures.should_retry(REPO, "a")
+        now += 1
+        assert failures.should_retry(REPO, "a")
+
+    assert failures.failures_total == 5
+    assert failures.skipped_total == 5
+    assert failures.should_retry(OTHER_REPO, "a")
+
+    failures.record_success(REPO, "a")
+    assert len(failures) == 0
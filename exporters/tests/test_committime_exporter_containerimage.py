@@ -15,28 +15,35 @@
 #
 
 
-import subprocess
-import time
+import json
 from pathlib import Path
-from unittest.mock import Mock, patch
 
 import pytest
+from kubernetes.dynamic.resource import ResourceInstance
 
+from committime import collector_containerimage
 from committime.collector_containerimage import (
-    SkopeoDataException,
-    _cache_container_images_labels,
+    ContainerImageCommitCollector,
+    ImageLabelsException,
+    ImageLabelWorkers,
     get_labels_from_image,
-    image_label_cache,
-    skopeo_failures,
 )
+from committime.image_label_store import ImageCommit, MemoryImageLabelStore
+from committime.registry import ImageReference, RegistryClient
+from tests.fake_registry import FakeRegistry
+from tests.local_server import server_fixture
 
 TEST_DATA_DIR = Path(__file__).resolve().parent / "data"
 
 
+registry = server_fixture(lambda: FakeRegistry(auth=True))
+
+
 @pytest.fixture
-def mock_popen():
-    with patch("subprocess.Popen") as mock_popen:
-        yield mock_popen
+def client(monkeypatch) -> RegistryClient:
+    client = RegistryClient(ca_dir=None, scheme="http")
+    monkeypatch.setattr(collector_containerimage, "registry_client", client)
+    return client
 
 
 def read_skopeo_fake_data(skopeo_response_json_file):
@@ -44,11 +51,17 @@ def read_skopeo_fake_data(skopeo_response_json_file):
         return file.read()
 
 
+def add_image_from_fake_data(registry: FakeRegistry, json_file: str) -> str:
+    "Add an image with the labels of the skopeo output in the file"
+    labels = json.loads(read_skopeo_fake_data(json_file))["Labels"]
+    digest = registry.add_image("org/app", labels)
+    return registry.uri("org/app", digest)
+
+
 @pytest.mark.parametrize(
-    "returncode, json_file, expected_labels",
+    "json_file, expected_labels",
     [
         (
-            0,
             "skopeo_default_container_labels.json",
             {
                 "io.openshift.build.commit.date": "Tue May 16 20:07:52 2023 +0200",
@@ -56,7 +69,6 @@ def read_skopeo_fake_data(skopeo_response_json_file):
             },
         ),
         (
-            0,
             "skopeo_custom_container_labels.json",
             {
                 "custom.commit.date": "Tue May 16 20:07:52 2023 +0200",
@@ -65,102 +77,273 @@ def read_skopeo_fake_data(skopeo_response_json_file):
         ),
     ],
 )
-def test_get_labels_from_image(mock_popen, returncode, json_file, expected_labels):
-    mocked_process = Mock()
-    mocked_process.returncode = returncode
-    mocked_process.communicate.return_value = (read_skopeo_fake_data(json_file), b"")
-    mock_popen.return_value = mocked_process
+def test_get_labels_from_image(registry, client, json_file, expected_labels):
+    image_uri = add_image_from_fake_data(registry, json_file)
 
-    result = get_labels_from_image("sha256_value", "image_uri")
+    result = get_labels_from_image(image_uri)
 
     for key, value in expected_labels.items():
         assert key in result and result[key] == value
 
-    command = "skopeo inspect --cert-dir /var/run/secrets/kubernetes.io/serviceaccount/ image_uri"
-    subprocess.Popen.assert_called_once_with(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-    )
-    mocked_process.communicate.assert_called_once()
-
-    assert "sha256_value" not in skopeo_failures
-
 
 @pytest.mark.parametrize(
-    "returncode, json_file, missing_labels",
+    "json_file, missing_labels",
     [
         (
-            0,
             "skopeo_missing_container_labels.json",
             ["io.openshift.build.commit.date", "io.openshift.build.commit.id"],
         )
     ],
 )
-def test_missing_labels_from_image(mock_popen, returncode, json_file, missing_labels):
-    mocked_process = Mock()
-    mocked_process.returncode = returncode
-    mocked_process.communicate.return_value = (read_skopeo_fake_data(json_file), b"")
-    mock_popen.return_value = mocked_process
+def test_missing_labels_from_image(registry, client, json_file, missing_labels):
+    image_uri = add_image_from_fake_data(registry, json_file)
 
-    result = get_labels_from_image("sha256_value", "image_uri")
+    result = get_labels_from_image(image_uri)
 
     for missing_label in missing_labels:
         assert missing_label not in result
 
-    command = "skopeo inspect --cert-dir /var/run/secrets/kubernetes.io/serviceaccount/ image_uri"
-    subprocess.Popen.assert_called_once_with(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-    )
-    mocked_process.communicate.assert_called_once()
 
-    assert "sha256_value" not in skopeo_failures
+def test_malformed_json_response(registry, client):
+    config = read_skopeo_fake_data("skopeo_malformed_json_file.json")
+    image_uri = registry.uri("org/app", registry.add_image("org/app", config=config))
 
+    with pytest.raises(ImageLabelsException) as labels_exception:
+        get_labels_from_image(image_uri)
+    assert "Invalid JSON" in str(labels_exception.value)
 
-@pytest.mark.parametrize(
-    "returncode, json_file",
-    [
-        (
-            0,
-            "skopeo_malformed_json_file.json",
+
+def test_missing_image_is_a_failure(registry, client):
+    with pytest.raises(ImageLabelsException):
+        get_labels_from_image(registry.uri("org/app", "sha256:0"))
+
+
+def test_token_and_connection_are_reused(registry, client):
+    images = [registry.add_image("org/app", {"n": str(i)}) for i in range(3)]
+
+    for i, digest in enumerate(images):
+        assert client.get_labels(registry.uri("org/app", digest)) == {"n": str(i)}
+
+    assert registry.requests["/token"] == 1
+    assert len(registry.connections) == 1
+
+
+def test_image_index_resolves_to_platform(registry, client):
+    amd64 = registry.add_image("org/app", {"arch": "amd64"})
+    arm64 = registry.add_image("org/app", {"arch": "arm64"})
+    index = registry.add_index("org/app", {"arm64": arm64, "amd64": amd64})
+
+    assert client.get_labels(registry.uri("org/app", index)) == {"arch": "amd64"}
+
+
+def test_tagged_image(registry, client):
+    registry.add_image("app", {"tagged": "yes"}, tag="v1")
+
+    image = ImageReference.parse(registry.uri("app", "v1"))
+
+    assert image.repository == "app"
+    assert client.get_labels(registry.uri("app", "v1")) == {"tagged": "yes"}
+
+
+def test_image_is_queued_once(client):
+    with FakeRegistry(delay=0.1) as registry:
+        digest = registry.add_image(
+            "org/app",
+            {
+                "io.openshift.build.commit.id": "abc",
+                "io.openshift.build.commit.date": "1684260472",
+                "other": "label",
+            },
         )
-    ],
-)
-def test_malformed_json_response(mock_popen, returncode, json_file):
-    mocked_process = Mock()
-    mocked_process.returncode = returncode
-    mocked_process.communicate.return_value = (read_skopeo_fake_data(json_file), b"")
-    mock_popen.return_value = mocked_process
+        workers = ImageLabelWorkers(workers=4)
+
+        assert workers.submit(digest, registry.uri("org/app", digest))
+        assert not workers.submit(digest, registry.uri("org/app", digest))
+        workers.join()
+
+    # only the commit labels are stored
+    assert workers.store.get(digest) == ImageCommit("abc", "1684260472")
+    assert workers.lookups_total == {"success": 1}
+    assert registry.requests[f"/v2/org/app/manifests/{digest}"] == 1
+    # stored images aren't queued again
+    assert not workers.submit(digest, registry.uri("org/app", digest))
+
 
-    with pytest.raises(SkopeoDataException) as skopeo_exception:
-        get_labels_from_image("sha256_value", "image_uri")
-    assert "Error: Invalid JSON output" in str(skopeo_exception.value)
+def test_lookups_are_concurrent_but_bounded_per_registry(client):
+    with FakeRegistry(delay=0.05) as registry:
+        digests = [registry.add_image("org/app", {"n": str(i)}) for i in range(12)]
+        workers = ImageLabelWorkers(workers=8, workers_per_registry=3)
 
-    command = "skopeo inspect --cert-dir /var/run/secrets/kubernetes.io/serviceaccount/ image_uri"
-    subprocess.Popen.assert_called_once_with(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-    )
-    mocked_process.communicate.assert_called_once()
+        for digest in digests:
+            workers.submit(digest, registry.uri("org/app", digest))
+        workers.join()
 
-    assert "sha256_value" in skopeo_failures
+    assert 1 < registry.max_active <= 3
+    assert workers.lookups_total == {"success": 12}
+    assert workers.in_flight == 0
 
 
-def test_cache_container_images_labels():
-    sha_256 = "sha256_value"
-    labels = {"label1": "value1", "label2": "value2"}
+def test_slow_lookups_time_out(client):
+    with FakeRegistry(delay=0.3) as registry:
+        digest = registry.add_image("org/app", {"a": "b"})
+        workers = ImageLabelWorkers(timeout=0.1)
 
-    current_time = time.time()
+        workers.submit(digest, registry.uri("org/app", digest))
+        workers.join()
+
+    assert workers.lookups_total == {"failure": 1}
+    assert workers.store.has_failed(digest)
+    assert digest not in workers.store
+
+    samples = {
+        (
+            sample.name,
+            sample.labels.get("result", sample.labels.get("le")),
+        ): sample.value
+        for family in workers.metrics()
+        for sample in family.samples
+    }
+    assert samples[("pelorus_image_labels_queue_depth", None)] == 0
+    assert samples[("pelorus_image_label_lookups_total", "failure")] == 1
+    assert samples[("pelorus_image_label_lookup_seconds_count", None)] == 1
+    assert samples[("pelorus_image_label_lookup_seconds_bucket", "0.1")] == 0
+    assert samples[("pelorus_image_label_lookup_seconds_bucket", "+Inf")] == 1
+
+
+def test_images_failing_too_often_are_not_queued(client):
+    store = MemoryImageLabelStore(failure_max_retries=2)
+    workers = ImageLabelWorkers(store=store)
+    store.put("sha256:stored", ImageCommit("abc", None))
+    for _ in range(2):
+        store.record_failure("sha256:failing")
+
+    assert not workers.submit("sha256:stored", "quay.io/org/app@sha256:stored")
+    assert not workers.submit("sha256:failing", "quay.io/org/app@sha256:failing")
+    assert workers.queue_depth == 0
+
+
+def test_newest_images_are_looked_up_first(client):
+    with FakeRegistry(delay=0.1) as registry:
+        blocker = registry.add_image("org/app", {"n": "blocker"})
+        digests = {
+            created_at: registry.add_image("org/app", {"n": str(created_at)})
+            for created_at in (1.0, 3.0, 2.0)
+        }
+        workers = ImageLabelWorkers(workers=1)
+
+        # keeps the only worker busy while the others are queued
+        workers.submit(blocker, registry.uri("org/app", blocker), 10.0)
+        for created_at, digest in digests.items():
+            workers.submit(digest, registry.uri("org/app", digest), created_at)
+        workers.join()
+
+    assert list(workers.store._entries) == [
+        blocker,
+        digests[3.0],
+        digests[2.0],
+        digests[1.0],
+    ]
+
+
+def test_busy_registries_keep_their_order_and_dont_hold_back_others(client):
+    with FakeRegistry(delay=0.1) as busy, FakeRegistry() as idle:
+        blocker = busy.add_image("org/app", {"n": "blocker"})
+        digests = {
+            created_at: busy.add_image("org/app", {"n": str(created_at)})
+            for created_at in (1.0, 3.0, 2.0)
+        }
+        other = idle.add_image("org/other", {"n": "other"})
+        workers = ImageLabelWorkers(workers=4, workers_per_registry=1)
+
+        workers.submit(blocker, busy.uri("org/app", blocker), 10.0)
+        for created_at, digest in digests.items():
+            workers.submit(digest, busy.uri("org/app", digest), created_at)
+        # older than all of them, but its registry isn't busy
+        workers.submit(other, idle.uri("org/other", other), 0.0)
+        workers.join()
+
+    looked_up = list(workers.store._entries)
+    assert [digest for digest in looked_up if digest != other] == [
+        blocker,
+        digests[3.0],
+        digests[2.0],
+        digests[1.0],
+    ]
+    assert looked_up.index(other) < looked_up.index(digests[3.0])
+    assert busy.max_active == 1
+
+
+def test_wait_for_lookups(client):
+    with FakeRegistry(delay=0.2) as registry:
+        digest = registry.add_image("org/app", {"a": "b"})
+        workers = ImageLabelWorkers()
+
+        workers.submit(digest, registry.uri("org/app", digest))
+        assert not workers.wait([digest], timeout=0.01)
+        assert workers.wait([digest], timeout=5)
+
+    assert digest in workers.store
+    # images not being looked up are not waited for
+    assert workers.wait(["sha256:other"], timeout=0)
+
+
+def test_collector_waits_for_new_images(client, monkeypatch):
+    with FakeRegistry(delay=0.1) as registry:
+        digest = registry.add_image(
+            "org/app",
+            {
+                "io.openshift.build.commit.id": "abc",
+                "io.openshift.build.commit.date": "1684260472",
+            },
+        )
+        pod = ResourceInstance(
+            None,
+            dict(
+                kind="Pod",
+                apiVersion="v1",
+                metadata=dict(
+                    namespace="ns",
+                    labels={"app.kubernetes.io/name": "app"},
+                    creationTimestamp="2023-05-16T18:07:52Z",
+                ),
+            ),
+        )
+        monkeypatch.setattr(
+            collector_containerimage,
+            "get_and_log_namespaces",
+            lambda *args: {"ns"},
+        )
+        monkeypatch.setattr(
+            collector_containerimage, "get_running_pods", lambda *args, **kw: [pod]
+        )
+        monkeypatch.setattr(
+            collector_containerimage,
+            "filter_pods_by_replica_uid",
+            lambda pods: {"uid": pod},
+        )
+        monkeypatch.setattr(
+            collector_containerimage,
+            "get_images_from_pod",
+            lambda pod: {digest: registry.uri("org/app", digest)},
+        )
+        collector = ContainerImageCommitCollector(
+            kube_client=None,
+            username="",
+            token="",
+            namespaces=set(),
+            prod_label="",
+            date_format="",
+            label_wait=5,
+        )
 
-    with patch("time.time") as mock_time:
-        mock_time.return_value = current_time
-        _cache_container_images_labels(sha_256, labels)
+        metrics = list(collector.generate_metrics())
 
-    assert sha_256 in image_label_cache
-    assert image_label_cache[sha_256] == (labels, current_time)
+    assert [(m.name, m.commit_hash, m.image_hash) for m in metrics] == [
+        ("app", "abc", digest)
+    ]
+    # pods may be shared by the watch cache, so they are left as they were
+    assert set(pod.to_dict()["metadata"]) == {
+        "namespace",
+        "labels",
+        "creationTimestamp",
+    }
@@ -0,0 +1,77 @@
+from unittest.mock import Mock
+
+from committime.collector_image import ImageCommitCollector
+from tests.openshift_mocks import PagedResource
+
+APP_LABEL = "app.kubernetes.io/name"
+
+
+def image(name: str, version: str = "1", app: str = "app") -> dict:
+    return dict(
+        metadata=dict(
+            name=name,
+            resourceVersion=version,
+            labels={APP_LABEL: app},
+            annotations={},
+        ),
+        dockerImageReference=f"quay.io/org/app@{name}",
+        dockerImageMetadata=dict(
+            Config=dict(
+                Labels={
+                    "io.openshift.build.commit.id": f"commit-of-{name}",
+                    "io.openshift.build.commit.date": "1684260472",
+                }
+            )
+        ),
+    )
+
+
+def collector_listing(images: list[dict]) -> ImageCommitCollector:
+    kube_client = Mock()
+    kube_client.resources.get.return_value = PagedResource(images)
+    return ImageCommitCollector(
+        kube_client=kube_client,
+        username="",
+        token="",
+        namespaces=set(),
+        prod_label="",
+        date_format="",
+        image_page_size=2,
+    )
+
+
+def test_only_new_or_changed_images_are_processed(monkeypatch):
+    images = [image("sha256:a"), image("sha256:b"), image("sha256:c")]
+    collector = collector_listing(images)
+    processed = []
+    commit_metric_from_image = collector.commit_metric_from_image
+
+    def spy(app, image, errors):
+        processed.append(image.metadata.name)
+        return commit_metric_from_image(app, image, errors)
+
+    monkeypatch.setattr(collector, "commit_metric_from_image", spy)
+
+    first = list(collector.generate_metrics())
+    images[1] = image("sha256:b", version="2")
+    second = list(collector.generate_metrics())
+
+    assert [m.commit_hash for m in first] == [m.commit_hash for m in second]
+    assert [m.commit_hash for m in second] == [
+        "commit-of-sha256:a",
+        "commit-of-sha256:b",
+        "commit-of-sha256:c",
+    ]
+    assert processed == ["sha256:a", "sha256:b", "sha256:c", "sha256:b"]
+
+
+def test_images_gone_from_the_listing_are_forgotten():
+    images = [image("sha256:a"), image("sha256:b")]
+    collector = collector_listing(images)
+    list(collector.generate_metrics())
+
+    del images[0]
+    metrics = list(collector.generate_metrics())
+
+    assert [m.image_hash for m in metrics] == ["sha256:b"]
+    assert list(collector._metrics_by_image) == ["sha256:b"]
@@ -0,0 +1,109 @@
+import pytest
+
+from committime.image_label_store import (
+    ImageCommit,
+    MemoryImageLabelStore,
+    SQLiteImageLabelStore,
+    make_image_label_store,
+)
+
+COMMIT = ImageCommit("abc", "1684260472")
+OTHER_COMMIT = ImageCommit("def", None)
+
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("committime.image_label_store.time.time", lambda: clock[0])
+    return clock
+
+
+def test_least_recently_used_image_is_evicted():
+    store = MemoryImageLabelStore(max_entries=2)
+    store.put("sha256:a", COMMIT)
+    store.put("sha256:b", OTHER_COMMIT)
+    store.get("sha256:a")
+
+    store.put("sha256:c", COMMIT)
+
+    assert len(store) == 2
+    assert "sha256:b" not in store
+    assert store.get("sha256:a") == COMMIT
+
+
+def test_images_not_in_use_expire(now):
+    store = MemoryImageLabelStore(max_age=100)
+    store.put("sha256:used", COMMIT)
+    store.put("sha256:unused", OTHER_COMMIT)
+
+    now[0] += 101
+    store.expire(in_use={"sha256:used"})
+
+    assert "sha256:used" in store
+    assert "sha256:unused" not in store
+
+
+def test_failures_back_off(now):
+    store = MemoryImageLabelStore(failure_max_retries=2, failure_backoff=100)
+
+    for _ in range(2):
+        assert store.should_retry("sha256:a")
+        store.record_failure("sha256:a")
+    assert not store.should_retry("sha256:a")
+
+    now[0] += 101
+    assert store.should_retry("sha256:a")
+    store.expire()
+    assert not store.has_failed("sha256:a")
+
+
+def test_success_clears_the_failures():
+    store = MemoryImageLabelStore()
+    store.record_failure("sha256:a")
+
+    store.put("sha256:a", COMMIT)
+
+    assert store.failures == 0
+
+
+def test_sqlite_store_is_warmed_at_startup(tmp_path):
+    path = str(tmp_path / "images.db")
+    store = SQLiteImageLabelStore(path=path)
+    store.put("sha256:a", COMMIT)
+    store.put("sha256:b", OTHER_COMMIT)
+    store.record_failure("sha256:c")
+    store.close()
+
+    reopened = SQLiteImageLabelStore(path=path)
+
+    assert len(reopened) == 2
+    assert reopened.get("sha256:a") == COMMIT
+    assert reopened.get("sha256:b") == OTHER_COMMIT
+    assert reopened.has_failed("sha256:c")
+
+
+def test_sqlite_store_drops_old_and_least_recently_used(tmp_path, now):
+    path = str(tmp_path / "images.db")
+    store = SQLiteImageLabelStore(2, 100, path=path)
+    store.put("sha256:old", COMMIT)
+    now[0] += 150
+    for sha_256 in ("sha256:a", "sha256:b"):
+        store.put(sha_256, COMMIT)
+        now[0] += 1
+    store.get("sha256:a")
+    store.put("sha256:c", OTHER_COMMIT)
+    store.close()
+
+    reopened = SQLiteImageLabelStore(2, 100, path=path)
+
+    assert sorted(reopened._entries) == ["sha256:a", "sha256:c"]
+
+
+@pytest.mark.parametrize(
+    "path, expected_type",
+    [(None, MemoryImageLabelStore), ("db", SQLiteImageLabelStore)],
+)
+def test_make_image_label_store(tmp_path, path, expected_type):
+    store = make_image_label_store(path and str(tmp_path / path))
+
+    assert type(store) is expected_type
@@ -1,6 +1,22 @@
+from unittest.mock import NonCallableMock
+
 import pytest
+from kubernetes.dynamic.resource import ResourceInstance
 
-from provider_common.openshift import _parse_container_image_uri
+from provider_common.openshift import (
+    CLUSTER,
+    METADATA_ONLY_ACCEPT,
+    PER_NAMESPACE,
+    NamespaceQueryPlanner,
+    _parse_container_image_uri,
+    filter_pods_by_replica_uid,
+    filter_raw_pods_by_replica_uid,
+    get_and_log_namespaces,
+    get_images_from_pod,
+    get_images_from_raw_pod,
+    get_running_pods,
+)
+from tests.openshift_mocks import RawGetResponse
 
 
 @pytest.mark.parametrize(
@@ -50,3 +66,171 @@ def test_image_sha_bad_uri(registry: str, image: str, sha: str) -> None:
     assert ret_registry is None
     assert ret_image is None
     assert ret_sha is None
+
+
+class FakePods:
+    "A Pod resource listing `per_namespace` pods in each namespace, recording the calls."
+
+    kind = "Pod"
+
+    def __init__(self, namespaces: int, per_namespace: int):
+        self.items = [
+            dict(metadata=dict(name=f"pod-{i}", namespace=f"ns-{n}"))
+            for n in range(namespaces)
+            for i in range(per_namespace)
+        ]
+        self.calls = []
+
+    def get(self, namespace=None, serialize=True, **query):
+        self.calls.append(namespace)
+        items = [
+            item
+            for item in self.items
+            if namespace in (None, item["metadata"]["namespace"])
+        ]
+        if not serialize:
+            return RawGetResponse.of(items)
+        return ResourceInstance(
+            None, dict(kind="PodList", apiVersion="v1", items=items)
+        )
+
+
+def namespaces(count: int) -> set[str]:
+    return {f"ns-{n}" for n in range(count)}
+
+
+def test_few_namespaces_are_listed_concurrently():
+    pods = FakePods(namespaces=20, per_namespace=2)
+    planner = NamespaceQueryPlanner(workers=4)
+
+    items = planner.list(pods, namespaces(3), label_selector="app")
+
+    assert len(items) == 6
+    assert sorted(pods.calls) == ["ns-0", "ns-1", "ns-2"]
+    assert planner.plans_total == {("Pod", PER_NAMESPACE): 1}
+    assert planner.requests_total == {("Pod", PER_NAMESPACE): 3}
+
+
+def test_many_namespaces_are_listed_cluster_wide():
+    pods = FakePods(namespaces=20, per_namespace=2)
+    planner = NamespaceQueryPlanner(workers=4)
+
+    items = planner.list(pods, namespaces(10), label_selector="app")
+
+    assert {item.metadata.namespace for item in items} == namespaces(10)
+    assert pods.calls == [None]
+    assert planner.plans_total == {("Pod", CLUSTER): 1}
+
+
+def test_raw_lists_are_plain_dicts():
+    pods = FakePods(namespaces=20, per_namespace=2)
+    planner = NamespaceQueryPlanner(workers=4)
+
+    cluster_items = planner.list(pods, namespaces(10), raw=True)
+    namespaced_items = planner.list(pods, namespaces(2), raw=True)
+
+    assert all(isinstance(item, dict) for item in cluster_items + namespaced_items)
+    assert {item["metadata"]["namespace"] for item in cluster_items} == namespaces(10)
+    assert len(namespaced_items) == 4
+
+
+def test_plan_uses_the_sizes_of_previous_lists():
+    # a cluster-wide list of the 2000 pods costs more than 3 namespaced calls
+    pods = FakePods(namespaces=100, per_namespace=20)
+    planner = NamespaceQueryPlanner(workers=2, call_cost=50)
+
+    planner.list(pods, namespaces(3))
+    assert pods.calls == [None]
+    pods.calls.clear()
+
+    planner.list(pods, namespaces(3))
+    assert sorted(pods.calls) == ["ns-0", "ns-1", "ns-2"]
+    # but not more than 50 namespaced calls
+    assert planner.plan(("Pod",), namespaces(50)) == CLUSTER
+
+
+def test_planner_metrics():
+    pods = FakePods(namespaces=2, per_namespace=1)
+    planner = NamespaceQueryPlanner()
+    planner.list(pods, namespaces(2))
+    planner.list(pods)
+
+    samples = {
+        (sample.name, sample.labels["plan"]): sample.value
+        for family in planner.metrics()
+        for sample in family.samples
+    }
+
+    assert samples == {
+        ("pelorus_namespace_query_plans_total", CLUSTER): 1,
+        ("pelorus_namespace_query_plans_total", PER_NAMESPACE): 1,
+        ("pelorus_namespace_query_requests_total", CLUSTER): 1,
+        ("pelorus_namespace_query_requests_total", PER_NAMESPACE): 2,
+    }
+
+
+def test_namespaces_are_listed_without_their_spec():
+    client = NonCallableMock()
+    namespaces_resource = client.resources.get.return_value
+    namespaces_resource.get.return_value = ResourceInstance(
+        None,
+        dict(
+            kind="PartialObjectMetadataList",
+            apiVersion="meta.k8s.io/v1",
+            items=[dict(metadata=dict(name="prod"))],
+        ),
+    )
+
+    assert get_and_log_namespaces(client, set(), "env=prod") == {"prod"}
+    assert namespaces_resource.get.call_args.kwargs == dict(
+        label_selector="env=prod", header_params={"Accept": METADATA_ONLY_ACCEPT}
+    )
+
+
+SHA = "sha256:" + "a" * 64
+
+
+def raw_pod(name: str, owner_kind: str, owner_uid: str) -> dict:
+    return dict(
+        metadata=dict(
+            name=name,
+            namespace="ns-0",
+            ownerReferences=[dict(kind=owner_kind, uid=owner_uid, apiVersion="v1")],
+        ),
+        status=dict(
+            containerStatuses=[
+                dict(imageID=f"quay.io/org/app@{SHA}"),
+                dict(imageID="quay.io/org/sidecar:latest"),
+                dict(),
+            ]
+        ),
+    )
+
+
+def test_raw_pod_helpers_match_resource_field_ones():
+    pods = FakePods(namespaces=0, per_namespace=0)
+    pods.items = [
+        raw_pod("app-1", "ReplicaSet", "rs"),
+        raw_pod("app-2", "ReplicaSet", "rs"),
+        raw_pod("job-1", "Job", "job"),
+    ]
+    client = NonCallableMock()
+    client.resources.get.return_value = pods
+
+    raw_pods = get_running_pods(client, {"ns-0"}, raw=True)
+    fields = get_running_pods(client, {"ns-0"})
+
+    assert [p["metadata"]["name"] for p in raw_pods] == ["app-1", "app-2"]
+    assert [p.metadata.name for p in fields] == ["app-1", "app-2"]
+
+    raw_by_owner = filter_raw_pods_by_replica_uid(raw_pods)
+    by_owner = filter_pods_by_replica_uid(fields)
+    assert raw_by_owner.keys() == by_owner.keys() == {"rs"}
+    assert raw_by_owner["rs"]["metadata"]["name"] == by_owner["rs"].metadata.name
+
+    assert get_images_from_raw_pod(raw_by_owner["rs"]) == get_images_from_pod(
+        by_owner["rs"]
+    )
+    assert get_images_from_raw_pod(raw_by_owner["rs"]) == {
+        SHA: f"docker://quay.io/org/app@{SHA}"
+    }
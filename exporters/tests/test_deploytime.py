@@ -3,16 +3,19 @@ from collections import defaultdict
 from datetime import datetime, timedelta
 from random import randrange
 from typing import Optional
-from unittest.mock import NonCallableMock, patch
+from unittest.mock import NonCallableMock
 
 import attrs
 import pytest
 from openshift.dynamic import DynamicClient  # type: ignore
 from openshift.dynamic.discovery import Discoverer  # type: ignore
 
+import deploytime.app
 import pelorus
 from deploytime import DeployTimeMetric
 from deploytime.app import DeployTimeCollector
+from pelorus.timeutil import METRIC_TIMESTAMP_THRESHOLD_MINUTES, to_iso
+from provider_common.openshift import METADATA_ONLY_ACCEPT
 from tests.openshift_mocks import (
     Container,
     ContainerStatus,
@@ -21,6 +24,7 @@ from tests.openshift_mocks import (
     Pod,
     PodSpec,
     PodStatus,
+    RawGetResponse,
     Replicator,
     ResourceGetResponse,
 )
@@ -83,6 +87,7 @@ class DynClientMockData:
     def __attrs_post_init__(self):
         self.mock_client = NonCallableMock(DynamicClient)
         self.pods_mock = NonCallableMock(Discoverer)
+        self.pods_mock.kind = "Pod"
         self.replicators_by_kind = defaultdict(lambda: NonCallableMock(Discoverer))
 
         self.mock_client.resources.get.side_effect = self.get_resource
@@ -101,7 +106,9 @@ class DynClientMockData:
             return self.replicators_by_kind[kind]
         raise ValueError(f"Unknown, un-mocked resource kind '{kind}'")
 
-    def get_pods(self, **_kwargs):
+    def get_pods(self, serialize: bool = True, **_kwargs):
+        if not serialize:
+            return RawGetResponse.of(self.pods)
         return ResourceGetResponse(self.pods)
 
     def get_replicas(self, *, kind: str, **_kwargs):
@@ -135,7 +142,10 @@ def rc(
 
 
 def random_time() -> datetime:
-    return datetime.now() - timedelta(hours=12) + timedelta(hours=randrange(0, 12))
+    "A time within the last METRIC_TIMESTAMP_THRESHOLD_MINUTES, so it is collected"
+    return datetime.now() - timedelta(
+        minutes=randrange(0, METRIC_TIMESTAMP_THRESHOLD_MINUTES - 5)
+    )
 
 
 def random_uid() -> str:
@@ -149,6 +159,7 @@ def pod(
     app_label: str,
     labels: Optional[dict[str, str]] = None,
     status_image_shas: Optional[list[str]] = None,
+    created: Optional[str] = None,
 ):
     if status_image_shas is None:
         status_image_shas = container_image_shas
@@ -161,6 +172,7 @@ def pod(
             namespace=namespace,
             ownerReferences=owner_refs,
             labels=labels,
+            creationTimestamp=created,
         ),
         spec=PodSpec(containers=[Container(x) for x in container_image_shas]),
         status=PodStatus(
@@ -172,7 +184,8 @@ def pod(
 # endregion
 
 
-def test_generate_normal_case() -> None:
+@pytest.mark.parametrize("raw_lists", [True, False])
+def test_generate_normal_case(raw_lists: bool) -> None:
     foo_rep_uid = random_uid()
 
     foo_rep = rc(
@@ -239,34 +252,111 @@ def test_generate_normal_case() -> None:
     data = DynClientMockData(pods=pods, replicators=[foo_rep, bar_rep, quux_rep])
 
     collector = DeployTimeCollector(
-        client=data.mock_client, namespaces={FOO_NS, BAR_NS, QUUX_NS}
+        client=data.mock_client,
+        namespaces={FOO_NS, BAR_NS, QUUX_NS},
+        raw_lists=raw_lists,
     )
 
     expected = {
         DeployTimeMetric(
             name=FOO_APP,
             namespace=FOO_NS,
-            labels={FOO_LABEL: FOO_LABEL_VALUE, APP_LABEL: FOO_APP},
             deploy_time=foo_rep.metadata.creationTimestamp,
             image_sha=FOO_POD_SHAS[0].split("@")[1],
         ),
         DeployTimeMetric(
             name=QUUX_APP,
             namespace=QUUX_NS,
-            labels={APP_LABEL: QUUX_APP},
             deploy_time=quux_rep.metadata.creationTimestamp,
             image_sha=STATUS_CONTAINER_SHAS[0].split("@")[1],
         ),
     }
 
-    with patch("deploytime.app.get_owner_object_from_child") as owner_refs:
-        owner_refs.return_value = {
-            foo_rep_uid: foo_rep,
-            bar_rep_uid: bar_rep,
-            quux_rep_uid: quux_rep,
-        }
-        actual = set(collector.generate_metrics())
-        assert actual == expected
+    actual = set(collector.generate_metrics())
+    assert actual == expected
+    # pods are decoded without being wrapped in ResourceFields
+    pods_kwargs = [c.kwargs for c in data.pods_mock.get.call_args_list]
+    assert all(kwargs.get("serialize", True) != raw_lists for kwargs in pods_kwargs)
+
+    # owners are listed once per namespace and kind, not fetched one by one
+    rc_mock = data.replicators_by_kind[REP_CONTROLLER]
+    rs_mock = data.replicators_by_kind[REPLICA_SET]
+    assert rc_mock.get.call_count == 1
+    # only their metadata is requested
+    assert rc_mock.get.call_args.kwargs == dict(
+        namespace=FOO_NS, header_params={"Accept": METADATA_ONLY_ACCEPT}
+    )
+    assert sorted(c.kwargs["namespace"] for c in rs_mock.get.call_args_list) == sorted(
+        [BAR_NS, QUUX_NS]
+    )
+
+    # resolved owners are cached for the next collection
+    assert set(collector.generate_metrics()) == expected
+    assert rs_mock.get.call_count == 2
+
+
+@pytest.mark.parametrize("raw_lists", [True, False])
+def test_old_deployments_are_pruned_early(
+    raw_lists: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    too_old = datetime.now() - timedelta(minutes=METRIC_TIMESTAMP_THRESHOLD_MINUTES + 5)
+    old_rep = rc(
+        REPLICA_SET, API_VERSION, FOO_REP, random_uid(), FOO_NS, FOO_APP, too_old
+    )
+    # its pod was restarted recently, so the owner has to be looked up
+    restarted_rep = rc(
+        REPLICA_SET, API_VERSION, BAR_REP, random_uid(), FOO_NS, BAR_APP, too_old
+    )
+    new_rep = rc(
+        REPLICA_SET,
+        API_VERSION,
+        QUUX_REP,
+        random_uid(),
+        FOO_NS,
+        QUUX_APP,
+        datetime.now(),
+    )
+
+    pods = [
+        pod(
+            FOO_NS,
+            [old_rep.ref()],
+            FOO_POD_SHAS,
+            FOO_APP,
+            created=to_iso(too_old.astimezone()),
+        ),
+        pod(
+            FOO_NS,
+            [restarted_rep.ref()],
+            FOO_POD_SHAS,
+            BAR_APP,
+            created=to_iso(datetime.now().astimezone()),
+        ),
+        pod(FOO_NS, [new_rep.ref()], QUUX_POD_SHAS, QUUX_APP),
+    ]
+    data = DynClientMockData(pods=pods, replicators=[restarted_rep, new_rep])
+    collector = DeployTimeCollector(
+        client=data.mock_client, namespaces={FOO_NS}, raw_lists=raw_lists
+    )
+    looked_up = []
+    get_owner_creation_timestamps = deploytime.app.get_owner_creation_timestamps
+
+    def get_owners(client, pods_by_owner_uid, cache):
+        looked_up.extend(pods_by_owner_uid)
+        return get_owner_creation_timestamps(client, pods_by_owner_uid, cache)
+
+    monkeypatch.setattr(deploytime.app, "get_owner_creation_timestamps", get_owners)
+
+    assert list(collector.generate_metrics()) == [
+        DeployTimeMetric(
+            name=QUUX_APP,
+            namespace=FOO_NS,
+            deploy_time=new_rep.metadata.creationTimestamp,
+            image_sha=QUUX_POD_SHAS[0].split("@")[1],
+        )
+    ]
+    # the owner of the old pod was not looked up
+    assert set(looked_up) == {restarted_rep.metadata.uid, new_rep.metadata.uid}
 
 
 @pytest.mark.xfail(reason="Bug with different rep kinds with same name and namespace")
@@ -296,14 +386,12 @@ def test_generate_reps_with_same_name() -> None:
         DeployTimeMetric(
             name=FOO_APP,
             namespace=FOO_NS,
-            labels={FOO_LABEL: FOO_LABEL_VALUE, APP_LABEL: FOO_APP},
             deploy_time=foo_rep.metadata.creationTimestamp,
             image_sha=FOO_POD_SHAS[0],
         ),
         DeployTimeMetric(
             name=BAR_APP,
             namespace=BAR_NS,
-            labels={APP_LABEL: BAR_APP},
             deploy_time=bar_rep.metadata.creationTimestamp,
             image_sha=BAR_POD_SHAS[0],
         ),
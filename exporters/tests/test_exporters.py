@@ -1,5 +1,11 @@
 import pytest
+from kubernetes.dynamic.resource import ResourceInstance
 
+from committime import (
+    commit_metric_from_build,
+    commit_metric_from_raw_build,
+    parse_repo_url,
+)
 from committime.collector_base import CommitMetric
 
 
@@ -236,3 +242,48 @@ def test_malformed_git_url(malformed_url):
     metric.name = test_name
     with pytest.raises(ValueError):
         metric.repo_url = malformed_url
+
+
+def test_repo_url_is_parsed_once():
+    parse_repo_url.cache_clear()
+    url = "https://github.com/konveyor/pelorus.git"
+    metrics = [CommitMetric("pytest") for _ in range(3)]
+
+    for metric in metrics:
+        metric.repo_url = url + "/"
+
+    assert parse_repo_url.cache_info().misses == 1
+    assert {metric.repo_project for metric in metrics} == {"pelorus"}
+
+
+@pytest.mark.parametrize(
+    "build",
+    [
+        dict(
+            metadata=dict(name="app-1", namespace="ns", labels=dict(buildconfig="app")),
+            spec=dict(
+                source=dict(git=dict(uri="https://github.com/org/app.git")),
+                revision=dict(git=dict(commit="abc", author=dict(name="dev"))),
+            ),
+            status=dict(
+                outputDockerImageReference="registry/ns/app:latest",
+                output=dict(to=dict(imageDigest="sha256:123")),
+            ),
+        ),
+        # missing required and optional fields
+        dict(metadata=dict(name="app-2", labels={}), spec=dict(revision=None)),
+        dict(metadata=dict(name="app-3")),
+    ],
+)
+def test_commit_metric_from_raw_build_matches_resource_field(build):
+    errors, raw_errors = [], []
+
+    metric = commit_metric_from_build(
+        "app",
+        ResourceInstance(None, dict(build, kind="Build", apiVersion="v1")),
+        errors,
+    )
+    raw_metric = commit_metric_from_raw_build("app", build, raw_errors)
+
+    assert raw_metric == metric
+    assert [str(e) for e in raw_errors] == [str(e) for e in errors]
@@ -28,6 +28,7 @@ from failure.collector_github import GithubFailureCollector
 from failure.collector_jira import DEFAULT_JQL_SEARCH_QUERY, JiraFailureCollector
 from pelorus.config import load_and_log
 from pelorus.errors import FailureProviderAuthenticationError
+from pelorus.utils.resilience import CircuitBreakers, CircuitOpenError
 from tests import run_prometheus_register
 
 JIRA_SERVER = "https://pelorustest.atlassian.net"
@@ -237,6 +238,57 @@ def test_token_auth_connect_to_jira(jira_mock):
     assert jira_client == jira_client_mock
 
 
+@mock.patch("failure.collector_jira.JIRA")
+def test_jira_circuit_opens_when_the_server_fails(
+    jira_mock, monkeypatch: pytest.MonkeyPatch
+):
+    jira_mock.side_effect = JIRAError(status_code=503, text="Service Unavailable")
+    monkeypatch.setattr(
+        collector_jira,
+        "circuit_breakers",
+        CircuitBreakers(failure_threshold=2, reset_timeout=3600),
+    )
+    collector = JiraFailureCollector(
+        tracker_api="https://my.jira.server.com", token="token"
+    )
+
+    for _ in range(2):
+        with pytest.raises(JIRAError):
+            collector.search_issues()
+    with pytest.raises(CircuitOpenError):
+        collector.search_issues()
+
+    assert jira_mock.call_count == 2
+
+
+@mock.patch("failure.collector_jira.JIRA")
+def test_jira_circuit_opens_when_searches_fail(
+    jira_mock, monkeypatch: pytest.MonkeyPatch
+):
+    jira_client_mock = mock.MagicMock()
+    jira_client_mock.search_issues.side_effect = JIRAError(
+        status_code=502, text="Bad Gateway"
+    )
+    jira_mock.return_value = jira_client_mock
+    monkeypatch.setattr(
+        collector_jira,
+        "circuit_breakers",
+        CircuitBreakers(failure_threshold=2, reset_timeout=3600),
+    )
+    collector = JiraFailureCollector(
+        tracker_api="https://my.jira.server.com", token="token"
+    )
+
+    # each collection connects, then fails to search
+    for _ in range(2):
+        with pytest.raises(JIRAError):
+            collector.search_issues()
+    with pytest.raises(CircuitOpenError):
+        collector.search_issues()
+
+    assert jira_client_mock.search_issues.call_count == 2
+
+
 def test_jira_prometheus_register(monkeypatch: pytest.MonkeyPatch):
     def mock_search_issues(self):
         return []
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+import requests
+
+from provider_common.github import (
+    RATELIMIT_LIMIT_HEADER,
+    RATELIMIT_REMAINING_HEADER,
+    RATELIMIT_RESET_HEADER,
+    RateLimitBudget,
+    RateLimitDeferred,
+    rate_limit_budget,
+)
+
+
+def response(remaining: int, limit: int = 5000, reset_in: float = 100.0):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers.update(
+        {
+            RATELIMIT_LIMIT_HEADER: str(limit),
+            RATELIMIT_REMAINING_HEADER: str(remaining),
+            RATELIMIT_RESET_HEADER: str(time.time() + reset_in),
+        }
+    )
+    return response
+
+
+def test_requests_go_right_away_until_the_limit_is_known(sleeps: list[float]):
+    budget = RateLimitBudget()
+
+    for _ in range(100):
+        budget.acquire(priority=False)
+
+    budget.update(requests.Response())
+    budget.acquire()
+    assert sleeps == []
+    assert budget.remaining is None
+
+
+def test_remaining_requests_are_spread_until_the_reset(sleeps: list[float]):
+    budget = RateLimitBudget(burst=0.1, max_wait=5)
+    budget.update(response(remaining=100, reset_in=100))
+
+    for _ in range(13):
+        budget.acquire()
+
+    # 10 right away, then one per second
+    assert [round(wait) for wait in sleeps] == [1, 2, 3]
+    assert budget.waited_seconds_total == pytest.approx(6, abs=0.1)
+
+
+def test_requests_that_would_wait_too_long_are_deferred(sleeps: list[float]):
+    budget = RateLimitBudget(burst=0.1, max_wait=1.5)
+    budget.update(response(remaining=100, reset_in=100))
+
+    for _ in range(11):
+        budget.acquire()
+    with pytest.raises(RateLimitDeferred):
+        budget.acquire()
+
+    assert budget.deferred_total == 1
+
+
+def test_reserve_is_kept_for_priority_requests(sleeps: list[float]):
+    budget = RateLimitBudget(reserve=0.1)
+    budget.update(response(remaining=400, limit=5000))
+
+    with pytest.raises(RateLimitDeferred):
+        budget.acquire(priority=False)
+    budget.acquire(priority=True)
+
+    budget.update(response(remaining=0, limit=5000))
+    with pytest.raises(RateLimitDeferred) as deferred:
+        budget.acquire(priority=True)
+    assert deferred.value.reset_at == budget.reset_at
+
+
+def test_limit_resets(sleeps: list[float]):
+    budget = RateLimitBudget()
+    budget.update(response(remaining=0, reset_in=-1))
+
+    budget.acquire()
+
+
+def test_budgets_are_shared_per_token():
+    assert rate_limit_budget("s3cr3t") is rate_limit_budget("s3cr3t")
+    assert rate_limit_budget("s3cr3t") is not rate_limit_budget("other")
+    assert rate_limit_budget(None) is rate_limit_budget("")
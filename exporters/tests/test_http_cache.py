@@ -0,0 +1,183 @@
+import gzip
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+from pelorus.utils import HttpClient, TokenAuth, http
+from pelorus.utils.http_cache import (
+    CachedResponse,
+    MemoryResponseCache,
+    SQLiteResponseCache,
+    make_response_cache,
+)
+from tests.local_server import LocalServer, QuietHandler, server_fixture
+
+LAST_MODIFIED = "Tue, 16 May 2023 18:07:52 GMT"
+
+
+class ConditionalServer(LocalServer):
+    """
+    Serves `body` with an ETag and Last-Modified, answering 304 to requests
+    that have the current ETag. Counts the responses by status.
+    """
+
+    def __init__(self):
+        self.body = b'["v1"]'
+        self.etag = '"1"'
+        self.remaining = 5000
+        self.gzip = False
+        self.statuses: Counter = Counter()
+        super().__init__(self._handler())
+
+    @property
+    def url(self) -> str:
+        return f"{super().url}/repos/org/app/releases"
+
+    def _handler(self):
+        origin = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                origin.remaining -= 1
+                if self.headers.get("If-None-Match") == origin.etag:
+                    status, body = 304, b""
+                else:
+                    status, body = 200, origin.body
+                origin.statuses[status] += 1
+                self.send_response(status)
+                self.send_header("ETag", origin.etag)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                self.send_header("x-ratelimit-remaining", str(origin.remaining))
+                if status == 200:
+                    if origin.gzip:
+                        body = gzip.compress(body)
+                        self.send_header("Content-Encoding", "gzip")
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+server = server_fixture(ConditionalServer)
+
+
+def test_not_modified_responses_are_served_from_the_cache(server: ConditionalServer):
+    cache = MemoryResponseCache()
+    client = HttpClient(cache=cache)
+
+    first = client.get(server.url)
+    second = client.get(server.url)
+
+    assert server.statuses == {200: 1, 304: 1}
+    assert second.status_code == 200
+    assert second.json() == first.json() == ["v1"]
+    # the headers of the 304 are kept, so rate limits stay current
+    assert second.headers["x-ratelimit-remaining"] == "4998"
+    assert second.request.headers["If-None-Match"] == '"1"'
+    assert second.request.headers["If-Modified-Since"] == LAST_MODIFIED
+
+    server.body, server.etag = b'["v1", "v2"]', '"2"'
+    assert client.get(server.url).json() == ["v1", "v2"]
+    assert client.get(server.url).json() == ["v1", "v2"]
+    assert server.statuses == {200: 2, 304: 2}
+
+    families = {family.name: family for family in cache.metrics()}
+    host = server.url.split("/")[2]
+    assert {
+        tuple(sample.labels.values()): sample.value
+        for sample in families["pelorus_http_cache_requests"].samples
+    } == {(host, "hit"): 2, (host, "miss"): 2}
+    assert families["pelorus_http_cache_hit_ratio"].samples[0].value == 0.5
+    assert families["pelorus_http_cache_entries"].samples[0].value == 1
+
+
+def test_cached_responses_match_their_decoded_body(server: ConditionalServer):
+    server.gzip = True
+    client = HttpClient(cache=MemoryResponseCache())
+
+    client.get(server.url)
+    response = client.get(server.url)
+
+    assert server.statuses == {200: 1, 304: 1}
+    assert response.json() == ["v1"]
+    assert "Content-Encoding" not in response.headers
+    assert "Content-Length" not in response.headers
+
+
+def test_responses_are_cached_per_authorization(server: ConditionalServer):
+    cache = MemoryResponseCache()
+    alice, bob = HttpClient(cache=cache), HttpClient(cache=cache)
+    alice.auth, bob.auth = TokenAuth("alice"), TokenAuth("bob")
+
+    alice.get(server.url)
+    bob.get(server.url)
+
+    assert server.statuses == {200: 2}
+    assert len(cache) == 2
+
+
+def test_cache_is_bounded():
+    cache = MemoryResponseCache(max_entries=2)
+    for key in "abc":
+        cache.put(key, CachedResponse((), b"", etag=key))
+
+    assert cache.get("a") is None
+    assert len(cache) == 2
+
+
+def test_cache_is_bounded_by_size():
+    cache = MemoryResponseCache(max_bytes=250, max_entry_bytes=100)
+    for key in "abc":
+        assert cache.put(key, CachedResponse((), b"x" * 90, etag=key))
+
+    assert cache.get("a") is None
+    assert len(cache) == 2
+    assert cache.bytes == 180
+
+    # too large to be cached, and the stale entry is dropped
+    assert not cache.put("b", CachedResponse((), b"x" * 101, etag="b"))
+    assert cache.get("b") is None
+    assert cache.bytes == 90
+
+
+def test_sqlite_cache_is_revalidated_after_a_restart(
+    server: ConditionalServer, tmp_path: Path
+):
+    path = str(tmp_path / "responses.db")
+    client = HttpClient(cache=make_response_cache(path))
+    client.get(server.url)
+
+    restarted = make_response_cache(path)
+    assert isinstance(restarted, SQLiteResponseCache)
+    response = HttpClient(cache=restarted).get(server.url)
+
+    assert response.json() == ["v1"]
+    assert server.statuses == {200: 1, 304: 1}
+
+
+@pytest.mark.parametrize("use_httpx", [True, False])
+def test_async_calls_are_cached(
+    server: ConditionalServer, monkeypatch: pytest.MonkeyPatch, use_httpx: bool
+):
+    if not use_httpx:
+        monkeypatch.setattr(http, "httpx", None)
+    client = HttpClient(cache=MemoryResponseCache())
+
+    client.get(server.url)
+    (response,) = client.gather([client.get_async(server.url)])
+
+    assert response.status_code == 200
+    assert response.json() == ["v1"]
+    assert server.statuses == {200: 1, 304: 1}
+
+
+def test_cache_can_be_disabled(server: ConditionalServer):
+    client = HttpClient(cache=None)
+
+    client.get(server.url)
+    client.get(server.url)
+
+    assert server.statuses == {200: 2}
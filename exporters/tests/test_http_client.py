@@ -0,0 +1,111 @@
+import json
+import socket
+import time
+
+import pytest
+import requests
+
+from pelorus.utils import HttpClient, TokenAuth, http, set_up_requests_session
+from pelorus.utils.resilience import NO_RETRY, CircuitBreakers
+from tests.local_server import LocalServer, QuietHandler, server_fixture
+
+
+class EchoServer(LocalServer):
+    "Answers every GET with the path and Authorization header, recording connections."
+
+    def __init__(self):
+        self.connections: set = set()
+        super().__init__(self._handler())
+
+    def _handler(self):
+        echo = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                echo.connections.add(self.client_address)
+                body = json.dumps(
+                    dict(path=self.path, auth=self.headers.get("Authorization"))
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+server = server_fixture(EchoServer)
+
+
+def test_sessions_are_per_host_and_configured_like_requests_sessions():
+    client = HttpClient()
+    set_up_requests_session(client, False, username="user", token="s3cr3t")
+
+    github = client.session("https://api.github.com/repos/org/app")
+
+    assert client.session("https://api.github.com/user") is github
+    assert client.session("https://gitlab.com/api/v4") is not github
+    assert github.verify is False
+    assert github.auth == ("user", "s3cr3t")
+
+
+def test_connections_are_kept_alive(server: EchoServer):
+    client = HttpClient()
+
+    for i in range(5):
+        assert client.get(f"{server.url}/{i}").json()["path"] == f"/{i}"
+
+    assert len(server.connections) == 1
+
+
+@pytest.mark.parametrize("use_httpx", [True, False])
+def test_async_calls_fan_out(
+    server: EchoServer, monkeypatch: pytest.MonkeyPatch, use_httpx: bool
+):
+    if not use_httpx:
+        # run the calls in the thread pool instead
+        monkeypatch.setattr(http, "httpx", None)
+    client = HttpClient(pool_size=4)
+    client.auth = TokenAuth("s3cr3t")
+
+    responses = client.gather(client.get_async(f"{server.url}/{i}") for i in range(8))
+
+    assert all(isinstance(response, requests.Response) for response in responses)
+    assert [response.json() for response in responses] == [
+        dict(path=f"/{i}", auth="token s3cr3t") for i in range(8)
+    ]
+    assert len(server.connections) <= 4
+
+
+def test_async_call_errors_can_be_returned(server: EchoServer):
+    client = HttpClient()
+
+    ok, failed = client.gather(
+        [client.get_async(f"{server.url}/ok"), client.get_async("http://127.0.0.1:1/")],
+        return_exceptions=True,
+    )
+
+    assert ok.status_code == 200
+    assert isinstance(failed, Exception)
+
+
+@pytest.mark.parametrize("use_httpx", [True, False])
+def test_async_calls_time_out_by_default(
+    monkeypatch: pytest.MonkeyPatch, use_httpx: bool
+):
+    timeout_error = http.httpx.TimeoutException if use_httpx else requests.Timeout
+    if not use_httpx:
+        monkeypatch.setattr(http, "httpx", None)
+    client = HttpClient(
+        timeout=0.2, cache=None, retry=NO_RETRY, breakers=CircuitBreakers()
+    )
+
+    # accepts connections, but never answers
+    with socket.create_server(("127.0.0.1", 0)) as hung:
+        url = f"http://127.0.0.1:{hung.getsockname()[1]}/"
+        started = time.monotonic()
+        (error,) = client.gather([client.get_async(url)], return_exceptions=True)
+
+    assert time.monotonic() - started < 5
+    assert isinstance(error, timeout_error)
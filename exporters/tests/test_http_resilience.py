@@ -0,0 +1,181 @@
+import pytest
+import requests
+
+from pelorus.utils import HttpClient
+from pelorus.utils.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreakers,
+    CircuitOpenError,
+    RetryPolicy,
+)
+from tests.local_server import LocalServer, QuietHandler, server_fixture
+
+
+class ScriptedServer(LocalServer):
+    "Answers each request with the next (status, headers) of `responses`, then 200."
+
+    def __init__(self):
+        self.responses: list[tuple[int, dict]] = []
+        self.calls = 0
+        super().__init__(self._handler())
+
+    @property
+    def host(self) -> str:
+        "The host the circuit breakers know the server by."
+        return f"127.0.0.1:{self.port}"
+
+    @property
+    def url(self) -> str:
+        return f"{super().url}/rest/api/1.0/projects"
+
+    def _handler(self):
+        scripted = self
+
+        class Handler(QuietHandler):
+            def _respond(self):
+                scripted.calls += 1
+                status, headers = (
+                    scripted.responses.pop(0) if scripted.responses else (200, {})
+                )
+                body = b"{}"
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._respond()
+
+        return Handler
+
+
+server = server_fixture(ScriptedServer)
+
+
+def client(breakers: CircuitBreakers, **kwargs) -> HttpClient:
+    return HttpClient(cache=None, breakers=breakers, **kwargs)
+
+
+def test_server_errors_are_retried_with_jittered_backoff(
+    server: ScriptedServer, sleeps: list[float]
+):
+    server.responses = [(503, {}), (502, {})]
+    breakers = CircuitBreakers()
+
+    response = client(breakers, retry=RetryPolicy(backoff=1)).get(server.url)
+
+    assert response.status_code == 200
+    assert server.calls == 3
+    assert 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2
+    assert breakers.retries_total == {
+        (server.host, "503"): 1,
+        (server.host, "502"): 1,
+    }
+
+
+def test_retry_after_is_honored(server: ScriptedServer, sleeps: list[float]):
+    server.responses = [(429, {"Retry-After": "2"})]
+
+    response = client(CircuitBreakers()).get(server.url)
+
+    assert response.status_code == 200
+    assert sleeps == [2.0]
+
+
+def test_retry_after_beyond_the_maximum_backoff_is_not_waited_for(
+    server: ScriptedServer, sleeps: list[float]
+):
+    server.responses = [(429, {"Retry-After": "3600"})]
+
+    response = client(CircuitBreakers()).get(server.url)
+
+    assert response.status_code == 429
+    assert sleeps == []
+
+
+def test_calls_give_up_after_the_maximum_retries(
+    server: ScriptedServer, sleeps: list[float]
+):
+    server.responses = [(500, {})] * 5
+
+    response = client(CircuitBreakers(), retry=RetryPolicy(max_retries=2)).get(
+        server.url
+    )
+
+    assert response.status_code == 500
+    assert server.calls == 3
+
+
+def test_non_idempotent_calls_are_not_retried(
+    server: ScriptedServer, sleeps: list[float]
+):
+    server.responses = [(503, {})]
+
+    response = client(CircuitBreakers()).request("POST", server.url, data=b"{}")
+
+    assert response.status_code == 503
+    assert server.calls == 1
+
+
+def test_circuit_opens_after_consecutive_failures(
+    server: ScriptedServer, sleeps: list[float]
+):
+    server.responses = [(503, {})] * 3
+    breakers = CircuitBreakers(failure_threshold=3, reset_timeout=3600)
+    c = client(breakers, retry=RetryPolicy(max_retries=0))
+
+    for _ in range(3):
+        assert c.get(server.url).status_code == 503
+    with pytest.raises(CircuitOpenError):
+        c.get(server.url)
+
+    assert server.calls == 3
+    # other hosts are still called
+    with pytest.raises(requests.ConnectionError) as error:
+        c.get("http://127.0.0.1:1/")
+    assert not isinstance(error.value, CircuitOpenError)
+
+
+def test_circuit_closes_after_a_successful_trial(server: ScriptedServer):
+    server.responses = [(503, {})] * 2
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=0)
+    c = client(breakers, retry=RetryPolicy(max_retries=0))
+
+    c.get(server.url)
+    assert breakers.get(server.host).state == OPEN
+    # the trial fails, so the circuit opens again
+    c.get(server.url)
+    assert breakers.get(server.host).state == OPEN
+    assert c.get(server.url).status_code == 200
+    assert breakers.get(server.host).state == CLOSED
+
+    families = {family.name: family for family in breakers.metrics()}
+    assert {
+        sample.labels["state"]: sample.value
+        for sample in families["pelorus_http_circuit_transitions"].samples
+    } == {OPEN: 2, HALF_OPEN: 2, CLOSED: 1}
+    assert {
+        sample.labels["state"]: sample.value
+        for sample in families["pelorus_http_circuit_state"].samples
+    } == {CLOSED: 1.0, OPEN: 0.0, HALF_OPEN: 0.0}
+
+
+def test_only_one_trial_call_is_let_through():
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=0)
+    breaker = breakers.get("git.example.com")
+    breaker.record_failure()
+
+    breaker.check()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    breaker.record_success()
+    breaker.check()
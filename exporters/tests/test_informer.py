@@ -0,0 +1,287 @@
+import json
+import threading
+import time
+from typing import Optional
+from unittest.mock import NonCallableMock
+
+import pytest
+from kubernetes.dynamic.resource import ResourceInstance
+
+import pelorus
+from provider_common.informer import (
+    BY_APP,
+    BY_NAMESPACE,
+    BY_OWNER_UID,
+    Informer,
+    WatchCache,
+    _WatchExpired,
+    label_index,
+    namespace_index,
+    owner_uid_index,
+)
+from provider_common.openshift import get_and_log_namespaces, get_running_pods
+
+APP_LABEL = pelorus.DEFAULT_APP_LABEL
+
+
+def pod(
+    uid: str, namespace: str, app: Optional[str], owner: Optional[str] = None
+) -> dict:
+    metadata = dict(name=uid, uid=uid, namespace=namespace, resourceVersion="1")
+    if app:
+        metadata["labels"] = {APP_LABEL: app}
+    if owner:
+        metadata["ownerReferences"] = [
+            dict(kind="ReplicaSet", name=owner, uid=owner, apiVersion="apps/v1")
+        ]
+    return dict(kind="Pod", apiVersion="v1", metadata=metadata)
+
+
+def pod_list(resource_version: str, *pods: dict) -> ResourceInstance:
+    return ResourceInstance(
+        None,
+        dict(
+            kind="PodList",
+            apiVersion="v1",
+            metadata=dict(resourceVersion=resource_version),
+            items=list(pods),
+        ),
+    )
+
+
+class FakeWatchResponse:
+    def __init__(self, *events: dict):
+        self.lines = [json.dumps(event).encode() + b"\n" for event in events]
+
+    def stream(self, amt=None, decode_content=False):
+        yield from self.lines
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class IdleWatchResponse(FakeWatchResponse):
+    "A watch without events, that stays open until `done` is set."
+
+    def __init__(self, done: threading.Event):
+        super().__init__()
+        self.done = done
+
+    def stream(self, amt=None, decode_content=False):
+        self.done.wait(5)
+        yield from ()
+
+
+def make_informer(resource) -> Informer:
+    return Informer(
+        resource,
+        label_selector=APP_LABEL,
+        indexers={
+            BY_NAMESPACE: namespace_index,
+            BY_OWNER_UID: owner_uid_index,
+            BY_APP: label_index(APP_LABEL),
+        },
+    )
+
+
+def uids(objects) -> set[str]:
+    return {obj.metadata.uid for obj in objects}
+
+
+def test_relist_fills_store_and_indexes():
+    resource = NonCallableMock(kind="Pod")
+    resource.get.return_value = pod_list(
+        "10",
+        pod("a", "foo_ns", "foo", owner="rs-1"),
+        pod("b", "foo_ns", "bar", owner="rs-1"),
+        pod("c", "bar_ns", "foo"),
+    )
+    informer = make_informer(resource)
+
+    informer.relist()
+
+    assert informer.has_synced
+    assert informer.resource_version == "10"
+    assert uids(informer.list()) == {"a", "b", "c"}
+    assert informer.get("c").metadata.namespace == "bar_ns"
+    assert uids(informer.by_index(BY_NAMESPACE, "foo_ns")) == {"a", "b"}
+    assert uids(informer.by_index(BY_OWNER_UID, "rs-1")) == {"a", "b"}
+    assert uids(informer.by_index(BY_APP, ("foo_ns", "foo"))) == {"a"}
+    assert informer.by_index(BY_APP, ("foo_ns", "missing")) == []
+
+
+def test_events_update_store_and_indexes():
+    resource = NonCallableMock(kind="Pod")
+    resource.get.return_value = pod_list("10", pod("a", "foo_ns", "foo"))
+    informer = make_informer(resource)
+    informer.relist()
+
+    informer.apply(dict(type="ADDED", object=pod("b", "foo_ns", "foo")))
+    moved = pod("a", "foo_ns", "bar")
+    moved["metadata"]["resourceVersion"] = "12"
+    informer.apply(dict(type="MODIFIED", object=moved))
+
+    assert informer.resource_version == "12"
+    assert uids(informer.by_index(BY_APP, ("foo_ns", "foo"))) == {"b"}
+    assert uids(informer.by_index(BY_APP, ("foo_ns", "bar"))) == {"a"}
+
+    informer.apply(dict(type="DELETED", object=pod("b", "foo_ns", "foo")))
+    assert uids(informer.list()) == {"a"}
+    assert ("foo_ns", "foo") not in informer.index_keys(BY_APP)
+
+    bookmark = dict(kind="Pod", apiVersion="v1", metadata=dict(resourceVersion="20"))
+    informer.apply(dict(type="BOOKMARK", object=bookmark))
+    assert informer.resource_version == "20"
+    assert uids(informer.list()) == {"a"}
+
+
+def test_expired_watch_raises():
+    informer = make_informer(NonCallableMock(kind="Pod"))
+
+    with pytest.raises(_WatchExpired):
+        informer.apply(
+            dict(type="ERROR", object=dict(code=410, reason="Expired", message="old"))
+        )
+
+
+def test_watch_resumes_from_resource_version_with_bookmarks():
+    resource = NonCallableMock(kind="Pod")
+    resource.get.return_value = pod_list("10")
+    informer = make_informer(resource)
+    informer.relist()
+
+    resource.get.return_value = FakeWatchResponse(
+        dict(type="ADDED", object=pod("a", "foo_ns", "foo"))
+    )
+    informer.watch()
+
+    kwargs = resource.get.call_args.kwargs
+    assert kwargs["watch"] is True
+    assert kwargs["resource_version"] == "10"
+    assert ("allowWatchBookmarks", "true") in kwargs["query_params"]
+    assert uids(informer.list()) == {"a"}
+
+
+def test_relists_when_watch_expires():
+    resource = NonCallableMock(kind="Pod")
+    informer = make_informer(resource)
+    relisted = threading.Event()
+    responses = iter(
+        [
+            pod_list("10", pod("a", "foo_ns", "foo")),
+            FakeWatchResponse(
+                dict(type="ERROR", object=dict(code=410, reason="Expired"))
+            ),
+            pod_list("30", pod("b", "foo_ns", "foo")),
+        ]
+    )
+
+    def get(**kwargs):
+        try:
+            return next(responses)
+        except StopIteration:
+            relisted.set()
+            informer._stop_event.set()
+            return FakeWatchResponse()
+
+    resource.get.side_effect = get
+    informer.start()
+    try:
+        assert relisted.wait(5)
+    finally:
+        informer.stop(timeout=5)
+
+    assert informer.resource_version == "30"
+    assert uids(informer.list()) == {"b"}
+
+
+def serve(resource: NonCallableMock, listed: ResourceInstance, done: threading.Event):
+    resource.get.side_effect = lambda **kwargs: (
+        IdleWatchResponse(done) if kwargs.get("watch") else listed
+    )
+
+
+def test_collectors_read_from_cache():
+    done = threading.Event()
+    pods = NonCallableMock(kind="Pod")
+    serve(
+        pods,
+        pod_list(
+            "10",
+            pod("a", "foo_ns", "foo", owner="rs-1"),
+            pod("b", "bar_ns", "foo", owner="rs-2"),
+            pod("c", "foo_ns", "foo"),
+        ),
+        done,
+    )
+    namespaces = NonCallableMock(kind="Namespace")
+    serve(
+        namespaces,
+        ResourceInstance(
+            None,
+            dict(
+                kind="NamespaceList",
+                apiVersion="v1",
+                metadata=dict(resourceVersion="5"),
+                items=[dict(metadata=dict(name="foo_ns", uid="ns-1"))],
+            ),
+        ),
+        done,
+    )
+    client = NonCallableMock()
+    client.resources.get.side_effect = lambda api_version, kind: dict(
+        Pod=pods, Namespace=namespaces
+    )[kind]
+
+    cache = WatchCache(client)
+    try:
+        assert uids(get_running_pods(client, {"foo_ns"}, APP_LABEL, cache=cache)) == {
+            "a"
+        }
+        assert get_and_log_namespaces(client, set(), "", cache) == {"foo_ns"}
+        # a second collection doesn't list again
+        get_running_pods(client, {"foo_ns"}, APP_LABEL, cache=cache)
+        list_calls = [c for c in pods.get.call_args_list if "watch" not in c.kwargs]
+        assert len(list_calls) == 1
+    finally:
+        done.set()
+        cache.stop(timeout=5)
+
+
+def test_unsynced_informer_is_only_waited_for_once():
+    done, listable = threading.Event(), threading.Event()
+    pods = NonCallableMock(kind="Pod")
+
+    def get(**kwargs):
+        if kwargs.get("watch"):
+            return IdleWatchResponse(done)
+        listable.wait(5)
+        return pod_list("10", pod("a", "foo_ns", "foo"))
+
+    pods.get.side_effect = get
+    client = NonCallableMock()
+    client.resources.get.return_value = pods
+
+    cache = WatchCache(client, sync_timeout=0.2)
+    try:
+        started = time.monotonic()
+        assert cache.informer("v1", "Pod") is None
+        assert time.monotonic() - started >= 0.2
+        # later lookups fall back right away while the informer keeps syncing
+        started = time.monotonic()
+        assert cache.informer("v1", "Pod") is None
+        assert time.monotonic() - started < 0.1
+
+        listable.set()
+        deadline = time.monotonic() + 5
+        while (informer := cache.informer("v1", "Pod")) is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert uids(informer.list()) == {"a"}
+    finally:
+        listable.set()
+        done.set()
+        cache.stop(timeout=5)
@@ -0,0 +1,100 @@
+from typing import Iterable
+from unittest.mock import patch
+
+import pytest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector, CollectorRegistry
+
+from pelorus.runtime import BackgroundCollector, register
+
+
+class CountingCollector(Collector):
+    def __init__(self):
+        self.calls = 0
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        self.calls += 1
+        metric = GaugeMetricFamily("calls", "Number of collections", labels=[])
+        metric.add_metric([], self.calls)
+        yield metric
+
+
+class FailingCollector(Collector):
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        raise RuntimeError("upstream unavailable")
+
+
+def test_scrape_is_served_from_snapshot():
+    inner = CountingCollector()
+    background = BackgroundCollector(inner)
+    registry = CollectorRegistry()
+    registry.register(background)
+
+    # registering does not collect, and nothing is served before the first refresh
+    assert inner.calls == 0
+    assert registry.get_sample_value("calls") is None
+
+    background.refresh()
+
+    for _ in range(3):
+        assert registry.get_sample_value("calls") == 1
+    assert inner.calls == 1
+    assert registry.get_sample_value("pelorus_collection_age_seconds") >= 0
+    assert registry.get_sample_value("pelorus_collection_duration_seconds") >= 0
+
+
+def test_failed_refresh_keeps_previous_snapshot():
+    inner = CountingCollector()
+    background = BackgroundCollector(inner)
+    background.refresh()
+
+    with patch.object(inner, "collect", side_effect=RuntimeError("boom")):
+        background.refresh()
+
+    registry = CollectorRegistry()
+    registry.register(background)
+    assert registry.get_sample_value("calls") == 1
+    assert registry.get_sample_value("pelorus_collection_failures_total") == 1
+
+
+def test_failing_collector_serves_nothing():
+    background = BackgroundCollector(FailingCollector())
+    background.refresh()
+
+    registry = CollectorRegistry()
+    registry.register(background)
+    assert registry.get_sample_value("pelorus_collection_failures_total") == 1
+    assert registry.get_sample_value("pelorus_collection_age_seconds") is None
+
+
+def test_background_thread_refreshes():
+    inner = CountingCollector()
+    background = BackgroundCollector(inner, interval=0.01)
+    background.start()
+    try:
+        for _ in range(100):
+            if inner.calls >= 2:
+                break
+            background._stop_event.wait(0.01)
+    finally:
+        background.stop(timeout=1)
+
+    assert inner.calls >= 2
+    assert background.snapshot is not None
+
+
+@pytest.mark.parametrize(
+    "interval, expected_type",
+    [("0", CountingCollector), ("3600", BackgroundCollector)],
+)
+def test_register_uses_refresh_interval(monkeypatch, interval, expected_type):
+    monkeypatch.setenv("REFRESH_INTERVAL", interval)
+    inner = CountingCollector()
+    registry = CollectorRegistry()
+
+    registered = register(inner, registry)
+    try:
+        assert isinstance(registered, expected_type)
+    finally:
+        if isinstance(registered, BackgroundCollector):
+            registered.stop(timeout=1)
@@ -1,14 +1,21 @@
+import gzip
+import json
 import os
 
 import pytest
+from kubernetes import client, config
 
 import pelorus
 from pelorus.utils import (
     BadAttributePathError,
     collect_bad_attribute_path_error,
     get_env_var,
+    get_k8s_client,
     get_nested,
+    paginate_resource,
 )
+from tests.local_server import LocalServer, QuietHandler, server_fixture
+from tests.openshift_mocks import PagedResource
 
 ROOT = dict(foo=dict(bar=dict()))
 PATH = "foo.bar.baz.quux"
@@ -104,3 +111,78 @@ def test_env_var_default():
     assert (
         get_env_var("PELORUS_TEST_ENV_VAR_DEFAULT", "default_value") == "default_value"
     )
+
+
+def test_paginate_resource_follows_continue_tokens():
+    resource = PagedResource([dict(metadata=dict(name=f"item-{i}")) for i in range(5)])
+
+    items = paginate_resource(resource, dict(label_selector="app"), limit=2)
+
+    assert [item.metadata.name for item in items] == [f"item-{i}" for i in range(5)]
+    assert resource.client.calls == [
+        ({"label_selector": "app"}, None),
+        ({"label_selector": "app"}, "2"),
+        ({"label_selector": "app"}, "4"),
+    ]
+
+
+def test_paginate_resource_requests_pages_as_items_are_consumed():
+    resource = PagedResource([dict(metadata=dict(name=f"item-{i}")) for i in range(5)])
+
+    items = paginate_resource(resource, {}, limit=2)
+    next(items)
+    next(items)
+
+    assert len(resource.client.calls) == 1
+    next(items)
+    assert len(resource.client.calls) == 2
+
+
+class GzipServer(LocalServer):
+    "Answers with a JSON list, compressed if the client accepts gzip."
+
+    body = json.dumps(dict(kind="PodList", items=[dict(name="pod")] * 100)).encode()
+
+    def __init__(self):
+        self.accept_encodings: list[str] = []
+        super().__init__(self._handler())
+
+    def _handler(self):
+        server = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                accept_encoding = self.headers.get("Accept-Encoding", "")
+                server.accept_encodings.append(accept_encoding)
+                body = server.body
+                self.send_response(200)
+                if "gzip" in accept_encoding:
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+api_server = server_fixture(GzipServer)
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_k8s_client_requests_compressed_responses(
+    api_server, monkeypatch: pytest.MonkeyPatch, compress: bool
+):
+    api_client = client.ApiClient(client.Configuration(host=api_server.url))
+    monkeypatch.setattr(config, "new_client_from_config", lambda: api_client)
+    # skip the discovery of the DynamicClient
+    monkeypatch.setattr(pelorus.utils, "DynamicClient", lambda api_client: api_client)
+
+    assert get_k8s_client(compress=compress) is api_client
+    response = api_client.call_api(
+        "/api/v1/pods", "GET", _preload_content=False, _return_http_data_only=True
+    )
+
+    assert json.loads(response.data) == json.loads(api_server.body)
+    assert ("gzip" in api_server.accept_encodings[0]) == compress